@@ -0,0 +1,383 @@
+import dataclasses
+import json
+import logging
+import math
+import multiprocessing
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable
+
+import polars as pl
+import synthetic
+from telethon.tl.types import Message
+
+import collegram
+from collegram.fake import SyntheticSpec, read_tl_object
+from collegram.messages import ExtendedMessage
+
+logger = logging.getLogger(__name__)
+# `ru_maxrss` is in bytes on macOS, in KiB elsewhere.
+MAXRSS_UNIT = 1 if sys.platform == "darwin" else 2**10
+
+
+@dataclass(frozen=True)
+class Stage:
+    """
+    A stage of the offline processing to benchmark: `setup` prepares fresh arguments
+    for `run`, untimed, as most stages mutate their inputs, and `run` returns the
+    number of `unit`s it processed.
+    """
+
+    name: str
+    unit: str
+    setup: Callable[[], tuple]
+    run: Callable[..., int]
+
+
+def measure(
+    stage: Stage,
+    nr_repeats: int = 3,
+    min_total_seconds: float = 1.0,
+    max_repeats: int = 100,
+) -> dict:
+    """
+    Measure the throughput of `stage` over its fastest run. It is run at least
+    `nr_repeats` times, and more, up to `max_repeats`, until runs add up to
+    `min_total_seconds`, for short stages to be measured reliably.
+    """
+    seconds = math.inf
+    total_seconds = 0.0
+    i = 0
+    while i < nr_repeats or (total_seconds < min_total_seconds and i < max_repeats):
+        args = stage.setup()
+        start = time.perf_counter()
+        nr_items = stage.run(*args)
+        run_seconds = time.perf_counter() - start
+        seconds = min(seconds, run_seconds)
+        total_seconds += run_seconds
+        i += 1
+    return {
+        "unit": stage.unit,
+        "nr_items": nr_items,
+        "seconds": seconds,
+        "throughput": nr_items / seconds,
+    }
+
+
+def reset_peak_rss():
+    """
+    Reset the peak resident set size of the process to its current one. This is only
+    supported on Linux, elsewhere the peak keeps accounting for earlier allocations.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def get_run_peak_rss(
+    stage_name: str,
+    paths: collegram.ProjectPaths,
+    channels: list[collegram.fake.FakeChannel],
+    anon_ids: list[str],
+) -> int:
+    """
+    Get by how much running stage `stage_name` raises the peak resident set size of the
+    process, in bytes. Meant to be called in a fresh process.
+    """
+    stage = next(
+        s for s in get_stages(paths, channels, anon_ids) if s.name == stage_name
+    )
+    args = stage.setup()
+    reset_peak_rss()
+    start_maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    stage.run(*args)
+    end_maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return (end_maxrss - start_maxrss) * MAXRSS_UNIT
+
+
+def measure_peak_memory(
+    stage_name: str,
+    paths: collegram.ProjectPaths,
+    channels: list[collegram.fake.FakeChannel],
+    anon_ids: list[str],
+) -> float:
+    """
+    Measure the peak memory of stage `stage_name`, in MiB, from the peak resident set
+    size of a fresh process running it, so that unlike with `tracemalloc`, it includes
+    the buffers allocated by Polars and Arrow.
+    """
+    # Forking a process in which Polars' thread pool is running may deadlock, and
+    # processes spawned from this one would inherit its peak, so fork from a server
+    # process instead.
+    with ProcessPoolExecutor(
+        max_workers=1, mp_context=multiprocessing.get_context("forkserver")
+    ) as executor:
+        peak = executor.submit(
+            get_run_peak_rss, stage_name, paths, channels, anon_ids
+        ).result()
+    return peak / 2**20
+
+
+def find_regressions(
+    results: dict, baselines: dict, tolerance: float, min_peak_diff_mib: float = 1.0
+) -> list[str]:
+    """
+    Compare `results` to `baselines` with a relative `tolerance`. Peak memory must also
+    have grown by at least `min_peak_diff_mib`, as stages allocating next to nothing
+    would otherwise be reported for any small difference.
+    """
+    regressions = []
+    for name, res in results.items():
+        base = baselines.get(name)
+        if base is None:
+            continue
+        if res["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(
+                f"{name}: throughput of {res['throughput']:.0f} {res['unit']}/s, "
+                f"baseline {base['throughput']:.0f}"
+            )
+        peak_diff = res["peak_mib"] - base["peak_mib"]
+        if peak_diff > base["peak_mib"] * tolerance and peak_diff > min_peak_diff_mib:
+            regressions.append(
+                f"{name}: peak memory of {res['peak_mib']:.1f} MiB, "
+                f"baseline {base['peak_mib']:.1f}"
+            )
+    return regressions
+
+
+def get_stages(
+    paths: collegram.ProjectPaths,
+    channels: list[collegram.fake.FakeChannel],
+    anon_ids: list[str],
+) -> list[Stage]:
+    tl_messages = [m for c in channels for m in c.messages_data]
+    raw_messages = b"".join(
+        Path(p).read_bytes() for p in sorted(paths.messages_dir.glob("*/*.jsonl"))
+    )
+    channels_json = [
+        json.dumps(collegram.channels.load(anon_id, paths)) for anon_id in anon_ids
+    ]
+    media_save_path = paths.raw_data / "media"
+
+    def get_anonymiser():
+        return collegram.utils.HMAC_anonymiser(key=synthetic.HMAC_KEY)
+
+    def get_messages():
+        return [read_tl_object(m) for m in tl_messages]
+
+    def get_extended_messages():
+        return [
+            ExtendedMessage.from_message(m)
+            for m in get_messages()
+            if isinstance(m, Message)
+        ]
+
+    def get_preprocessed_messages():
+        anonymiser = get_anonymiser()
+        return [
+            collegram.messages.preprocess(
+                m, set(), anonymiser.anonymise, media_save_path
+            )
+            for m in get_messages()
+        ]
+
+    def get_decoded_messages():
+        return [
+            m
+            for m in collegram.json.MESSAGE_JSON_DECODER.decode_lines(raw_messages)
+            if isinstance(m, collegram.json.Message)
+        ]
+
+    def clear(*dataset_paths):
+        for p in dataset_paths:
+            shutil.rmtree(p, ignore_errors=True)
+
+    def setup_convert():
+        clear(
+            paths.messages_dataset,
+            paths.service_messages_dataset,
+            paths.urls_dataset,
+            paths.channel_domains_dataset,
+        )
+        return (anon_ids,)
+
+    def setup_upsert_channels():
+        clear(paths.channels_dataset, paths.memberships_dataset)
+        return (collegram.parquet.group_by_partition(anon_ids),)
+
+    def setup_upsert_users():
+        setup_upsert_channels()
+        users_dfs = [
+            collegram.parquet.upsert_channels_partition(p, paths).result
+            for p in collegram.parquet.group_by_partition(anon_ids)
+        ]
+        clear(paths.users_dataset)
+        return (pl.concat(users_dfs, how="diagonal_relaxed"),)
+
+    def run_preprocess(messages, anonymiser):
+        for m in messages:
+            collegram.messages.preprocess(
+                m, set(), anonymiser.anonymise, media_save_path
+            )
+        return len(messages)
+
+    def run_preprocess_entities(messages, anonymiser):
+        for m in messages:
+            collegram.messages.preprocess_entities(m, anonymiser.anonymise)
+        return len(messages)
+
+    def run_anonymise_metadata(messages, anonymiser):
+        for m in messages:
+            collegram.messages.anonymise_metadata(m, set(), anonymiser.anonymise)
+        return len(messages)
+
+    def run_anonymise(ids, anonymiser):
+        for i in ids:
+            anonymiser.anonymise(i)
+        return len(ids)
+
+    def run_encode(messages):
+        for m in messages:
+            collegram.json.encode_tl_object(m)
+        return len(messages)
+
+    def run_decode(raw):
+        return len(collegram.json.MESSAGE_JSON_DECODER.decode_lines(raw))
+
+    def run_messages_to_dict(messages):
+        collegram.json.messages_to_dict(messages)
+        return len(messages)
+
+    def run_flatten_dict(chans_json):
+        for c in chans_json:
+            collegram.channels.flatten_dict(json.loads(c))
+        return len(chans_json)
+
+    def run_convert(anon_ids):
+        return sum(
+            collegram.parquet.convert_channel_messages(i, paths).nr_rows
+            for i in anon_ids
+        )
+
+    def run_upsert_channels(partitions):
+        return sum(
+            collegram.parquet.upsert_channels_partition(p, paths).nr_rows
+            for p in partitions
+        )
+
+    def run_upsert_users(users_df):
+        collegram.parquet.upsert_users(users_df, paths)
+        return users_df.height
+
+    ids = [str(i) for i in range(10**9, 10**9 + len(tl_messages))]
+    return [
+        Stage("anonymise", "IDs", lambda: (ids, get_anonymiser()), run_anonymise),
+        Stage(
+            "preprocess",
+            "messages",
+            lambda: (get_messages(), get_anonymiser()),
+            run_preprocess,
+        ),
+        Stage(
+            "preprocess_entities",
+            "messages",
+            lambda: (get_extended_messages(), get_anonymiser()),
+            run_preprocess_entities,
+        ),
+        Stage(
+            "anonymise_metadata",
+            "messages",
+            lambda: (get_extended_messages(), get_anonymiser()),
+            run_anonymise_metadata,
+        ),
+        Stage("encode", "messages", lambda: (get_preprocessed_messages(),), run_encode),
+        Stage("decode", "messages", lambda: (raw_messages,), run_decode),
+        Stage(
+            "messages_to_dict",
+            "messages",
+            lambda: (get_decoded_messages(),),
+            run_messages_to_dict,
+        ),
+        Stage("flatten_dict", "channels", lambda: (channels_json,), run_flatten_dict),
+        Stage("convert_channel_messages", "rows", setup_convert, run_convert),
+        Stage(
+            "upsert_channels_partition",
+            "channels",
+            setup_upsert_channels,
+            run_upsert_channels,
+        ),
+        Stage("upsert_users", "users", setup_upsert_users, run_upsert_users),
+    ]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    # Sizes of the synthetic data, per channel and message.
+    spec = SyntheticSpec(
+        nr_channels=20,
+        nr_messages=2000,
+        nr_participants=200,
+        nr_entities=3,
+        nr_reactions=4,
+        forward_share=0.2,
+    )
+    seed = 0
+    nr_repeats = 3
+    # Relative decrease in throughput, or increase in peak memory, from the baselines
+    # above which a stage is reported as a regression.
+    tolerance = 0.2
+    # Baselines depend on the machine, so they are not versioned: they are recorded on
+    # the first run, and can be updated, for instance after an optimisation.
+    update_baselines = False
+    baselines_path = Path(__file__).parent / "baselines.json"
+    # Stages to run, all if None.
+    stage_names = None
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = collegram.ProjectPaths(data=Path(tmp_dir))
+        start = time.perf_counter()
+        channels, anon_ids = synthetic.write_raw_project(paths, spec, seed=seed)
+        logger.info(
+            f"Generated {len(channels)} channels of {spec.nr_messages} messages in "
+            f"{time.perf_counter() - start:.1f}s"
+        )
+        results = {}
+        for stage in get_stages(paths, channels, anon_ids):
+            if stage_names is not None and stage.name not in stage_names:
+                continue
+            res = measure(stage, nr_repeats=nr_repeats)
+            res["peak_mib"] = measure_peak_memory(stage.name, paths, channels, anon_ids)
+            results[stage.name] = res
+            logger.info(
+                f"{stage.name:<28}{res['throughput']:>12.0f} {res['unit']}/s"
+                f"{res['peak_mib']:>10.1f} MiB peak"
+            )
+
+    spec_d = json.loads(json.dumps(dataclasses.asdict(spec), default=str))
+    baselines = {}
+    if baselines_path.exists():
+        baselines_d = json.loads(baselines_path.read_text())
+        if baselines_d["spec"] == spec_d:
+            baselines = baselines_d["stages"]
+        else:
+            logger.warning("Baselines were measured on different sizes, not comparing")
+
+    if update_baselines or not baselines_path.exists():
+        baselines_path.write_text(
+            json.dumps({"spec": spec_d, "stages": results}, indent=2) + "\n"
+        )
+        logger.info(f"Saved baselines to {baselines_path}")
+    else:
+        regressions = find_regressions(results, baselines, tolerance)
+        for r in regressions:
+            logger.error(f"Regression in {r}")
+        if regressions:
+            sys.exit(1)
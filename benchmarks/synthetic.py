@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import datetime
+import json
+from typing import TYPE_CHECKING
+
+import collegram
+import collegram.channels as cgc
+from collegram.fake import FakeChannel, SyntheticSpec, make_network
+
+if TYPE_CHECKING:
+    from collegram.paths import ProjectPaths
+
+# Fixed, so that synthetic data is the same across runs.
+HMAC_KEY = "00" * 32
+KEY_NAME = "benchmark"
+
+
+def get_month_start(dt: datetime.datetime) -> datetime.datetime:
+    return dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def get_next_month_start(dt: datetime.datetime) -> datetime.datetime:
+    return get_month_start(get_month_start(dt) + datetime.timedelta(days=32))
+
+
+def save_channel(channel: FakeChannel, project_paths: ProjectPaths) -> str:
+    """
+    Save the raw data of `channel` like `scripts/channel_expansion.py` does: its
+    anonymised full data, with participants, recommendations and content counts, and
+    its preprocessed messages in monthly JSONL files. Return its anonymised ID.
+    """
+    anonymiser = collegram.utils.HMAC_anonymiser(key=HMAC_KEY)
+    anon_id = anonymiser.anonymise(channel.id)
+    chan_paths = collegram.paths.ChannelPaths(anon_id, project_paths)
+    anonymiser.save_path = chan_paths.anon_map
+
+    full_d = json.loads(channel.get_full().to_json())
+    full_d["participants"] = [
+        json.loads(u.to_json()) for u in channel.get_participants()
+    ]
+    full_d["recommended_channels"] = channel.recommended
+    for content_type, f in collegram.messages.MESSAGE_CONTENT_TYPE_MAP.items():
+        full_d[f"{content_type}_count"] = channel.filter_counts[type(f)]
+    full_d["last_queried_at"] = datetime.datetime.now(datetime.UTC).isoformat()
+    full_d = cgc.anon_full_dict(full_d, anonymiser)
+
+    forwards_set = set()
+    chan_paths.messages.mkdir(parents=True, exist_ok=True)
+    media_save_path = project_paths.raw_data / "media"
+    f = None
+    bin_end = None
+    try:
+        for i in range(len(channel.message_ids)):
+            m = collegram.fake.read_tl_object(channel.messages_data[i])
+            if bin_end is None or m.date >= bin_end:
+                if f is not None:
+                    f.close()
+                bin_start = get_month_start(m.date)
+                bin_end = get_next_month_start(m.date)
+                f = open(
+                    chan_paths.messages
+                    / f"{bin_start.date()}_to_{bin_end.date()}.jsonl",
+                    "wb",
+                )
+            preprocessed_m = collegram.messages.preprocess(
+                m, forwards_set, anonymiser.anonymise, media_save_path
+            )
+            f.write(collegram.json.encode_tl_object(preprocessed_m))
+            f.write(b"\n")
+    finally:
+        if f is not None:
+            f.close()
+
+    full_d["forwards_from"] = [anonymiser.anonymise(c) for c in forwards_set]
+    anonymiser.save_map()
+    cgc.save(full_d, project_paths, KEY_NAME)
+    return anon_id
+
+
+def write_raw_project(
+    project_paths: ProjectPaths, spec: SyntheticSpec, seed: int = 0
+) -> tuple[list[FakeChannel], list[str]]:
+    """
+    Write the raw data of a synthetic network of channels following `spec` to
+    `project_paths`, matching the schema of the data saved by the crawl. Return the
+    channels and their anonymised IDs.
+    """
+    channels = make_network(spec, seed=seed)
+    anon_ids = [save_channel(c, project_paths) for c in channels]
+    return channels, anon_ids
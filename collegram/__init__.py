@@ -1,6 +1,25 @@
 import logging
 
-from . import channels, client, json, media, messages, paths, text, users, utils
+from . import (
+    channels,
+    client,
+    dataset,
+    fake,
+    fulltext,
+    graph,
+    json,
+    media,
+    messages,
+    metrics,
+    parquet,
+    paths,
+    search,
+    store,
+    text,
+    urls,
+    users,
+    utils,
+)
 from .paths import ChannelPaths, ProjectPaths
 from .utils import HMAC_anonymiser, UniquePriorityQueue, get_last_modif_time
 
@@ -10,12 +29,21 @@ __all__ = [
     "channels",
     "client",
     "messages",
+    "metrics",
     "media",
     "users",
     "paths",
     "utils",
     "json",
+    "dataset",
+    "fake",
+    "fulltext",
+    "graph",
+    "parquet",
+    "search",
+    "store",
     "text",
+    "urls",
     "ChannelPaths",
     "ProjectPaths",
     "HMAC_anonymiser",
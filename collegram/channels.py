@@ -1,24 +1,22 @@
 from __future__ import annotations
 
 import datetime
+import functools
 import inspect
 import json
 import logging
-import re
-import time
 import typing
+from dataclasses import dataclass, field
 
 import polars as pl
 from telethon.errors import (
     ChannelInvalidError,
     ChannelPrivateError,
-    UsernameInvalidError,
 )
 from telethon.tl.functions.channels import (
     GetChannelRecommendationsRequest,
     GetFullChannelRequest,
 )
-from telethon.tl.functions.contacts import SearchRequest
 from telethon.tl.types import (
     Channel,
     ChannelFull,
@@ -30,13 +28,16 @@ from telethon.tl.types import (
 
 import collegram.json
 import collegram.messages
+import collegram.metrics
 import collegram.text
 import collegram.users
 from collegram.paths import ChannelPaths, ProjectPaths
+from collegram.store import PackedStore
 from collegram.utils import LOCAL_FS, HMAC_anonymiser
 
 if typing.TYPE_CHECKING:
     from pathlib import Path
+    from typing import Any, Iterable, Iterator
 
     from bidict import bidict
     from fsspec import AbstractFileSystem
@@ -51,48 +52,14 @@ if typing.TYPE_CHECKING:
 logger = logging.getLogger(__name__)
 
 
+@collegram.metrics.timed("telegram_request_seconds", request="query_bot")
 async def query_bot(client: TelegramClient, bot, cmd):
     async with client.conversation(bot, timeout=120) as conv:
         await conv.send_message(cmd)
         return await conv.get_response()
 
 
-def search_from_tgdb(client: TelegramClient, query, raise_on_daily_limit=True):
-    while True:
-        search_res = client.loop.run_until_complete(
-            query_bot(client, "tgdb_bot", f"/search {query}")
-        )
-        if "result" in search_res.message:
-            results = re.findall(r"@([a-zA-Z0-9_]+)", search_res.message)
-            break
-        elif "exhausted your daily free searches" in search_res.message:
-            if raise_on_daily_limit:
-                raise RuntimeError(search_res.message)
-            else:
-                time.sleep(24 * 3600)
-        else:
-            time.sleep(10)
-
-    id_access_hash_map = {}
-    for username in results:
-        try:
-            entity = get_input_peer(client, username)
-        except (ValueError, UsernameInvalidError, ChannelPrivateError):
-            continue
-        if hasattr(entity, "channel_id"):
-            id_access_hash_map[entity.channel_id] = entity.access_hash
-    return id_access_hash_map
-
-
-def search_from_api(client: TelegramClient, query, limit=100):
-    return {
-        c.id: c.access_hash
-        for c in client.loop.run_until_complete(
-            client(SearchRequest(q=query, limit=limit))
-        ).chats
-    }
-
-
+@collegram.metrics.timed("telegram_request_seconds", request="get_input_peer")
 def get_input_peer(
     client: TelegramClient,
     channel_id: str | int,
@@ -124,6 +91,7 @@ def get_input_peer(
     return input_entity
 
 
+@collegram.metrics.timed("telegram_request_seconds", request="get")
 def get(
     client: TelegramClient,
     channel: int | str,
@@ -140,6 +108,7 @@ def get(
             return
 
 
+@collegram.metrics.timed("get_full_seconds")
 def get_full(
     client: TelegramClient,
     project_paths: ProjectPaths,
@@ -182,9 +151,12 @@ def get_full(
             # This case only happens for firt seed, so we always pass on these.
             logger.error(f"Passed identifier {channel_id} refers to a user.")
         elif input_chan:
-            full_chat = client.loop.run_until_complete(
-                client(GetFullChannelRequest(channel=input_chan))
-            )
+            with collegram.metrics.REGISTRY.timer(
+                "telegram_request_seconds", request="GetFullChannelRequest"
+            ):
+                full_chat = client.loop.run_until_complete(
+                    client(GetFullChannelRequest(channel=input_chan))
+                )
             new_full_d = get_anoned_full_dict(full_chat, anonymiser)
             # To avoid overwriting data in channels for which we passed a username, try
             # to load once more here:
@@ -263,6 +235,9 @@ def content_count(client: TelegramClient, channel: TypeInputChannel, content_typ
     return collegram.messages.get_channel_messages_count(client, channel, f)
 
 
+@collegram.metrics.timed(
+    "telegram_request_seconds", request="GetChannelRecommendationsRequest"
+)
 def get_recommended(
     client: TelegramClient, channel: TypeInputChannel
 ) -> list[TypeChat]:
@@ -305,29 +280,43 @@ def get_matching_chat_from_full(
 def recover_fwd_from_msgs(
     messages_path: Path,
     fs: AbstractFileSystem = LOCAL_FS,
-) -> dict[int, dict]:
-    chans_fwd_msg = {}
-    messages_str_path = str(messages_path)
-    if fs.isdir(messages_str_path):
-        fpaths_iter = fs.glob(f"{messages_str_path}/*.jsonl")
-    elif fs.exists(messages_str_path):
-        fpaths_iter = [messages_str_path]
+    forwards_index_path: Path | None = None,
+) -> dict[str, dict]:
+    """
+    Get the channels forwarded from in the messages saved at `messages_path`, mapped to
+    an example forwarded message. If `forwards_index_path` is passed, the forwards index
+    is read if it exists, otherwise it is built from the messages and saved there.
+    """
+    if forwards_index_path is not None and fs.exists(str(forwards_index_path)):
+        fwd_sources = collegram.json.read_forwards_index(forwards_index_path, fs)
     else:
-        fpaths_iter = []
+        fwd_sources = {}
+        messages_str_path = str(messages_path)
+        if fs.isdir(messages_str_path):
+            fpaths_iter = fs.glob(f"{messages_str_path}/*.jsonl")
+        elif fs.exists(messages_str_path):
+            fpaths_iter = [messages_str_path]
+        else:
+            fpaths_iter = []
 
-    for p in fpaths_iter:
-        for m in collegram.json.yield_message(
-            p, fs, collegram.json.FAST_FORWARD_DECODER
-        ):
-            if m.fwd_from is not None:
-                from_chan_id = getattr(m.fwd_from.from_id, "channel_id", None)
-                if from_chan_id is not None:
-                    chans_fwd_msg[from_chan_id] = {"id": m.id}
-                    if m.reply_to is not None:
-                        chans_fwd_msg[from_chan_id]["reply_to"] = (
-                            m.reply_to.reply_to_msg_id
-                        )
+        for p in fpaths_iter:
+            for batch in collegram.json.yield_message_batches(
+                p, fs, collegram.json.FAST_FORWARD_DECODER
+            ):
+                for m in batch:
+                    collegram.messages.update_fwd_sources(fwd_sources, m)
+
+        # Written even without any forward, for the index not to be rebuilt next time.
+        if forwards_index_path is not None:
+            collegram.json.append_forwards_index(
+                fwd_sources, forwards_index_path, fs=fs
+            )
 
+    chans_fwd_msg = {}
+    for chan_id, fwd_source in fwd_sources.items():
+        chans_fwd_msg[chan_id] = {"id": fwd_source.id}
+        if fwd_source.reply_to is not None:
+            chans_fwd_msg[chan_id]["reply_to"] = fwd_source.reply_to
     return chans_fwd_msg
 
 
@@ -343,8 +332,9 @@ def fwd_from_msg_ids(
     lang_priorities: dict,
     private_chans_priority: int,
     fs: AbstractFileSystem = LOCAL_FS,
+    lang_cache: collegram.text.LanguageCache | None = None,
 ):
-    forwarded_channels = {}
+    fwd_full_chan_ds = {}
     for chan_id, m_d in chans_fwd_msg.items():
         fwd_full_chan_d = {}
         m = client.loop.run_until_complete(
@@ -382,16 +372,16 @@ def fwd_from_msg_ids(
         else:
             logger.error("forwarded message was deleted")
 
-        prio = get_explo_priority(
-            fwd_full_chan_d,
-            anonymiser,
-            parent_priority,
-            lang_detector,
-            lang_priorities,
-            private_chans_priority,
-        )
-        forwarded_channels[chan_id] = prio
-    return forwarded_channels
+        fwd_full_chan_ds[chan_id] = fwd_full_chan_d
+    return get_explo_priorities(
+        fwd_full_chan_ds,
+        anonymiser,
+        parent_priority,
+        lang_detector,
+        lang_priorities,
+        private_chans_priority,
+        lang_cache=lang_cache,
+    )
 
 
 def get_anoned_full_dict(full_chat: ChatFull, anonymiser: HMAC_anonymiser, safe=True):
@@ -434,6 +424,64 @@ def anon_full_dict(full_dict: dict, anonymiser: HMAC_anonymiser, safe=True):
     return full_dict
 
 
+# We eliminate channels with huge number of messages and very few participants.
+# Threshold set such that a channel with 100 participants can have up to 10 updates per
+# day.
+MAX_UPDATES_PER_PART_PER_DAY = 0.1
+# Some channels may be from a relevant language, but detection was just not conclusive,
+# so default shouldn't be too high.
+DEFAULT_LANG_PRIORITY = 100
+
+
+def get_updates_per_part_per_day(fwd_full_chan_d: dict) -> float:
+    full = fwd_full_chan_d["full_chat"]
+    chat = get_matching_chat_from_full(fwd_full_chan_d)
+    # This gives an overestimate of lifespan since the channel's last query time is
+    # necessarily before now, but doesn't matter much here since we want to avoid
+    # channels with `updates_per_part_per_day` at a certain order of magnitude.
+    lifespan = datetime.datetime.now(datetime.UTC) - datetime.datetime.fromisoformat(
+        chat["date"]
+    )
+    return full["pts"] / (1 + full["participants_count"] * (1 + lifespan.days))
+
+
+def get_explo_priorities(
+    fwd_full_chan_ds: dict[Any, dict],
+    anonymiser,
+    parent_priority: int,
+    lang_detector: LanguageDetector,
+    lang_priorities: dict,
+    private_chans_priority: int,
+    lang_cache: collegram.text.LanguageCache | None = None,
+) -> dict[Any, int]:
+    """
+    Get the exploration priorities of the channels whose full dicts are the values of
+    `fwd_full_chan_ds`, keyed like it. The languages of all the channels that need one
+    are detected in a single batch.
+    """
+    prios = {}
+    to_detect = {}
+    for key, fwd_full_chan_d in fwd_full_chan_ds.items():
+        if not fwd_full_chan_d:
+            prios[key] = private_chans_priority
+        elif (
+            get_updates_per_part_per_day(fwd_full_chan_d) > MAX_UPDATES_PER_PART_PER_DAY
+        ):
+            prios[key] = private_chans_priority - 1
+        else:
+            to_detect[key] = fwd_full_chan_d
+    langs = collegram.text.detect_chans_langs(
+        to_detect.values(), anonymiser.inverse_anon_map, lang_detector, lang_cache
+    )
+    for key, lang in zip(to_detect.keys(), langs):
+        lang_prio = lang_priorities.get(lang, DEFAULT_LANG_PRIORITY)
+        # lang_prio is both increment and multiplicative factor, thus if some language has
+        # prio value N times superior, after exploring N of other language, it'l' be this
+        # language's turn.
+        prios[key] = parent_priority + lang_prio
+    return {key: prios[key] for key in fwd_full_chan_ds.keys()}
+
+
 def get_explo_priority(
     fwd_full_chan_d: dict,
     anonymiser,
@@ -441,38 +489,96 @@ def get_explo_priority(
     lang_detector: LanguageDetector,
     lang_priorities: dict,
     private_chans_priority: int,
+    lang_cache: collegram.text.LanguageCache | None = None,
 ):
-    if fwd_full_chan_d:
-        full = fwd_full_chan_d["full_chat"]
-        chat = get_matching_chat_from_full(fwd_full_chan_d)
-        # This gives an overestimate of lifespan since the channel's last query time is
-        # necessarily before now, but doesn't matter much here since we want to avoid
-        # channels with `updates_per_part_per_day` at a certain order of magnitude.
-        lifespan = datetime.datetime.now(
-            datetime.UTC
-        ) - datetime.datetime.fromisoformat(chat["date"])
-        updates_per_part_per_day = full["pts"] / (
-            1 + full["participants_count"] * (1 + lifespan.days)
-        )
-        # We make following test to eliminate channels with huge number of messages and
-        # very few participants. Threshold set such that a channel with 100 participants
-        # can have up to 10 updates per day.
-        if updates_per_part_per_day > 0.1:
-            prio = private_chans_priority - 1
-        else:
-            lang = collegram.text.detect_chan_lang(
-                fwd_full_chan_d, anonymiser.inverse_anon_map, lang_detector
-            )
-            # Some channels may be from a relevant language, but detection was just not
-            # conclusive, so default shouldn't be too high.
-            lang_prio = lang_priorities.get(lang, 100)
-            # lang_prio is both increment and multiplicative factor, thus if some language has
-            # prio value N times superior, after exploring N of other language, it'l' be this
-            # language's turn.
-            prio = parent_priority + lang_prio
-    else:
-        prio = private_chans_priority
-    return prio
+    return get_explo_priorities(
+        {0: fwd_full_chan_d},
+        anonymiser,
+        parent_priority,
+        lang_detector,
+        lang_priorities,
+        private_chans_priority,
+        lang_cache=lang_cache,
+    )[0]
+
+
+@dataclass(frozen=True)
+class ExploScoring:
+    """
+    Rules to compute exploration priorities, the lower the sooner a channel is
+    explored, as in `get_explo_priorities`.
+    """
+
+    lang_priorities: dict[str, int] = field(default_factory=dict)
+    default_lang_priority: int = DEFAULT_LANG_PRIORITY
+    max_updates_per_part_per_day: float = MAX_UPDATES_PER_PART_PER_DAY
+    private_chans_priority: int = int(1e7)
+
+
+def add_langs(
+    chans_df: pl.DataFrame,
+    lang_detector: LanguageDetector,
+    lang_cache: collegram.text.LanguageCache | None = None,
+    anon_map_df: pl.DataFrame | None = None,
+) -> pl.DataFrame:
+    """
+    Add a `lang` column to a frame of channels with `title` and `about` columns, like
+    the channels dataset. Titles are anonymised there, so the original ones are taken
+    from `anon_map_df`, with columns `original` and `hash` as in the merged anonymisation
+    map, so that texts match the ones cached while exploring.
+    """
+    texts_df = chans_df.select(pl.col("title", "about").fill_null(""))
+    if anon_map_df is not None:
+        # Languages are attached back by position, so rows must keep their number and
+        # order.
+        texts_df = texts_df.join(
+            anon_map_df.unique("hash"),
+            left_on="title",
+            right_on="hash",
+            how="left",
+            maintain_order="left",
+        ).with_columns(title=pl.coalesce("original", "title"))
+    texts = texts_df.select(pl.concat_str("title", pl.lit(". "), "about"))
+    langs = collegram.text.detect_texts_langs(
+        texts.to_series().to_list(), lang_detector, lang_cache
+    )
+    return chans_df.with_columns(lang=pl.Series(langs, dtype=pl.Utf8))
+
+
+def score_channels(
+    chans: pl.LazyFrame | pl.DataFrame,
+    scoring: ExploScoring,
+    parent_priority: int | pl.Expr = 0,
+    now: datetime.datetime | None = None,
+) -> pl.LazyFrame:
+    """
+    Compute the exploration priorities of all channels in `chans` at once, like
+    `get_explo_priorities` does for the full dicts of candidates. `chans` has the
+    columns of the channels dataset, plus `lang`, without which all channels get the
+    default language priority.
+    """
+    lf = chans.lazy()
+    if "lang" not in lf.collect_schema().names():
+        lf = lf.with_columns(lang=pl.lit(None, dtype=pl.Utf8))
+    now = datetime.datetime.now(datetime.UTC) if now is None else now
+    lifespan_days = (pl.lit(now) - pl.col("date")).dt.total_days()
+    lang_prio = pl.col("lang").replace_strict(
+        scoring.lang_priorities,
+        default=scoring.default_lang_priority,
+        return_dtype=pl.Int64,
+    )
+    return lf.select(
+        "id",
+        "lang",
+        updates_per_part_per_day=pl.col("pts")
+        / (1 + pl.col("participants_count") * (1 + lifespan_days)),
+    ).with_columns(
+        priority=pl.when(pl.col("updates_per_part_per_day").is_null())
+        .then(scoring.private_chans_priority)
+        .when(pl.col("updates_per_part_per_day") > scoring.max_updates_per_part_per_day)
+        .then(scoring.private_chans_priority - 1)
+        .otherwise(parent_priority + lang_prio)
+    )
 
 
 def get_extended_save_data(
@@ -496,6 +602,7 @@ def get_extended_save_data(
     ]
 
     channel_save_data["recommended_channels"] = []
+    recommended_full_ds = {}
     for c in get_recommended(client, chat):
         # A priori, this `get_full` call is safe as `GetChannelRecommendationsRequest`
         # should only return public channels, and all these channels should be
@@ -510,12 +617,13 @@ def get_extended_save_data(
             channel=c,
         )
         new_anon.save_map()
-        if recommended_chans_prios is not None:
-            recommended_chans_prios[c.id] = get_explo_priority(
-                full_chat_d, anonymiser, **explo_prio_kwargs
-            )
+        recommended_full_ds[c.id] = full_chat_d
         channel_save_data["recommended_channels"].append(c.id)
     anonymiser.save_map()
+    if recommended_chans_prios is not None:
+        recommended_chans_prios.update(
+            get_explo_priorities(recommended_full_ds, anonymiser, **explo_prio_kwargs)
+        )
 
     for content_type, f in collegram.messages.MESSAGE_CONTENT_TYPE_MAP.items():
         count = collegram.messages.get_channel_messages_count(client, chat, f)
@@ -547,14 +655,36 @@ def save(
             ):
                 access_hashes[key_name] = chat_d["access_hash"]
                 chat_d["access_hashes"] = access_hashes
-    fs.mkdirs(str(channel_save_path.parent), exist_ok=True)
-    with fs.open(str(channel_save_path), "w") as f:
-        json.dump(chan_data, f)
+    store = get_store(project_paths, fs=fs)
+    if store is None:
+        fs.mkdirs(str(channel_save_path.parent), exist_ok=True)
+        with fs.open(str(channel_save_path), "w") as f:
+            json.dump(chan_data, f)
+    else:
+        store.put(anon_id, chan_data)
+    append_to_journal([anon_id], project_paths.channels_journal, fs=fs)
+
+
+def append_to_journal(
+    anon_ids: Iterable[str], journal_path: Path, fs: AbstractFileSystem = LOCAL_FS
+):
+    """
+    Record that the channels `anon_ids` changed, one ID per line, for conversions to
+    only process them.
+    """
+    lines = "".join(f"{anon_id}\n" for anon_id in anon_ids)
+    if lines:
+        fs.mkdirs(str(journal_path.parent), exist_ok=True)
+        with fs.open(str(journal_path), "a") as f:
+            f.write(lines)
 
 
 def load(
     anon_id: str, project_paths: ProjectPaths, fs: AbstractFileSystem = LOCAL_FS
 ) -> dict:
+    store = get_store(project_paths, fs=fs)
+    if store is not None:
+        return store.get(anon_id) or {}
     chan_paths = ChannelPaths(anon_id, project_paths)
     save_path = str(chan_paths.channel)
     full_chat_d = (
@@ -563,6 +693,56 @@ def load(
     return full_chat_d
 
 
+@functools.lru_cache
+def get_packed_store(root: Path, fs: AbstractFileSystem) -> PackedStore:
+    # Cached to keep the indices of shards in memory between calls.
+    return PackedStore(root, fs=fs)
+
+
+def get_store(
+    project_paths: ProjectPaths, fs: AbstractFileSystem = LOCAL_FS
+) -> PackedStore | None:
+    """
+    Get the store the full data of channels is packed in, or None if it is saved in
+    one file per channel.
+    """
+    if not project_paths.packed_channels:
+        return None
+    return get_packed_store(project_paths.channels_store, fs)
+
+
+def exists(
+    anon_id: str, project_paths: ProjectPaths, fs: AbstractFileSystem = LOCAL_FS
+) -> bool:
+    store = get_store(project_paths, fs=fs)
+    if store is not None:
+        return anon_id in store
+    return fs.exists(str(ChannelPaths(anon_id, project_paths).channel))
+
+
+def get_saved_at(
+    anon_id: str, project_paths: ProjectPaths, fs: AbstractFileSystem = LOCAL_FS
+) -> datetime.datetime | None:
+    store = get_store(project_paths, fs=fs)
+    if store is not None:
+        return store.get_saved_at(anon_id)
+    save_path = str(ChannelPaths(anon_id, project_paths).channel)
+    return fs.modified(save_path) if fs.exists(save_path) else None
+
+
+def yield_saved_ids(
+    project_paths: ProjectPaths, fs: AbstractFileSystem = LOCAL_FS
+) -> Iterator[str]:
+    """
+    Yield the anonymised IDs of all saved channels.
+    """
+    store = get_store(project_paths, fs=fs)
+    if store is not None:
+        yield from store.keys()
+    else:
+        yield from project_paths.yield_channel_ids(project_paths.channels_dir, fs=fs)
+
+
 DISCARDED_CHAN_FULL_FIELDS = (
     "_",
     "notify_settings",
@@ -691,8 +871,18 @@ def erase(
     """
     if fs.exists(channel_paths.anon_map):
         fs.rm(channel_paths.anon_map)
-    if fs.exists(channel_paths.channel):
-        fs.rm(channel_paths.channel)
+    anon_id = channel_paths.anon_channel_id
+    project_paths = channel_paths.project_paths
+    if exists(anon_id, project_paths, fs=fs):
+        store = get_store(project_paths, fs=fs)
+        if store is None:
+            fs.rm(channel_paths.channel)
+        else:
+            store.delete(anon_id)
+        # So that the channel is also removed from the channels dataset.
+        append_to_journal([anon_id], project_paths.channels_journal, fs=fs)
+    if fs.exists(channel_paths.forwards_index):
+        fs.rm(channel_paths.forwards_index)
     if fs.exists(channel_paths.messages):
         for p in fs.ls(channel_paths.messages):
             fs.rm(p)
@@ -0,0 +1,415 @@
+from __future__ import annotations
+
+import datetime
+import logging
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable
+
+import polars as pl
+from fsspec.implementations.local import LocalFileSystem
+
+import collegram.channels
+import collegram.json
+import collegram.parquet
+import collegram.urls
+import collegram.users
+from collegram.paths import ChannelPaths, ProjectPaths, get_prefix_partition
+from collegram.utils import LOCAL_FS
+
+if TYPE_CHECKING:
+    from fsspec import AbstractFileSystem
+
+logger = logging.getLogger(__name__)
+
+# Files written at different times may differ slightly in schema, so these are
+# unified to the one passed to the scans.
+SCAN_CAST_OPTIONS = pl.ScanCastOptions(
+    integer_cast="upcast",
+    float_cast="upcast",
+    datetime_cast=["nanosecond-downcast", "convert-timezone"],
+    missing_struct_fields="insert",
+    extra_struct_fields="ignore",
+)
+CHANNEL_HIVE_SCHEMA = {"channel_id": pl.Utf8, "month": pl.Utf8}
+
+
+def to_utc(dt: datetime.datetime | datetime.date) -> datetime.datetime:
+    if not isinstance(dt, datetime.datetime):
+        dt = datetime.datetime.combine(dt, datetime.time())
+    return dt if dt.tzinfo is not None else dt.replace(tzinfo=datetime.UTC)
+
+
+def get_bin_bounds(fpath: str | Path) -> tuple[datetime.datetime, datetime.datetime]:
+    """
+    Get the start and end dates of the bin saved at `fpath`, named like
+    "2024-01-01_to_2024-02-01.parquet".
+    """
+    start, end = Path(fpath).name.split(".")[0].split("_to_")
+    return to_utc(datetime.date.fromisoformat(start)), to_utc(
+        datetime.date.fromisoformat(end)
+    )
+
+
+def list_bin_files(
+    dataset_path: Path,
+    channel_ids: Iterable[str] | None = None,
+    start: datetime.datetime | None = None,
+    end: datetime.datetime | None = None,
+    fs: AbstractFileSystem = LOCAL_FS,
+) -> list[str]:
+    """
+    List the files of the dataset partitioned by channel and bin at `dataset_path` that
+    belong to channels `channel_ids`, if given, and to bins overlapping the interval
+    from `start` (included) to `end` (excluded).
+    """
+    if channel_ids is None:
+        patterns = [dataset_path / "channel_id=*" / "month=*" / "*.parquet"]
+    else:
+        patterns = [
+            dataset_path / f"channel_id={i}" / "month=*" / "*.parquet"
+            for i in channel_ids
+        ]
+    files = [f for p in patterns for f in fs.glob(str(p))]
+    return sorted(filter_bin_files(files, start=start, end=end))
+
+
+def filter_bin_files(
+    files: list[str],
+    start: datetime.datetime | None = None,
+    end: datetime.datetime | None = None,
+) -> list[str]:
+    """
+    Keep the `files` of bins overlapping the interval from `start` (included) to `end`
+    (excluded).
+    """
+    if start is None and end is None:
+        return files
+    start = to_utc(start) if start is not None else None
+    end = to_utc(end) if end is not None else None
+    return [
+        f
+        for f, (bin_start, bin_end) in zip(files, map(get_bin_bounds, files))
+        if (start is None or bin_end > start) and (end is None or bin_start < end)
+    ]
+
+
+def get_scan_sources(
+    files: list[str], fs: AbstractFileSystem = LOCAL_FS
+) -> tuple[list[str], dict | None]:
+    """
+    Get the sources and storage options with which Polars can scan `files` listed from
+    `fs`. Polars reads remote files with its own clients, so their paths are given
+    their protocol back, and the storage options of `fs` are passed on, which must thus
+    be ones Polars understands.
+    """
+    if isinstance(fs, LocalFileSystem):
+        return files, None
+    return [fs.unstrip_protocol(f) for f in files], dict(fs.storage_options)
+
+
+def scan_files(
+    files: list[str],
+    schema: dict,
+    hive_schema: dict | None = None,
+    fs: AbstractFileSystem = LOCAL_FS,
+) -> pl.LazyFrame:
+    # Fields with TL types unknown to `py_to_pl_types` have no dtype in the schemas, so
+    # these are left out.
+    schema = {c: dtype for c, dtype in schema.items() if dtype is not None}
+    if len(files) == 0:
+        return pl.LazyFrame(schema={**schema, **(hive_schema or {})})
+    sources, storage_options = get_scan_sources(files, fs=fs)
+    return pl.scan_parquet(
+        sources,
+        schema=schema,
+        storage_options=storage_options,
+        hive_partitioning=hive_schema is not None,
+        hive_schema=hive_schema,
+        missing_columns="insert",
+        extra_columns="ignore",
+        cast_options=SCAN_CAST_OPTIONS,
+    )
+
+
+def filter_dates(
+    lf: pl.LazyFrame,
+    start: datetime.datetime | None = None,
+    end: datetime.datetime | None = None,
+) -> pl.LazyFrame:
+    if start is not None:
+        lf = lf.filter(pl.col("date") >= to_utc(start))
+    if end is not None:
+        lf = lf.filter(pl.col("date") < to_utc(end))
+    return lf
+
+
+def get_reactions_pl_dtype(
+    files: list[str], fs: AbstractFileSystem = LOCAL_FS
+) -> pl.Struct:
+    """
+    Get the union of the `reactions` structs found in the schemas of `files`, only
+    reading their metadata.
+    """
+    fields = {}
+    for fpath in files:
+        with fs.open(fpath, "rb") as f:
+            dtype = pl.read_parquet_schema(f).get("reactions")
+        if isinstance(dtype, pl.Struct):
+            fields.update({field.name: field.dtype for field in dtype.fields})
+    return pl.Struct(fields)
+
+
+def scan_messages(
+    project_paths: ProjectPaths,
+    channel_ids: Iterable[str] | None = None,
+    start: datetime.datetime | None = None,
+    end: datetime.datetime | None = None,
+    with_reactions: bool = False,
+    fs: AbstractFileSystem = LOCAL_FS,
+) -> pl.LazyFrame:
+    """
+    Scan the messages dataset, with `channel_id` and `month` columns from its
+    partitioning. Only the partitions of `channel_ids` and overlapping the interval
+    from `start` (included) to `end` (excluded) are read. The `reactions` struct is
+    left out unless `with_reactions`, as its fields vary between files and thus need
+    to be unified from the metadata of all of them.
+    """
+    files = list_bin_files(
+        project_paths.messages_dataset, channel_ids, start=start, end=end, fs=fs
+    )
+    schema = collegram.json.get_pl_schema()
+    if with_reactions:
+        schema["reactions"] = get_reactions_pl_dtype(files, fs=fs)
+    else:
+        del schema["reactions"]
+    lf = scan_files(files, dict(sorted(schema.items())), CHANNEL_HIVE_SCHEMA, fs=fs)
+    return filter_dates(lf, start=start, end=end)
+
+
+def scan_reactions(
+    project_paths: ProjectPaths,
+    channel_ids: Iterable[str] | None = None,
+    start: datetime.datetime | None = None,
+    end: datetime.datetime | None = None,
+    fs: AbstractFileSystem = LOCAL_FS,
+) -> pl.LazyFrame:
+    """
+    Scan the long-format reactions dataset, partitioned like the messages one. As it
+    has no message date, `start` and `end` only prune bins.
+    """
+    files = list_bin_files(
+        project_paths.reactions_dataset, channel_ids, start=start, end=end, fs=fs
+    )
+    return scan_files(
+        files, collegram.json.REACTIONS_PL_SCHEMA, CHANNEL_HIVE_SCHEMA, fs=fs
+    )
+
+
+def scan_message_langs(
+    project_paths: ProjectPaths,
+    channel_ids: Iterable[str] | None = None,
+    start: datetime.datetime | None = None,
+    end: datetime.datetime | None = None,
+    fs: AbstractFileSystem = LOCAL_FS,
+) -> pl.LazyFrame:
+    """
+    Scan the languages detected in messages, partitioned like the messages dataset. As
+    it has no message date, `start` and `end` only prune bins.
+    """
+    files = list_bin_files(
+        project_paths.message_langs_dataset, channel_ids, start=start, end=end, fs=fs
+    )
+    return scan_files(
+        files, collegram.parquet.MESSAGE_LANGS_PL_SCHEMA, CHANNEL_HIVE_SCHEMA, fs=fs
+    )
+
+
+def get_channels_langs(
+    project_paths: ProjectPaths,
+    channel_ids: Iterable[str] | None = None,
+    sample_size: int = 1000,
+    seed: int = 0,
+    fs: AbstractFileSystem = LOCAL_FS,
+) -> pl.LazyFrame:
+    """
+    Get the main language of channels from a random sample of at most `sample_size` of
+    their messages with a detected language, along with its share of the sample and
+    the size of the sample.
+    """
+    return (
+        scan_message_langs(project_paths, channel_ids, fs=fs)
+        .drop_nulls("lang")
+        .filter(pl.int_range(pl.len()).shuffle(seed).over("channel_id") < sample_size)
+        .group_by("channel_id", "lang")
+        .agg(nr_messages=pl.len())
+        .with_columns(
+            lang_share=pl.col("nr_messages")
+            / pl.col("nr_messages").sum().over("channel_id"),
+            sample_size=pl.col("nr_messages").sum().over("channel_id"),
+        )
+        .sort("channel_id", "nr_messages", "lang", descending=[False, True, False])
+        .unique("channel_id", keep="first", maintain_order=True)
+        .select("channel_id", "lang", "lang_share", "sample_size")
+    )
+
+
+def scan_urls(
+    project_paths: ProjectPaths,
+    channel_ids: Iterable[str] | None = None,
+    start: datetime.datetime | None = None,
+    end: datetime.datetime | None = None,
+    fs: AbstractFileSystem = LOCAL_FS,
+) -> pl.LazyFrame:
+    """
+    Scan the URLs found in messages, partitioned like the messages dataset.
+    """
+    files = list_bin_files(
+        project_paths.urls_dataset, channel_ids, start=start, end=end, fs=fs
+    )
+    lf = scan_files(files, collegram.urls.URLS_PL_SCHEMA, CHANNEL_HIVE_SCHEMA, fs=fs)
+    return filter_dates(lf, start=start, end=end)
+
+
+def scan_channel_domains(
+    project_paths: ProjectPaths,
+    channel_ids: Iterable[str] | None = None,
+    fs: AbstractFileSystem = LOCAL_FS,
+) -> pl.LazyFrame:
+    """
+    Scan the counts of URLs and messages of every channel linking to every domain.
+    """
+    if channel_ids is None:
+        files = fs.glob(
+            str(project_paths.channel_domains_dataset / "channel_id=*" / "*.parquet")
+        )
+    else:
+        paths = [ChannelPaths(i, project_paths).channel_domains for i in channel_ids]
+        files = [str(p) for p in paths if fs.exists(str(p))]
+    return scan_files(
+        sorted(files),
+        collegram.urls.CHANNEL_DOMAINS_PL_SCHEMA,
+        {"channel_id": pl.Utf8},
+        fs=fs,
+    )
+
+
+def get_domain_counts(
+    project_paths: ProjectPaths, fs: AbstractFileSystem = LOCAL_FS
+) -> pl.LazyFrame:
+    """
+    Count the channels, messages and URLs linking to every domain, from the counts of
+    every channel.
+    """
+    return (
+        scan_channel_domains(project_paths, fs=fs)
+        .group_by("domain")
+        .agg(
+            nr_channels=pl.len(),
+            nr_messages=pl.col("nr_messages").sum(),
+            nr_urls=pl.col("nr_urls").sum(),
+            first_date=pl.col("first_date").min(),
+            last_date=pl.col("last_date").max(),
+        )
+    )
+
+
+def scan_prefix_partitions(
+    dataset_path: Path,
+    schema: dict,
+    id_col: str,
+    channel_ids: Iterable[str] | None = None,
+    fs: AbstractFileSystem = LOCAL_FS,
+) -> pl.LazyFrame:
+    """
+    Scan the dataset at `dataset_path` partitioned by the prefix of channel IDs. If
+    `channel_ids` are given, only their partitions are read, and only their rows, found
+    from column `id_col`, are kept.
+    """
+    if channel_ids is None:
+        files = fs.glob(str(dataset_path / "prefix=*" / "*.parquet"))
+    else:
+        channel_ids = list(channel_ids)
+        partitions = {dataset_path / get_prefix_partition(i) for i in channel_ids}
+        files = [str(p) for p in partitions if fs.exists(str(p))]
+    lf = scan_files(sorted(files), schema, fs=fs)
+    if channel_ids is not None:
+        lf = lf.filter(pl.col(id_col).is_in(channel_ids))
+    return lf
+
+
+def scan_channels(
+    project_paths: ProjectPaths,
+    channel_ids: Iterable[str] | None = None,
+    fs: AbstractFileSystem = LOCAL_FS,
+) -> pl.LazyFrame:
+    """
+    Scan the channels dataset. If `channel_ids` are given, only their partitions are
+    read.
+    """
+    return scan_prefix_partitions(
+        project_paths.channels_dataset,
+        collegram.channels.get_pl_schema(),
+        "id",
+        channel_ids,
+        fs=fs,
+    )
+
+
+def scan_users(
+    project_paths: ProjectPaths,
+    channel_ids: Iterable[str] | None = None,
+    fs: AbstractFileSystem = LOCAL_FS,
+) -> pl.LazyFrame:
+    """
+    Scan the users dataset, with the latest attributes of every user. If `channel_ids`
+    are given, only users who have been members of any of these channels are kept.
+    """
+    files = fs.glob(str(project_paths.users_dataset / "prefix=*" / "*.parquet"))
+    schema = {**collegram.users.get_pl_schema(), "last_seen": pl.Datetime}
+    lf = scan_files(sorted(files), schema, fs=fs)
+    if channel_ids is not None:
+        members = scan_memberships(project_paths, channel_ids, fs=fs).select("user_id")
+        lf = lf.join(members.unique(), left_on="id", right_on="user_id", how="semi")
+    return lf
+
+
+def scan_memberships(
+    project_paths: ProjectPaths,
+    channel_ids: Iterable[str] | None = None,
+    fs: AbstractFileSystem = LOCAL_FS,
+) -> pl.LazyFrame:
+    """
+    Scan the memberships of users in channels, with when each was first and last seen.
+    If `channel_ids` are given, only their partitions are read.
+    """
+    return scan_prefix_partitions(
+        project_paths.memberships_dataset,
+        collegram.parquet.MEMBERSHIPS_PL_SCHEMA,
+        "channel_id",
+        channel_ids,
+        fs=fs,
+    )
+
+
+def scan_service_messages(
+    project_paths: ProjectPaths,
+    channel_ids: Iterable[str] | None = None,
+    start: datetime.datetime | None = None,
+    end: datetime.datetime | None = None,
+    fs: AbstractFileSystem = LOCAL_FS,
+) -> pl.LazyFrame:
+    """
+    Scan the service messages dataset, partitioned like the messages one. `action` is
+    a JSON string, as its fields depend on `action_type`.
+    """
+    files = list_bin_files(
+        project_paths.service_messages_dataset,
+        channel_ids,
+        start=start,
+        end=end,
+        fs=fs,
+    )
+    lf = scan_files(
+        files, collegram.json.SERVICE_MESSAGES_PL_SCHEMA, CHANNEL_HIVE_SCHEMA, fs=fs
+    )
+    return filter_dates(lf, start=start, end=end)
@@ -0,0 +1,692 @@
+from __future__ import annotations
+
+import asyncio
+import base64
+import bisect
+import collections
+import datetime
+import json
+import logging
+import random
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, AsyncIterator, Iterable, Iterator
+
+from telethon.errors import (
+    ChannelInvalidError,
+    ChannelPrivateError,
+    ChatAdminRequiredError,
+    FloodWaitError,
+)
+from telethon.extensions import BinaryReader
+from telethon.tl.functions.channels import (
+    GetChannelRecommendationsRequest,
+    GetFullChannelRequest,
+)
+from telethon.tl.functions.contacts import SearchRequest as ContactsSearchRequest
+from telethon.tl.functions.messages import SearchRequest as MessagesSearchRequest
+from telethon.tl.types import (
+    Channel,
+    ChannelFull,
+    ChatPhotoEmpty,
+    DocumentAttributeAnimated,
+    DocumentAttributeAudio,
+    DocumentAttributeVideo,
+    InputChannel,
+    InputMessagesFilterDocument,
+    InputMessagesFilterEmpty,
+    InputMessagesFilterGif,
+    InputMessagesFilterMusic,
+    InputMessagesFilterPhotos,
+    InputMessagesFilterUrl,
+    InputMessagesFilterVideo,
+    InputMessagesFilterVoice,
+    InputPeerChannel,
+    Message,
+    MessageActionPinMessage,
+    MessageEntityHashtag,
+    MessageEntityMention,
+    MessageEntityTextUrl,
+    MessageEntityUrl,
+    MessageFwdHeader,
+    MessageMediaDocument,
+    MessageMediaPhoto,
+    MessageReactions,
+    MessageReplies,
+    MessageService,
+    PeerChannel,
+    PeerNotifySettings,
+    Photo,
+    PhotoEmpty,
+    ReactionCount,
+    ReactionEmoji,
+    User,
+)
+from telethon.tl.types.contacts import Found
+from telethon.tl.types.messages import ChannelMessages, Chats, ChatFull
+
+from collegram.channels import get_matching_chat_from_full
+from collegram.utils import LOCAL_FS
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+    from fsspec import AbstractFileSystem
+    from telethon import TelegramClient
+    from telethon.tl.types import TypeMessage
+
+logger = logging.getLogger(__name__)
+
+# Telethon gets histories by requests of at most this many messages.
+MESSAGES_BATCH_SIZE = 100
+# Words messages and descriptions of synthetic channels are made of, per language.
+WORDS = {
+    "EN": "the news of today war peace people government city report says new world",
+    "FR": "les nouvelles du jour guerre paix peuple gouvernement ville rapport dit",
+    "DE": "die nachrichten von heute krieg frieden volk regierung stadt bericht sagt",
+    "ES": "las noticias de hoy guerra paz pueblo gobierno ciudad informe dice nuevo",
+    "RU": "novosti segodnya voina mir narod pravitelstvo gorod doklad govorit novyi",
+}
+REACTION_EMOTICONS = ["👍", "❤", "🔥", "😢", "😡", "👎", "🤔", "😁"]
+# Which messages are counted by every filter of `messages.SearchRequest`, as done in
+# `collegram.channels.get_extended_save_data`.
+MESSAGE_FILTER_PREDICATES = {
+    InputMessagesFilterEmpty: lambda m: True,
+    InputMessagesFilterPhotos: lambda m: isinstance(m.media, MessageMediaPhoto),
+    InputMessagesFilterUrl: lambda m: any(
+        isinstance(e, (MessageEntityUrl, MessageEntityTextUrl))
+        for e in m.entities or []
+    ),
+    InputMessagesFilterDocument: lambda m: isinstance(m.media, MessageMediaDocument),
+    InputMessagesFilterVideo: lambda m: has_document_attribute(
+        m, DocumentAttributeVideo
+    ),
+    InputMessagesFilterGif: lambda m: has_document_attribute(
+        m, DocumentAttributeAnimated
+    ),
+    InputMessagesFilterMusic: lambda m: has_document_attribute(
+        m, DocumentAttributeAudio, voice=False
+    ),
+    InputMessagesFilterVoice: lambda m: has_document_attribute(
+        m, DocumentAttributeAudio, voice=True
+    ),
+}
+
+
+def has_document_attribute(message: Message, attr_type: type, **attr_values) -> bool:
+    document = getattr(message.media, "document", None)
+    return any(
+        isinstance(a, attr_type)
+        and all(getattr(a, k, None) == v for k, v in attr_values.items())
+        for a in getattr(document, "attributes", [])
+    )
+
+
+def read_tl_object(data: bytes):
+    with BinaryReader(data) as reader:
+        return reader.tgread_object()
+
+
+class FakeChannel:
+    """
+    Everything a `FakeTelegramClient` serves about a channel. TL objects are kept
+    serialised and read back on every response, like a real client does, so that
+    responses can be mutated, as `collegram.messages.preprocess` does, without altering
+    the channel.
+    """
+
+    def __init__(
+        self,
+        full: ChatFull,
+        messages: Iterable[TypeMessage] = (),
+        recommended: Iterable[int] = (),
+        participants: Iterable[User] = (),
+        private: bool = False,
+    ):
+        channel = get_matching_chat_from_full(full)
+        self.id: int = channel.id
+        self.access_hash: int = channel.access_hash
+        self.username: str | None = channel.username
+        self.title: str = channel.title
+        self.full_data = bytes(full)
+        self.channel_data = bytes(channel)
+        self.recommended = list(recommended)
+        self.participants_data = [bytes(u) for u in participants]
+        self.can_view_participants = bool(full.full_chat.can_view_participants)
+        self.private = private
+        self.message_ids: list[int] = []
+        self.message_dates: list[datetime.datetime] = []
+        self.messages_data: list[bytes] = []
+        self.filter_counts: collections.Counter = collections.Counter()
+        self.add_messages(messages)
+
+    def add_messages(self, messages: Iterable[TypeMessage]):
+        """
+        Add `messages` to the history of the channel, kept sorted by ID.
+        """
+        history = list(zip(self.message_ids, self.message_dates, self.messages_data))
+        for m in messages:
+            history.append((m.id, m.date, bytes(m)))
+            if isinstance(m, Message):
+                for f, predicate in MESSAGE_FILTER_PREDICATES.items():
+                    self.filter_counts[f] += int(predicate(m))
+        history.sort(key=lambda h: h[0])
+        self.message_ids = [h[0] for h in history]
+        self.message_dates = [h[1] for h in history]
+        self.messages_data = [h[2] for h in history]
+
+    def get_full(self) -> ChatFull:
+        return read_tl_object(self.full_data)
+
+    def get_channel(self) -> Channel:
+        return read_tl_object(self.channel_data)
+
+    def get_participants(self) -> list[User]:
+        return [read_tl_object(u) for u in self.participants_data]
+
+    def get_message(self, message_id: int) -> TypeMessage | None:
+        i = bisect.bisect_left(self.message_ids, message_id)
+        if i < len(self.message_ids) and self.message_ids[i] == message_id:
+            return read_tl_object(self.messages_data[i])
+        return None
+
+    def yield_message_indices(
+        self,
+        offset_date: datetime.datetime | None = None,
+        offset_id: int = 0,
+        reverse: bool = False,
+    ) -> Iterator[int]:
+        """
+        Yield the indices of the messages `iter_messages` would return, from the newest
+        to the oldest older than `offset_date` and `offset_id`, or the other way around
+        from these if `reverse`.
+        """
+        if reverse:
+            start = 0
+            if offset_date is not None:
+                start = bisect.bisect_left(self.message_dates, offset_date)
+            if offset_id > 0:
+                start = max(start, bisect.bisect_right(self.message_ids, offset_id))
+            yield from range(start, len(self.message_ids))
+        else:
+            end = len(self.message_ids)
+            if offset_date is not None:
+                end = bisect.bisect_left(self.message_dates, offset_date)
+            if offset_id > 0:
+                end = min(end, bisect.bisect_left(self.message_ids, offset_id))
+            yield from range(end - 1, -1, -1)
+
+
+@dataclass(frozen=True)
+class SyntheticSpec:
+    """
+    Sizes and shapes of a synthetic network of channels. Counts per message are
+    maxima, the actual ones being drawn uniformly up to them.
+    """
+
+    nr_channels: int = 100
+    nr_messages: int = 1000
+    nr_recommended: int = 5
+    nr_participants: int = 0
+    nr_entities: int = 2
+    nr_reactions: int = 3
+    forward_share: float = 0.1
+    photo_share: float = 0.2
+    service_share: float = 0.01
+    private_share: float = 0.05
+    start: datetime.datetime = datetime.datetime(2022, 1, 1, tzinfo=datetime.UTC)
+    end: datetime.datetime = datetime.datetime(2024, 1, 1, tzinfo=datetime.UTC)
+
+
+def make_channel(
+    channel_id: int, rng: random.Random, spec: SyntheticSpec, lang: str = "EN"
+) -> ChatFull:
+    span = spec.end - spec.start
+    date = spec.start + rng.random() * span / 2
+    nr_participants = rng.randint(10, 100_000)
+    channel = Channel(
+        id=channel_id,
+        title=" ".join(rng.choices(WORDS[lang].split(), k=3)),
+        photo=ChatPhotoEmpty(),
+        date=date.replace(microsecond=0),
+        access_hash=rng.getrandbits(63),
+        username=f"chan{channel_id}",
+        broadcast=True,
+        participants_count=nr_participants,
+    )
+    full_channel = ChannelFull(
+        id=channel_id,
+        about=" ".join(rng.choices(WORDS[lang].split(), k=12)),
+        read_inbox_max_id=0,
+        read_outbox_max_id=0,
+        unread_count=0,
+        chat_photo=PhotoEmpty(id=0),
+        notify_settings=PeerNotifySettings(),
+        bot_info=[],
+        pts=spec.nr_messages + rng.randint(0, spec.nr_messages),
+        participants_count=nr_participants,
+        can_view_participants=spec.nr_participants > 0,
+    )
+    return ChatFull(full_chat=full_channel, chats=[channel], users=[])
+
+
+def make_message(
+    message_id: int,
+    channel_id: int,
+    date: datetime.datetime,
+    rng: random.Random,
+    spec: SyntheticSpec,
+    lang: str = "EN",
+    forward_sources: list[int] | None = None,
+) -> TypeMessage:
+    peer = PeerChannel(channel_id)
+    if rng.random() < spec.service_share:
+        return MessageService(
+            id=message_id, peer_id=peer, date=date, action=MessageActionPinMessage()
+        )
+
+    # Texts are ASCII only, so that offsets in characters match the UTF-16 ones of
+    # entities.
+    tokens = [(w, None) for w in rng.choices(WORDS[lang].split(), k=rng.randint(3, 40))]
+    for _ in range(rng.randint(0, spec.nr_entities)):
+        n = rng.randrange(1000)
+        url = f"https://site{n % 50}.com/post/{n}?utm_source=tg"
+        entity = rng.choice(
+            [
+                (url, MessageEntityUrl),
+                (f"@user{n}", MessageEntityMention),
+                (f"#tag{n % 20}", MessageEntityHashtag),
+                (rng.choice(WORDS[lang].split()), MessageEntityTextUrl),
+            ]
+        )
+        tokens.insert(rng.randrange(len(tokens) + 1), (entity[0], (entity[1], url)))
+
+    entities = []
+    offset = 0
+    for token, entity in tokens:
+        if entity is not None:
+            entity_type, url = entity
+            if entity_type is MessageEntityTextUrl:
+                entities.append(entity_type(offset, len(token), url=url))
+            else:
+                entities.append(entity_type(offset, len(token)))
+        offset += len(token) + 1
+    text = " ".join(token for token, _ in tokens)
+
+    fwd_from = None
+    if forward_sources and rng.random() < spec.forward_share:
+        fwd_from = MessageFwdHeader(
+            date=date - datetime.timedelta(hours=rng.randint(0, 72)),
+            from_id=PeerChannel(rng.choice(forward_sources)),
+            channel_post=rng.randint(1, spec.nr_messages),
+        )
+    media = None
+    if rng.random() < spec.photo_share:
+        media = MessageMediaPhoto(
+            photo=Photo(
+                id=rng.getrandbits(63),
+                access_hash=rng.getrandbits(63),
+                file_reference=b"",
+                date=date,
+                sizes=[],
+                dc_id=2,
+            )
+        )
+    nr_reactions = rng.randint(0, spec.nr_reactions)
+    reactions = None
+    if nr_reactions > 0:
+        reactions = MessageReactions(
+            results=[
+                ReactionCount(reaction=ReactionEmoji(e), count=rng.randint(1, 500))
+                for e in rng.sample(REACTION_EMOTICONS, min(nr_reactions, 8))
+            ]
+        )
+    return Message(
+        id=message_id,
+        peer_id=peer,
+        date=date,
+        message=text,
+        post=True,
+        entities=entities or None,
+        fwd_from=fwd_from,
+        media=media,
+        reactions=reactions,
+        replies=MessageReplies(replies=rng.randint(0, 20), replies_pts=0),
+        views=rng.randint(0, 100_000),
+        forwards=rng.randint(0, 1000),
+    )
+
+
+def make_participants(rng: random.Random, nr_participants: int) -> list[User]:
+    return [
+        User(
+            id=rng.getrandbits(40),
+            access_hash=rng.getrandbits(63),
+            first_name=rng.choice(["Anna", "Ivan", "Marie", "John"]),
+            username=f"user{rng.getrandbits(20)}",
+        )
+        for _ in range(nr_participants)
+    ]
+
+
+def make_network(spec: SyntheticSpec, seed: int = 0) -> list[FakeChannel]:
+    """
+    Make a network of channels recommending and forwarding from each other, with their
+    message histories, reproducible from `seed`.
+    """
+    rng = random.Random(seed)
+    channel_ids = rng.sample(range(10**9, 2 * 10**9), spec.nr_channels)
+    private_ids = set(
+        rng.sample(channel_ids, int(spec.private_share * len(channel_ids)))
+    )
+    public_ids = [c_id for c_id in channel_ids if c_id not in private_ids]
+    channels = []
+    for c_id in channel_ids:
+        lang = rng.choice(list(WORDS.keys()))
+        full = make_channel(c_id, rng, spec, lang=lang)
+        others = [i for i in channel_ids if i != c_id]
+        forward_sources = rng.sample(others, min(len(others), 20))
+        created_at = full.chats[0].date
+        interval = (spec.end - created_at) / max(spec.nr_messages, 1)
+        messages = [
+            make_message(
+                i + 1,
+                c_id,
+                (created_at + i * interval).replace(microsecond=0),
+                rng,
+                spec,
+                lang=lang,
+                forward_sources=forward_sources,
+            )
+            for i in range(spec.nr_messages)
+        ]
+        recommendable = [i for i in public_ids if i != c_id]
+        channels.append(
+            FakeChannel(
+                full,
+                messages,
+                recommended=rng.sample(
+                    recommendable, min(spec.nr_recommended, len(recommendable))
+                ),
+                participants=make_participants(rng, spec.nr_participants),
+                private=c_id in private_ids,
+            )
+        )
+    return channels
+
+
+async def record_channel(
+    client: TelegramClient,
+    channel: InputPeerChannel | Channel,
+    save_path: Path,
+    messages_limit: int | None = None,
+    fs: AbstractFileSystem = LOCAL_FS,
+):
+    """
+    Record the responses of Telegram about `channel` to `save_path`, with its last
+    `messages_limit` messages, to be served by a `FakeTelegramClient` after loading it
+    with `load_recording`. Every line holds the kind of a response and the TL object
+    serialised as by Telegram, base64 encoded.
+    """
+    full = await client(GetFullChannelRequest(channel))
+    recommended = await client(GetChannelRecommendationsRequest(channel))
+    records = [("full", full), ("recommended", recommended)]
+    if full.full_chat.can_view_participants:
+        try:
+            participants = await client.get_participants(channel)
+            records.extend(("participant", u) for u in participants)
+        except ChatAdminRequiredError:
+            logger.warning(f"No access to participants of {channel}")
+
+    fs.mkdirs(str(save_path.parent), exist_ok=True)
+    with fs.open(str(save_path), "w") as f:
+        for kind, obj in records:
+            f.write(
+                json.dumps({"kind": kind, "tl": base64.b64encode(bytes(obj)).decode()})
+            )
+            f.write("\n")
+        async for m in client.iter_messages(channel, limit=messages_limit):
+            f.write(
+                json.dumps(
+                    {"kind": "message", "tl": base64.b64encode(bytes(m)).decode()}
+                )
+            )
+            f.write("\n")
+
+
+def load_recording(save_path: Path, fs: AbstractFileSystem = LOCAL_FS) -> FakeChannel:
+    records = collections.defaultdict(list)
+    with fs.open(str(save_path), "r") as f:
+        for line in f:
+            d = json.loads(line)
+            records[d["kind"]].append(read_tl_object(base64.b64decode(d["tl"])))
+    recommended = [c.id for r in records["recommended"] for c in r.chats]
+    return FakeChannel(
+        records["full"][0],
+        records["message"],
+        recommended=recommended,
+        participants=records["participant"],
+    )
+
+
+def load_recordings(
+    recordings_dir: Path, fs: AbstractFileSystem = LOCAL_FS
+) -> list[FakeChannel]:
+    return [load_recording(p, fs=fs) for p in fs.glob(f"{recordings_dir}/*.jsonl")]
+
+
+class FakeMessagesIter:
+    """
+    Iterator over the messages of a channel, asynchronous like the one returned by
+    `TelegramClient.iter_messages`, which can also be iterated over synchronously.
+    """
+
+    def __init__(self, client: FakeTelegramClient, messages: AsyncIterator):
+        self.client = client
+        self.messages = messages
+
+    def __aiter__(self):
+        return self.messages
+
+    def __iter__(self):
+        while True:
+            try:
+                yield self.client.loop.run_until_complete(self.messages.__anext__())
+            except StopAsyncIteration:
+                return
+
+
+class FakeTelegramClient:
+    """
+    Offline stand-in for a `TelegramClient`, serving `channels` to the methods and
+    requests collegram uses. Every request waits `latency` seconds, plus up to `jitter`,
+    and may hit a flood wait of `flood_wait_seconds` with probability
+    `flood_wait_prob`. As with Telethon, the client sleeps through flood waits up to
+    `flood_sleep_threshold` seconds, logging it, and raises a `FloodWaitError`
+    otherwise. Conversations with bots are not supported.
+    """
+
+    def __init__(
+        self,
+        channels: Iterable[FakeChannel],
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        flood_wait_prob: float = 0.0,
+        flood_wait_seconds: int = 1,
+        flood_sleep_threshold: int = 60,
+        seed: int = 0,
+    ):
+        self.channels = {c.id: c for c in channels}
+        self.usernames = {
+            c.username.lower(): c.id for c in self.channels.values() if c.username
+        }
+        self.latency = latency
+        self.jitter = jitter
+        self.flood_wait_prob = flood_wait_prob
+        self.flood_wait_seconds = flood_wait_seconds
+        self.flood_sleep_threshold = flood_sleep_threshold
+        self.rng = random.Random(seed)
+        self.loop = asyncio.new_event_loop()
+        # Number of requests made, per type of request.
+        self.nr_requests: collections.Counter = collections.Counter()
+
+    def start(self, *args, **kwargs):
+        return self
+
+    def disconnect(self):
+        pass
+
+    def is_connected(self) -> bool:
+        return True
+
+    async def simulate_request(self, request):
+        name = request if isinstance(request, str) else type(request).__name__
+        self.nr_requests[name] += 1
+        if self.rng.random() < self.flood_wait_prob:
+            if self.flood_wait_seconds > self.flood_sleep_threshold:
+                raise FloodWaitError(request=request, capture=self.flood_wait_seconds)
+            # Same record as Telethon's, for `collegram.metrics.FloodWaitHandler`.
+            logging.getLogger("telethon.client.users").info(
+                "Sleeping%s for %ds (%s) on %s flood wait",
+                "",
+                self.flood_wait_seconds,
+                datetime.timedelta(seconds=self.flood_wait_seconds),
+                name,
+            )
+            await asyncio.sleep(self.flood_wait_seconds)
+        await asyncio.sleep(self.latency + self.jitter * self.rng.random())
+
+    def resolve(self, entity, request=None) -> FakeChannel:
+        """
+        Get the channel `entity` refers to, raising the errors Telegram would if it
+        cannot be accessed.
+        """
+        if isinstance(entity, str):
+            entity = entity.lstrip("@").lower()
+            if entity.isdigit():
+                entity = int(entity)
+            elif entity in self.usernames:
+                entity = self.usernames[entity]
+            else:
+                raise ValueError(f'No user has "{entity}" as username')
+
+        access_hash = getattr(entity, "access_hash", None)
+        if isinstance(entity, int):
+            channel_id = entity
+        elif isinstance(entity, Channel):
+            channel_id = entity.id
+        else:
+            channel_id = getattr(entity, "channel_id", None)
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            raise ValueError(f"Could not find the input entity for {entity}")
+        if access_hash is not None and access_hash != channel.access_hash:
+            raise ChannelInvalidError(request=request)
+        if channel.private:
+            raise ChannelPrivateError(request=request)
+        return channel
+
+    async def get_input_entity(self, peer) -> InputPeerChannel:
+        if isinstance(peer, (InputPeerChannel, InputChannel)):
+            return peer
+        if isinstance(peer, str):
+            await self.simulate_request("ResolveUsernameRequest")
+        channel_id = (
+            self.usernames.get(peer.lstrip("@").lower())
+            if isinstance(peer, str)
+            else getattr(peer, "channel_id", getattr(peer, "id", peer))
+        )
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            raise ValueError(f"Could not find the input entity for {peer}")
+        return InputPeerChannel(channel.id, channel.access_hash)
+
+    async def get_entity(self, entity) -> Channel:
+        await self.simulate_request("GetChannelsRequest")
+        return self.resolve(entity).get_channel()
+
+    async def get_participants(self, entity) -> list[User]:
+        await self.simulate_request("GetParticipantsRequest")
+        channel = self.resolve(entity)
+        if not channel.can_view_participants:
+            raise ChatAdminRequiredError(request=None)
+        return channel.get_participants()
+
+    async def __call__(self, request):
+        await self.simulate_request(request)
+        if isinstance(request, GetFullChannelRequest):
+            return self.resolve(request.channel, request).get_full()
+
+        elif isinstance(request, GetChannelRecommendationsRequest):
+            channel = self.resolve(request.channel, request)
+            chats = [
+                self.channels[i].get_channel()
+                for i in channel.recommended
+                if i in self.channels
+            ]
+            return Chats(chats=chats)
+
+        elif isinstance(request, ContactsSearchRequest):
+            query = request.q.lower()
+            chats = [
+                c.get_channel()
+                for c in self.channels.values()
+                if not c.private
+                and (query in c.title.lower() or query in (c.username or "").lower())
+            ][: request.limit]
+            return Found(
+                my_results=[],
+                results=[PeerChannel(c.id) for c in chats],
+                chats=chats,
+                users=[],
+            )
+
+        elif isinstance(request, MessagesSearchRequest):
+            channel = self.resolve(request.peer, request)
+            return ChannelMessages(
+                pts=0,
+                count=channel.filter_counts[type(request.filter)],
+                messages=[],
+                topics=[],
+                chats=[],
+                users=[],
+            )
+
+        raise NotImplementedError(f"{type(request).__name__} is not served offline")
+
+    async def yield_messages(
+        self,
+        entity,
+        limit: int | None = None,
+        offset_date: datetime.datetime | None = None,
+        offset_id: int = 0,
+        reverse: bool = False,
+        reply_to: int | None = None,
+    ) -> AsyncIterator[TypeMessage]:
+        channel = self.resolve(entity)
+        nr_yielded = 0
+        for nr_read, i in enumerate(
+            channel.yield_message_indices(offset_date, offset_id, reverse)
+        ):
+            if limit is not None and nr_yielded >= limit:
+                return
+            if nr_read % MESSAGES_BATCH_SIZE == 0:
+                await self.simulate_request("GetHistoryRequest")
+            m = read_tl_object(channel.messages_data[i])
+            reply_to_id = getattr(getattr(m, "reply_to", None), "reply_to_msg_id", None)
+            if reply_to is None or reply_to_id == reply_to:
+                nr_yielded += 1
+                yield m
+
+    def iter_messages(self, entity, limit: int | None = None, **kwargs):
+        return FakeMessagesIter(self, self.yield_messages(entity, limit, **kwargs))
+
+    async def get_messages(self, entity, limit: int | None = None, ids=None, **kwargs):
+        if ids is None:
+            limit = 1 if limit is None else limit
+            return [m async for m in self.yield_messages(entity, limit, **kwargs)]
+
+        await self.simulate_request("GetMessagesRequest")
+        channel = self.resolve(entity)
+        if isinstance(ids, int):
+            return channel.get_message(ids)
+        return [channel.get_message(i) for i in ids]
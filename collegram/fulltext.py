@@ -0,0 +1,248 @@
+from __future__ import annotations
+
+import datetime
+import logging
+from typing import TYPE_CHECKING, Iterable
+
+import polars as pl
+
+import collegram.dataset
+import collegram.parquet
+import collegram.text
+from collegram.paths import ChannelPaths, ProjectPaths, get_bin_partition
+from collegram.utils import LOCAL_FS
+
+if TYPE_CHECKING:
+    from fsspec import AbstractFileSystem
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = r"\w+"
+# Postings of a term: the IDs of the messages it appears in, sorted and stored as
+# differences with the previous one to compress well, and the positions of the term in
+# every one of these messages.
+POSTINGS_PL_SCHEMA = {
+    "term": pl.Utf8,
+    "message_ids": pl.List(pl.Int64),
+    "positions": pl.List(pl.List(pl.UInt32)),
+}
+# Small row groups, sorted by term, so that queries only read the few containing their
+# terms, found from the statistics.
+POSTINGS_WRITE_PROFILE = collegram.parquet.ParquetWriteProfile(
+    row_group_size=2**8, sort_by=("term",)
+)
+# Dictionary of the terms of the whole index, with one row per term and segment it
+# appears in, the segment being given by its file relative to its channel's partition.
+# Sorted by term for the same reason as postings, so that queries only open the
+# segments containing their terms.
+TERMS_PL_SCHEMA = {"term": pl.Utf8, "channel_id": pl.Utf8, "segment": pl.Utf8}
+TERMS_WRITE_PROFILE = collegram.parquet.ParquetWriteProfile(
+    row_group_size=2**12, sort_by=("term", "channel_id", "segment")
+)
+
+
+def tokenize_expr(expr: pl.Expr) -> pl.Expr:
+    """
+    Get the list of lowercase words of texts, cleaned beforehand of URLs, mentions and
+    hashtags.
+    """
+    return (
+        collegram.text.clean_text_expr(expr)
+        .str.to_lowercase()
+        .str.extract_all(TOKEN_PATTERN)
+    )
+
+
+def tokenize(text: str) -> list[str]:
+    return pl.select(tokenize_expr(pl.lit(text, dtype=pl.Utf8))).item().to_list()
+
+
+def build_postings(messages_df: pl.DataFrame) -> pl.DataFrame:
+    """
+    Build the postings of all the terms of the `message` column of `messages_df`.
+    """
+    return (
+        messages_df.select(message_id="id", term=tokenize_expr(pl.col("message")))
+        .explode("term")
+        .drop_nulls("term")
+        .with_columns(
+            position=pl.int_range(pl.len(), dtype=pl.UInt32).over("message_id")
+        )
+        .group_by("term", "message_id")
+        .agg("position")
+        .sort("term", "message_id")
+        .group_by("term", maintain_order=True)
+        .agg(
+            message_ids=pl.col("message_id")
+            .diff()
+            .fill_null(pl.col("message_id").first()),
+            positions="position",
+        )
+    )
+
+
+def index_channel(
+    anon_id: str,
+    project_paths: ProjectPaths,
+    fs: AbstractFileSystem = LOCAL_FS,
+) -> collegram.parquet.ConversionReport:
+    """
+    Index the messages of a channel, with one segment of the index per partition of the
+    messages dataset. Only the segments of the bins converted since they were last
+    indexed are rebuilt.
+    """
+    chan_paths = ChannelPaths(anon_id, project_paths)
+    report = collegram.parquet.ConversionReport(anon_id)
+    for fpath in fs.glob(str(chan_paths.messages_partitions / "month=*" / "*.parquet")):
+        segment_path = chan_paths.fulltext_partitions / get_bin_partition(fpath)
+        if fs.exists(str(segment_path)) and fs.modified(
+            str(segment_path)
+        ) > fs.modified(fpath):
+            continue
+
+        with fs.open(fpath, "rb") as f:
+            m_df = pl.read_parquet(f, columns=["id", "message"])
+        postings_df = build_postings(m_df)
+        collegram.parquet.write_parquet(
+            postings_df, segment_path, fs=fs, profile=POSTINGS_WRITE_PROFILE
+        )
+        report.nr_files += 1
+        report.nr_rows += postings_df.height
+    return report
+
+
+def build_term_dictionary(
+    project_paths: ProjectPaths, fs: AbstractFileSystem = LOCAL_FS
+) -> int:
+    """
+    Build the dictionary of the terms of the full-text index from the terms of all its
+    segments, and return its number of rows. It should be rebuilt after indexing.
+    """
+    files = collegram.dataset.list_bin_files(project_paths.fulltext_index, fs=fs)
+    if len(files) == 0:
+        terms_df = pl.DataFrame(schema=TERMS_PL_SCHEMA)
+    else:
+        sources, storage_options = collegram.dataset.get_scan_sources(files, fs=fs)
+        terms_df = (
+            pl.scan_parquet(
+                sources,
+                storage_options=storage_options,
+                hive_partitioning=True,
+                hive_schema=collegram.dataset.CHANNEL_HIVE_SCHEMA,
+                include_file_paths="path",
+            )
+            .select(
+                "term",
+                "channel_id",
+                segment=pl.col("path").str.extract(r"(month=[^/]+/[^/]+)$"),
+            )
+            .collect()
+        )
+    collegram.parquet.write_parquet(
+        terms_df, project_paths.fulltext_terms, fs=fs, profile=TERMS_WRITE_PROFILE
+    )
+    return terms_df.height
+
+
+def list_term_segments(
+    project_paths: ProjectPaths,
+    terms: Iterable[str],
+    channel_ids: Iterable[str] | None = None,
+    start: datetime.datetime | None = None,
+    end: datetime.datetime | None = None,
+    fs: AbstractFileSystem = LOCAL_FS,
+) -> list[str]:
+    """
+    List the files of the segments of `channel_ids` overlapping the interval from
+    `start` to `end` that contain any of `terms`, from the term dictionary. Without a
+    dictionary, all the segments of `channel_ids` in the interval are listed.
+    """
+    if not fs.exists(str(project_paths.fulltext_terms)):
+        logger.warning(
+            "No term dictionary, run `build_term_dictionary` to only open the "
+            "segments containing the searched terms"
+        )
+        return collegram.dataset.list_bin_files(
+            project_paths.fulltext_index, channel_ids, start=start, end=end, fs=fs
+        )
+
+    sources, storage_options = collegram.dataset.get_scan_sources(
+        [str(project_paths.fulltext_terms)], fs=fs
+    )
+    segments_lf = pl.scan_parquet(
+        sources, schema=TERMS_PL_SCHEMA, storage_options=storage_options
+    ).filter(pl.col("term").is_in(list(terms)))
+    if channel_ids is not None:
+        segments_lf = segments_lf.filter(pl.col("channel_id").is_in(list(channel_ids)))
+    segments_df = segments_lf.select("channel_id", "segment").unique().collect()
+    files = [
+        str(project_paths.fulltext_index / f"channel_id={channel_id}" / segment)
+        for channel_id, segment in segments_df.iter_rows()
+    ]
+    return sorted(collegram.dataset.filter_bin_files(files, start=start, end=end))
+
+
+def scan_postings(
+    project_paths: ProjectPaths,
+    terms: Iterable[str],
+    channel_ids: Iterable[str] | None = None,
+    start: datetime.datetime | None = None,
+    end: datetime.datetime | None = None,
+    fs: AbstractFileSystem = LOCAL_FS,
+) -> pl.LazyFrame:
+    """
+    Scan the postings of `terms` in the segments of `channel_ids` overlapping the
+    interval from `start` to `end`, with one row per message a term appears in. Only
+    the segments containing `terms` according to the term dictionary are read.
+    """
+    terms = list(terms)
+    files = list_term_segments(project_paths, terms, channel_ids, start, end, fs=fs)
+    return (
+        collegram.dataset.scan_files(
+            files, POSTINGS_PL_SCHEMA, collegram.dataset.CHANNEL_HIVE_SCHEMA, fs=fs
+        )
+        .filter(pl.col("term").is_in(terms))
+        .with_columns(pl.col("message_ids").list.eval(pl.element().cum_sum()))
+        .explode("message_ids", "positions")
+        .rename({"message_ids": "id"})
+    )
+
+
+def search_messages(
+    project_paths: ProjectPaths,
+    query: str,
+    channel_ids: Iterable[str] | None = None,
+    start: datetime.datetime | None = None,
+    end: datetime.datetime | None = None,
+    fs: AbstractFileSystem = LOCAL_FS,
+) -> pl.DataFrame:
+    """
+    Get the `channel_id` and `id` of the messages containing the phrase `query`, that
+    is all its words in a row, from the full-text index. As the index is partitioned by
+    bins, `start` and `end` only prune these, to filter on the exact dates join the
+    result with `collegram.dataset.scan_messages`.
+    """
+    terms = tokenize(query)
+    if len(terms) == 0:
+        return pl.DataFrame(schema={"channel_id": pl.Utf8, "id": pl.Int64})
+
+    postings_df = (
+        scan_postings(project_paths, set(terms), channel_ids, start, end, fs=fs)
+        .select("channel_id", "id", "term", "positions")
+        .collect()
+    )
+    if len(terms) == 1:
+        return postings_df.select("channel_id", "id")
+
+    # A phrase starts at the position of its first term, of its second minus one, etc.
+    postings_df = postings_df.explode("positions")
+    matches = None
+    for i, term in enumerate(terms):
+        term_starts = postings_df.filter(pl.col("term") == term).select(
+            "channel_id", "id", start=pl.col("positions").cast(pl.Int64) - i
+        )
+        if matches is None:
+            matches = term_starts
+        else:
+            matches = matches.join(term_starts, on=["channel_id", "id", "start"])
+    return matches.select("channel_id", "id").unique(maintain_order=True)
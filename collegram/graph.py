@@ -0,0 +1,224 @@
+from __future__ import annotations
+
+import logging
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable
+
+import polars as pl
+
+import collegram.dataset
+import collegram.json
+import collegram.parquet
+from collegram.paths import ChannelPaths, ProjectPaths
+from collegram.utils import LOCAL_FS
+
+if TYPE_CHECKING:
+    import numpy as np
+    from fsspec import AbstractFileSystem
+
+logger = logging.getLogger(__name__)
+
+EDGE_KINDS = pl.Enum(["forward", "recommendation"])
+EDGES_PL_SCHEMA = {
+    "source": pl.UInt32,
+    "target": pl.UInt32,
+    "kind": EDGE_KINDS,
+    "weight": pl.Int64,
+}
+EDGES_WRITE_PROFILE = collegram.parquet.ParquetWriteProfile(
+    sort_by=("source", "target", "kind")
+)
+
+
+class ChannelGraph:
+    """
+    Weighted directed graph between channels. An edge goes from a channel to one it
+    forwarded messages from, weighted by the number of forwards, or to one it
+    recommends, with a weight of 1. Anonymised IDs are interned to integer indices,
+    and edges are kept sorted by source and target, that is in compressed sparse row
+    order.
+    """
+
+    def __init__(
+        self, node_ids: list[str] | None = None, edges: pl.DataFrame | None = None
+    ):
+        self.node_ids: list[str] = [] if node_ids is None else list(node_ids)
+        self.node_index = {anon_id: i for i, anon_id in enumerate(self.node_ids)}
+        self.edges = pl.DataFrame(schema=EDGES_PL_SCHEMA) if edges is None else edges
+
+    @property
+    def nr_nodes(self) -> int:
+        return len(self.node_ids)
+
+    @property
+    def nr_edges(self) -> int:
+        return self.edges.height
+
+    def intern(self, anon_ids: Iterable[str]) -> list[int]:
+        """
+        Get the indices of `anon_ids`, adding as new nodes those not in the graph yet.
+        """
+        indices = []
+        for anon_id in anon_ids:
+            i = self.node_index.get(anon_id)
+            if i is None:
+                i = len(self.node_ids)
+                self.node_ids.append(anon_id)
+                self.node_index[anon_id] = i
+            indices.append(i)
+        return indices
+
+    def nodes_frame(self) -> pl.DataFrame:
+        return pl.DataFrame(
+            {"index": range(self.nr_nodes), "id": self.node_ids},
+            schema={"index": pl.UInt32, "id": pl.Utf8},
+        )
+
+    def replace_out_edges(self, sources: Iterable[str], edges: pl.DataFrame):
+        """
+        Replace all the out-edges of channels `sources` with `edges`, which has columns
+        `source_id` and `target_id` with anonymised IDs, `kind` and `weight`.
+        """
+        ids = set(sources)
+        ids.update(edges["source_id"].unique().to_list())
+        ids.update(edges["target_id"].unique().to_list())
+        self.intern(sorted(ids))
+        nodes = self.nodes_frame()
+        new_edges = (
+            edges.join(nodes, left_on="source_id", right_on="id")
+            .rename({"index": "source"})
+            .join(nodes, left_on="target_id", right_on="id")
+            .rename({"index": "target"})
+            .select(
+                "source",
+                "target",
+                pl.col("kind").cast(EDGE_KINDS),
+                pl.col("weight").cast(pl.Int64),
+            )
+        )
+        source_indices = pl.Series(
+            [self.node_index[s] for s in sources], dtype=pl.UInt32
+        )
+        self.edges = pl.concat(
+            [self.edges.filter(~pl.col("source").is_in(source_indices)), new_edges]
+        ).sort("source", "target", "kind")
+
+    def update_channels(
+        self,
+        anon_ids: Iterable[str],
+        project_paths: ProjectPaths,
+        fs: AbstractFileSystem = LOCAL_FS,
+    ):
+        """
+        Update the out-edges of channels `anon_ids` from the channels dataset and their
+        forwards indices. Channels missing from the dataset lose their out-edges.
+        """
+        anon_ids = list(anon_ids)
+        chans_df = (
+            collegram.dataset.scan_channels(project_paths, channel_ids=anon_ids, fs=fs)
+            .select("id", "forwards_from", "recommended_channels")
+            .collect()
+        )
+        fwd_df = chans_df.select(source_id="id", target_id="forwards_from").explode(
+            "target_id"
+        )
+        nr_fwds = [
+            (anon_id, fwd_id, fwd_source.nr_forwards)
+            for anon_id in chans_df["id"]
+            for fwd_id, fwd_source in collegram.json.read_forwards_index(
+                ChannelPaths(anon_id, project_paths).forwards_index, fs=fs
+            ).items()
+        ]
+        nr_fwds_df = pl.DataFrame(
+            nr_fwds,
+            schema={"source_id": pl.Utf8, "target_id": pl.Utf8, "weight": pl.Int64},
+            orient="row",
+        )
+        # Channels forwarded from before forwards indices existed have no count.
+        fwd_df = (
+            fwd_df.join(
+                nr_fwds_df, on=["source_id", "target_id"], how="full", coalesce=True
+            )
+            .with_columns(pl.col("weight").fill_null(1), kind=pl.lit("forward"))
+            .drop_nulls("target_id")
+        )
+        rec_df = (
+            chans_df.select(source_id="id", target_id="recommended_channels")
+            .explode("target_id")
+            .drop_nulls("target_id")
+            .with_columns(weight=pl.lit(1), kind=pl.lit("recommendation"))
+        )
+        edges = pl.concat([fwd_df, rec_df], how="diagonal_relaxed").unique(
+            ["source_id", "target_id", "kind"]
+        )
+        self.replace_out_edges(anon_ids, edges)
+
+    @classmethod
+    def from_project(
+        cls, project_paths: ProjectPaths, fs: AbstractFileSystem = LOCAL_FS
+    ) -> ChannelGraph:
+        graph = cls()
+        anon_ids = (
+            collegram.dataset.scan_channels(project_paths, fs=fs)
+            .select("id")
+            .collect()["id"]
+        )
+        graph.update_channels(anon_ids, project_paths, fs=fs)
+        return graph
+
+    def to_edge_list(self) -> pl.DataFrame:
+        """
+        Get the edges with the anonymised IDs of their ends, as `source_id` and
+        `target_id`.
+        """
+        nodes = self.nodes_frame()
+        return (
+            self.edges.join(nodes, left_on="source", right_on="index")
+            .rename({"id": "source_id"})
+            .join(nodes, left_on="target", right_on="index")
+            .rename({"id": "target_id"})
+            .select("source_id", "target_id", "kind", "weight")
+        )
+
+    def to_csr(
+        self, kind: str | None = None
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Get the `indptr`, `indices` and `data` arrays of the graph's adjacency matrix
+        in the compressed sparse row format, as expected by `scipy.sparse.csr_array`.
+        If `kind` is None, weights of edges of different kinds between the same
+        channels are summed.
+        """
+        try:
+            import numpy as np
+        except ImportError as e:
+            raise ImportError("Exporting to CSR arrays requires numpy.") from e
+
+        if kind is None:
+            edges = (
+                self.edges.group_by("source", "target")
+                .agg(pl.col("weight").sum())
+                .sort("source", "target")
+            )
+        else:
+            edges = self.edges.filter(pl.col("kind") == kind)
+        sources = edges["source"].to_numpy()
+        indptr = np.zeros(self.nr_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=self.nr_nodes), out=indptr[1:])
+        return indptr, edges["target"].to_numpy(), edges["weight"].to_numpy()
+
+    def save(self, dir_path: Path, fs: AbstractFileSystem = LOCAL_FS):
+        collegram.parquet.write_parquet(
+            self.nodes_frame(), dir_path / "nodes.parquet", fs=fs
+        )
+        collegram.parquet.write_parquet(
+            self.edges, dir_path / "edges.parquet", fs=fs, profile=EDGES_WRITE_PROFILE
+        )
+
+    @classmethod
+    def load(cls, dir_path: Path, fs: AbstractFileSystem = LOCAL_FS) -> ChannelGraph:
+        with fs.open(str(dir_path / "nodes.parquet"), "rb") as f:
+            node_ids = pl.read_parquet(f).sort("index")["id"].to_list()
+        with fs.open(str(dir_path / "edges.parquet"), "rb") as f:
+            edges = pl.read_parquet(f).cast(EDGES_PL_SCHEMA)
+        return cls(node_ids, edges)
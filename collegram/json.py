@@ -1,17 +1,25 @@
 from __future__ import annotations
 
 import datetime
+import functools
 import inspect
-from typing import TYPE_CHECKING, Any, Optional, Union
+import itertools
+import mmap
+import re
+import typing
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Iterator, Optional, Union
+
+from pathlib import Path
 
 import msgspec
 import polars as pl
+from fsspec.implementations.local import LocalFileSystem
+from telethon.tl.tlobject import TLObject
 
 from collegram.utils import LOCAL_FS, py_to_pl_types
 
 if TYPE_CHECKING:
-    from pathlib import Path
-
     from fsspec import AbstractFileSystem
 
 
@@ -169,9 +177,80 @@ class Reaction(msgspec.Struct):
     document_id: Optional[int] = None
 
 
+class ForwardSource(msgspec.Struct):
+    """
+    Entry of a channel's forwards index: `id` and `reply_to` refer to an example message
+    forwarded from channel `channel_id`, and `nr_forwards` is the number of messages
+    forwarded from it.
+    """
+
+    channel_id: str
+    id: int
+    reply_to: Optional[int] = None
+    nr_forwards: int = 1
+
+
 MessageJSONDecodeType = Union[Message, MessageService]
 MESSAGE_JSON_DECODER = msgspec.json.Decoder(type=MessageJSONDecodeType)
 FAST_FORWARD_DECODER = msgspec.json.Decoder(type=MaybeForwardedMessage)
+FORWARDS_INDEX_DECODER = msgspec.json.Decoder(type=ForwardSource)
+
+
+def is_list_annotation(annot) -> bool:
+    """
+    Handles Optional args
+    """
+    return any(typing.get_origin(a) is list for a in (annot,) + typing.get_args(annot))
+
+
+@functools.lru_cache(maxsize=None)
+def get_tl_struct(tl_type: type[TLObject]) -> tuple[type[msgspec.Struct], tuple, tuple]:
+    """
+    Get a msgspec Struct mirroring what `tl_type.to_dict` outputs, along with the
+    attribute names to read from instances and the indices of vector fields.
+    """
+    # Telethon patches some types (like `Message`) with custom classes, and we may
+    # further subclass them (like `ExtendedMessage`), so find the generated class,
+    # whose name is the one put in "_" by `to_dict`.
+    gen_type = next(
+        t for t in tl_type.__mro__ if t.__module__.startswith("telethon.tl.types")
+    )
+    spec = inspect.getfullargspec(gen_type)
+    fields = tuple(spec.args[1:]) + tuple(getattr(tl_type, "extra_json_fields", ()))
+    # `to_dict` outputs empty lists for unset vectors, do the same.
+    vector_idx = tuple(
+        i for i, f in enumerate(fields) if is_list_annotation(spec.annotations.get(f))
+    )
+    struct = msgspec.defstruct(
+        gen_type.__name__,
+        [(f, Any) for f in fields],
+        tag=gen_type.__name__,
+        tag_field="_",
+    )
+    return struct, fields, vector_idx
+
+
+def tl_enc_hook(obj: Any):
+    """
+    Encoding hook converting Telethon objects to Structs, without going through
+    their `to_dict`. Nested objects are converted lazily as msgspec encounters them.
+    Fallbacks are the same as in Telethon's `to_json`.
+    """
+    if isinstance(obj, TLObject):
+        struct, fields, vector_idx = get_tl_struct(type(obj))
+        values = [getattr(obj, f) for f in fields]
+        for i in vector_idx:
+            if values[i] is None:
+                values[i] = []
+        return struct(*values)
+    return repr(obj)
+
+
+TL_JSON_ENCODER = msgspec.json.Encoder(enc_hook=tl_enc_hook)
+
+
+def encode_tl_object(obj: TLObject) -> bytes:
+    return TL_JSON_ENCODER.encode(obj)
 
 
 def read_messages_json(
@@ -200,6 +279,193 @@ def yield_message(
                 yield read_message(line, decoder)
 
 
+def append_forwards_index(
+    fwd_sources: dict[str, ForwardSource],
+    path: str | Path,
+    fs: AbstractFileSystem = LOCAL_FS,
+):
+    fs.mkdirs(str(Path(path).parent), exist_ok=True)
+    with fs.open(str(path), "ab") as f:
+        for fwd_source in fwd_sources.values():
+            f.write(msgspec.json.encode(fwd_source))
+            f.write(b"\n")
+
+
+def read_forwards_index(
+    path: str | Path,
+    fs: AbstractFileSystem = LOCAL_FS,
+) -> dict[str, ForwardSource]:
+    """
+    Read a forwards index, aggregating the entries of every source channel: the example
+    message is the last one saved, and the number of forwards are summed.
+    """
+    fwd_sources = {}
+    if fs.exists(str(path)):
+        with fs.open(str(path), "rb") as f:
+            entries = FORWARDS_INDEX_DECODER.decode_lines(f.read())
+        for e in entries:
+            prev = fwd_sources.get(e.channel_id)
+            if prev is not None:
+                e.nr_forwards += prev.nr_forwards
+            fwd_sources[e.channel_id] = e
+    return fwd_sources
+
+
+# Size of the byte chunks read at once, and thus rough upper bound on the memory taken
+# by the raw data when reading messages in batches.
+READ_CHUNK_SIZE = 2**24
+
+
+def yield_lines_chunks(
+    fpath: str | Path,
+    fs: AbstractFileSystem = LOCAL_FS,
+    chunk_size: int = READ_CHUNK_SIZE,
+    use_mmap: bool | None = None,
+) -> Iterator[bytes | memoryview]:
+    """
+    Yield chunks of about `chunk_size` bytes from a file, always ending on a line
+    boundary. Local files are memory-mapped by default, in which case the yielded
+    chunks are views that are only valid until the next one is yielded.
+    """
+    if use_mmap is None:
+        use_mmap = isinstance(fs, LocalFileSystem)
+    with fs.open(str(fpath), "rb") as f:
+        if use_mmap:
+            # Cannot mmap empty files.
+            if fs.size(str(fpath)) == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                with memoryview(mm) as view:
+                    start = 0
+                    size = len(mm)
+                    while start < size:
+                        end = mm.find(b"\n", start + chunk_size)
+                        end = size if end == -1 else end + 1
+                        with view[start:end] as chunk:
+                            yield chunk
+                        start = end
+        else:
+            remainder = b""
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                last_line_end = chunk.rfind(b"\n") + 1
+                if last_line_end == 0:
+                    remainder += chunk
+                    continue
+                yield remainder + chunk[:last_line_end]
+                remainder = chunk[last_line_end:]
+            if remainder:
+                yield remainder
+
+
+def yield_message_batches(
+    fpath: str | Path,
+    fs: AbstractFileSystem = LOCAL_FS,
+    decoder: msgspec.json.Decoder = MESSAGE_JSON_DECODER,
+    chunk_size: int = READ_CHUNK_SIZE,
+    use_mmap: bool | None = None,
+) -> Iterator[list]:
+    """
+    Yield lists of messages decoded from a JSONL file, reading it in chunks of bytes to
+    keep memory bounded while decoding many lines per call.
+    """
+    for chunk in yield_lines_chunks(
+        fpath, fs=fs, chunk_size=chunk_size, use_mmap=use_mmap
+    ):
+        batch = decoder.decode_lines(chunk)
+        if batch:
+            yield batch
+
+
+# Start of a top-level message. Quotes are escaped inside JSON strings, and no nested
+# object is tagged as a message, so this only matches where a message object starts.
+MESSAGE_START_PATTERN = re.compile(rb'\{"_": ?"Message(?:Service)?"')
+
+
+@dataclass
+class DecodeReport:
+    """
+    Counts of records decoded from a file: `nr_recovered` counts records that could
+    only be decoded after being split from a corrupted line, `nr_bad` the ones that
+    could not be decoded at all.
+    """
+
+    nr_decoded: int = 0
+    nr_recovered: int = 0
+    nr_bad: int = 0
+
+
+def split_on_message_starts(line: bytes) -> list[bytes]:
+    """
+    Split a corrupted line (like concatenated messages, or a truncated message followed
+    by a complete one) on the start of every message, keeping any leading garbage.
+    """
+    starts = [match.start() for match in MESSAGE_START_PATTERN.finditer(line)]
+    if not starts or starts[0] > 0:
+        starts.insert(0, 0)
+    bounds = zip(starts, starts[1:] + [len(line)])
+    return [line[start:end] for start, end in bounds if line[start:end].strip()]
+
+
+def yield_message_batches_tolerant(
+    fpath: str | Path,
+    fs: AbstractFileSystem = LOCAL_FS,
+    decoder: msgspec.json.Decoder = MESSAGE_JSON_DECODER,
+    quarantine_path: str | Path | None = None,
+    report: DecodeReport | None = None,
+    chunk_size: int = READ_CHUNK_SIZE,
+    use_mmap: bool | None = None,
+) -> Iterator[list]:
+    """
+    Same as `yield_message_batches`, but when a chunk fails to decode, decode it line by
+    line and recover the messages of the corrupted lines. Records that cannot be decoded
+    are written to `quarantine_path` if passed, and are counted in `report`. The source
+    file is never modified.
+    """
+    if report is None:
+        report = DecodeReport()
+    quarantine = None
+    try:
+        for chunk in yield_lines_chunks(
+            fpath, fs=fs, chunk_size=chunk_size, use_mmap=use_mmap
+        ):
+            try:
+                batch = decoder.decode_lines(chunk)
+                report.nr_decoded += len(batch)
+            except msgspec.DecodeError:
+                batch = []
+                for line in bytes(chunk).split(b"\n"):
+                    if not line.strip():
+                        continue
+                    try:
+                        batch.append(decoder.decode(line))
+                        report.nr_decoded += 1
+                        continue
+                    except msgspec.DecodeError:
+                        pass
+                    for record in split_on_message_starts(line):
+                        try:
+                            batch.append(decoder.decode(record))
+                            report.nr_recovered += 1
+                        except msgspec.DecodeError:
+                            report.nr_bad += 1
+                            if quarantine_path is not None:
+                                if quarantine is None:
+                                    fs.mkdirs(
+                                        str(Path(quarantine_path).parent), exist_ok=True
+                                    )
+                                    quarantine = fs.open(str(quarantine_path), "wb")
+                                quarantine.write(record)
+                                quarantine.write(b"\n")
+            if batch:
+                yield batch
+    finally:
+        if quarantine is not None:
+            quarantine.close()
+
+
 NEW_MSG_FIELDS = {
     "media_type": pl.Utf8,
     "media_id": pl.Int64,
@@ -243,113 +509,242 @@ def get_pl_schema():
     return msg_schema
 
 
+MEDIA_FIELDS = (
+    "media_type",
+    "media_id",
+    "webpage_preview_url",
+    "webpage_preview_type",
+    "webpage_preview_site_name",
+    "webpage_preview_title",
+    "webpage_preview_description",
+)
+NO_MEDIA_ROW = (None,) * len(MEDIA_FIELDS)
+OTHER_MEDIA_ROW = ("other",) + (None,) * (len(MEDIA_FIELDS) - 1)
+NO_PEER_ROW = (None, None)
+NO_FWD_ROW = (None, None, None, None)
+NO_REPLIES_ROW = (0, False)
+
+
+def get_media_row(media: MessageMediaTypes | None) -> tuple:
+    # TODO: save media separately? like whole JSON / parquets of photos / videos
+    # / web pages / documents
+    media_type = type(media)
+    if media is None:
+        return NO_MEDIA_ROW
+    elif media_type is MessageMediaWebPage:
+        w = media.webpage
+        return ("webpage", w.id, w.url, w.type, w.site_name, w.title, w.description)
+    elif media_type is MessageMediaPhoto:
+        return ("photo", media.photo.id) + NO_MEDIA_ROW[2:]
+    elif media_type is MessageMediaDocument:
+        if media.video:
+            doc_type = "video"
+        elif media.voice:
+            doc_type = "voice"
+        else:
+            doc_type = "document"
+        return (doc_type, media.document.id) + NO_MEDIA_ROW[2:]
+    return OTHER_MEDIA_ROW
+
+
+def get_peer_row(peer: Peer | None) -> tuple:
+    if peer is None:
+        return NO_PEER_ROW
+    return (peer._, getattr(peer, PEER_TYPES_ID[peer._]))
+
+
+def get_fwd_row(fwd_from: FwdFrom | None) -> tuple:
+    if fwd_from is None:
+        return NO_FWD_ROW
+    return (fwd_from.date, fwd_from.channel_post) + get_peer_row(fwd_from.from_id)
+
+
+def get_reply_to_row(reply_to: ReplyHeader | None) -> tuple:
+    if reply_to is None:
+        return NO_PEER_ROW
+    peer = reply_to.reply_to_peer_id
+    return (reply_to.reply_to_msg_id, None if peer is None else peer.channel_id)
+
+
+def get_replies_row(replies: Replies | None) -> tuple:
+    if replies is None:
+        return NO_REPLIES_ROW
+    return (replies.replies, replies.comments)
+
+
+def get_reactions_dict(reactions: Reactions | None) -> dict[str, int] | None:
+    if reactions is None:
+        return None
+    # There can be big number of different reactions, so keep this as dict
+    # (converted to struct by Polars).
+    reaction_d = {}
+    if reactions.results is not None:
+        for r in reactions.results:
+            # Cast `document_id` to string to have consistent type.
+            key = r.reaction.emoticon or str(r.reaction.document_id)
+            reaction_d[key] = r.count
+    return reaction_d
+
+
+def rows_to_columns(rows: list[tuple], fields: tuple[str, ...]) -> dict[str, list]:
+    return {f: [r[i] for r in rows] for i, f in enumerate(fields)}
+
+
 def messages_to_dict(messages: list[Message]):
+    """
+    Build the columns of the messages table from decoded messages. Each column, or
+    group of columns coming from the same nested field, is built in one pass over the
+    messages, instead of appending to every column for each message.
+    """
     # can also determine nested from Message.__annotations__, but not super robust
     non_nested_f = set(Message.__struct_fields__).difference(DISCARDED_MSG_FIELDS)
-    final_fields = non_nested_f.union(NEW_MSG_FIELDS.keys()).union(
-        CHANGED_MSG_FIELDS.keys()
+    m_dict = {field: [getattr(m, field) for m in messages] for field in non_nested_f}
+    m_dict.update(
+        rows_to_columns([get_media_row(m.media) for m in messages], MEDIA_FIELDS)
     )
-    m_dict = {field: [] for field in final_fields}
-    for m in messages:
-        for field in non_nested_f:
-            m_dict[field].append(getattr(m, field))
+    m_dict.update(
+        rows_to_columns(
+            [get_peer_row(m.from_id) for m in messages], ("from_type", "from_id")
+        )
+    )
+    m_dict.update(
+        rows_to_columns(
+            [get_reply_to_row(m.reply_to) for m in messages],
+            ("replies_to_msg_id", "replies_to_chan_id"),
+        )
+    )
+    m_dict.update(
+        rows_to_columns(
+            [get_fwd_row(m.fwd_from) for m in messages],
+            ("fwd_from_date", "fwd_from_msg_id", "fwd_from_type", "fwd_from_id"),
+        )
+    )
+    m_dict.update(
+        rows_to_columns(
+            [get_replies_row(m.replies) for m in messages],
+            ("nr_replies", "has_comments"),
+        )
+    )
+    m_dict["reactions"] = [get_reactions_dict(m.reactions) for m in messages]
+    return m_dict
 
-        media = m.media
-        if media is not None:
-            # TODO: save media separately? like whole JSON / parquets of photos / videos
-            # / web pages / documents
-            if isinstance(media, MessageMediaWebPage):
-                m_dict["media_type"].append("webpage")
-                m_dict["media_id"].append(media.webpage.id)
-                m_dict["webpage_preview_url"].append(media.webpage.url)
-                m_dict["webpage_preview_type"].append(media.webpage.type)
-                m_dict["webpage_preview_site_name"].append(media.webpage.site_name)
-                m_dict["webpage_preview_title"].append(media.webpage.title)
-                m_dict["webpage_preview_description"].append(media.webpage.description)
-            else:
-                if isinstance(media, MessageMediaPhoto):
-                    m_dict["media_type"].append("photo")
-                    m_dict["media_id"].append(media.photo.id)
-                elif isinstance(media, MessageMediaDocument):
-                    if media.video:
-                        m_dict["media_type"].append("video")
-                    elif media.voice:
-                        m_dict["media_type"].append("voice")
-                    else:
-                        m_dict["media_type"].append("document")
-                    m_dict["media_id"].append(media.document.id)
-                else:
-                    m_dict["media_type"].append("other")
-                    m_dict["media_id"].append(None)
-                m_dict["webpage_preview_url"].append(None)
-                m_dict["webpage_preview_type"].append(None)
-                m_dict["webpage_preview_site_name"].append(None)
-                m_dict["webpage_preview_title"].append(None)
-                m_dict["webpage_preview_description"].append(None)
-        else:
-            m_dict["media_type"].append(None)
-            m_dict["media_id"].append(None)
-            m_dict["webpage_preview_url"].append(None)
-            m_dict["webpage_preview_type"].append(None)
-            m_dict["webpage_preview_site_name"].append(None)
-            m_dict["webpage_preview_title"].append(None)
-            m_dict["webpage_preview_description"].append(None)
-
-        from_id = m.from_id
-        if from_id is not None:
-            m_dict["from_type"].append(from_id._)
-            m_dict["from_id"].append(getattr(from_id, PEER_TYPES_ID[from_id._]))
-        else:
-            m_dict["from_id"].append(None)
-            m_dict["from_type"].append(None)
-
-        reply_to = m.reply_to
-        m_dict["replies_to_msg_id"].append(getattr(reply_to, "reply_to_msg_id", None))
-        m_dict["replies_to_chan_id"].append(
-            None
-            if reply_to is None
-            else getattr(reply_to.reply_to_peer_id, "channel_id", None)
+
+def get_reactions_pl_dtype(reactions: list[dict | None]) -> pl.DataType:
+    # Take the union of all reactions as struct fields, in order of appearance.
+    keys = dict.fromkeys(k for r in reactions if r for k in r)
+    if len(keys) == 0:
+        return pl.Null
+    return pl.Struct({k: pl.Int64 for k in keys})
+
+
+def list_series(name: str, values: list[list | None], dtype: pl.List) -> pl.Series:
+    """
+    Build a list Series from flattened values and offsets, as converting many short
+    Python lists one by one is slow in Polars.
+    """
+    lengths = [0 if v is None else len(v) for v in values]
+    flat = pl.Series(
+        name, itertools.chain.from_iterable(filter(None, values)), dtype=dtype.inner
+    )
+    rows_df = pl.DataFrame(
+        {"len": lengths, "is_null": [v is None for v in values]},
+        schema={"len": pl.Int64, "is_null": pl.Boolean},
+    ).with_row_index("row")
+    # Group flattened values by the row they belong to, which only relies on
+    # operations available in all supported versions of Polars.
+    lists_df = (
+        rows_df.select(pl.col("row").repeat_by("len").explode().drop_nulls())
+        .with_columns(flat)
+        .group_by("row", maintain_order=True)
+        .agg(name)
+    )
+    return (
+        rows_df.join(lists_df, on="row", how="left", maintain_order="left")
+        .select(
+            pl.when(~pl.col("is_null"))
+            .then(pl.col(name).fill_null(pl.lit([], dtype=dtype)))
+            .alias(name)
         )
+        .to_series()
+    )
 
-        fwd_from = m.fwd_from
-        if fwd_from is not None:
-            m_dict["fwd_from_date"].append(fwd_from.date)
-            m_dict["fwd_from_msg_id"].append(fwd_from.channel_post)
-            if fwd_from.from_id is not None:
-                m_dict["fwd_from_type"].append(fwd_from.from_id._)
-                m_dict["fwd_from_id"].append(
-                    getattr(fwd_from.from_id, PEER_TYPES_ID[fwd_from.from_id._])
-                )
-            else:
-                m_dict["fwd_from_type"].append(None)
-                m_dict["fwd_from_id"].append(None)
-        else:
-            m_dict["fwd_from_date"].append(None)
-            m_dict["fwd_from_msg_id"].append(None)
-            m_dict["fwd_from_type"].append(None)
-            m_dict["fwd_from_id"].append(None)
-
-        replies = m.replies
-        if replies is not None:
-            m_dict["nr_replies"].append(replies.replies)
-            m_dict["has_comments"].append(replies.comments)
-        else:
-            m_dict["nr_replies"].append(0)
-            m_dict["has_comments"].append(False)
-
-        if m.reactions is not None:
-            # There can be big number of different reactions, so keep this as dict
-            # (converted to struct by Polars).
-            reaction_d = {}
-            if m.reactions.results is not None:
-                for r in m.reactions.results:
-                    # Cast `document_id` to string to have consistent type.
-                    key = r.reaction.emoticon or str(r.reaction.document_id)
-                    reaction_d[key] = r.count
-            m_dict["reactions"].append(reaction_d)
-        else:
-            m_dict["reactions"].append(None)
-    return m_dict
+
+def messages_to_df(
+    messages: list[Message], with_reactions: bool = True
+) -> pl.DataFrame:
+    """
+    Build the messages table following `get_pl_schema`, with its columns sorted, and
+    the fields of the `reactions` struct being all the reactions found in `messages`.
+    If `with_reactions` is False, the `reactions` column is left out, to be saved in
+    long format with `messages_to_reactions_df` instead.
+    """
+    m_dict = messages_to_dict(messages)
+    schema = get_pl_schema()
+    if with_reactions:
+        schema["reactions"] = get_reactions_pl_dtype(m_dict["reactions"])
+    else:
+        del schema["reactions"]
+        del m_dict["reactions"]
+    list_cols = [
+        list_series(f, m_dict.pop(f), dtype)
+        for f, dtype in schema.items()
+        if isinstance(dtype, pl.List)
+    ]
+    m_df = pl.DataFrame(
+        m_dict, schema={f: dtype for f, dtype in schema.items() if f in m_dict}
+    ).with_columns(list_cols)
+    return m_df.select(sorted(m_df.columns))
+
+
+REACTIONS_PL_SCHEMA = {
+    "message_id": pl.Int64,
+    "reaction": pl.Utf8,
+    "count": pl.Int64,
+    "queried_at": pl.Datetime(time_zone="UTC"),
+}
+
+
+def messages_to_reactions_df(
+    messages: list[Message], queried_at: datetime.datetime
+) -> pl.DataFrame:
+    """
+    Build a long-format table of reactions, with one row per message and reaction,
+    following `REACTIONS_PL_SCHEMA`. `queried_at` should be when the reaction counts
+    were collected.
+    """
+    rows = [
+        (m.id, reaction, count)
+        for m in messages
+        for reaction, count in (get_reactions_dict(m.reactions) or {}).items()
+    ]
+    columns = rows_to_columns(rows, ("message_id", "reaction", "count"))
+    columns["queried_at"] = [queried_at] * len(rows)
+    return pl.DataFrame(columns, schema=REACTIONS_PL_SCHEMA)
+
+
+def pivot_reactions(reactions_df: pl.DataFrame) -> pl.DataFrame:
+    """
+    Pivot a long-format table of reactions back to a `reactions` struct per message,
+    as in the messages table, with the message ID as `id`. Only the reaction counts of
+    the latest query of every message are kept. Any other column, like the ones of Hive
+    partitions, is kept as part of the index.
+    """
+    index = [
+        c for c in reactions_df.columns if c not in ("reaction", "count", "queried_at")
+    ]
+    latest_df = reactions_df.filter(
+        pl.col("queried_at") == pl.col("queried_at").max().over(index)
+    )
+    wide_df = latest_df.pivot(
+        on="reaction", index=index, values="count", aggregate_function="first"
+    )
+    reactions_cols = [c for c in wide_df.columns if c not in index]
+    if reactions_cols:
+        reactions = pl.struct(reactions_cols)
+    else:
+        # `pl.struct` needs at least one field, which an empty table does not have.
+        reactions = pl.lit(None, dtype=pl.Struct({}))
+    return wide_df.select(*index, reactions=reactions).rename({"message_id": "id"})
 
 
 def service_messages_to_dict(messages: list[MessageService]):
@@ -365,3 +760,21 @@ def service_messages_to_dict(messages: list[MessageService]):
         m_dict["action_type"].append(action_d.pop("_"))
         m_dict["action"].append(action_d)
     return m_dict
+
+
+SERVICE_MESSAGES_PL_SCHEMA = {
+    "id": pl.Int64,
+    "date": pl.Datetime(time_zone="UTC"),
+    "action_type": pl.Utf8,
+    "action": pl.Utf8,
+}
+
+
+def service_messages_to_df(messages: list[MessageService]) -> pl.DataFrame:
+    """
+    Build the service messages table following `SERVICE_MESSAGES_PL_SCHEMA`. As the
+    fields of `action` depend on its type, it is kept as a JSON string.
+    """
+    m_dict = service_messages_to_dict(messages)
+    m_dict["action"] = [msgspec.json.encode(a).decode() for a in m_dict["action"]]
+    return pl.DataFrame(m_dict, schema=SERVICE_MESSAGES_PL_SCHEMA)
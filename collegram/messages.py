@@ -40,7 +40,9 @@ from telethon.tl.types import (
 )
 from telethon.tl.types.messages import ChannelMessages
 
+import collegram.json
 import collegram.media
+import collegram.metrics
 from collegram.utils import LOCAL_FS
 
 if TYPE_CHECKING:
@@ -75,7 +77,11 @@ def get_comments_iter(
     message_id: int,
 ) -> Iterable[Message]:
     try:
-        return client.iter_messages(channel, reply_to=message_id)
+        return collegram.metrics.TimedPages(
+            client.iter_messages(channel, reply_to=message_id),
+            "telegram_request_seconds",
+            request="GetRepliesRequest",
+        )
     except MsgIdInvalidError:
         logger.error(f"no replies found for message ID {message_id}")
         breakpoint()
@@ -93,6 +99,7 @@ def yield_comments(
             yield c
 
 
+@collegram.metrics.timed("save_channel_messages_seconds")
 async def save_channel_messages(
     client: TelegramClient,
     channel: TypeInputChannel | Channel,
@@ -104,36 +111,83 @@ async def save_channel_messages(
     media_save_path: Path,
     offset_id=0,
     fs: AbstractFileSystem = LOCAL_FS,
+    forwards_index_path: Path | None = None,
 ):
     """
     TODO: add linking channels
     offset_id: messages with ID superior to `offset_id` will be retrieved
+    forwards_index_path: if passed, the channels forwarded from in the saved messages are
+    appended to the forwards index found at this path.
     """
-    # Telethon docs are misleading, `offset_date` is in fact a datetime.
-    with fs.open(messages_save_path, "a") as f:
-        async for message in client.iter_messages(
-            entity=channel,
-            offset_date=dt_from,
-            offset_id=offset_id,
-            reverse=True,
-        ):
-            # Take messages in until we've reached `dt_to` (works because
-            # `iter_messages` gets messages in reverse chronological order by default,
-            # and we reversed it)
-            if message.date <= dt_to:
-                preprocessed_m = preprocess(
-                    message,
-                    forwards_set,
-                    anon_func,
-                    media_save_path,
-                    fs=fs,
-                )
-                f.write(preprocessed_m.to_json())
-                f.write("\n")
-            else:
-                break
+    fwd_sources = {}
+    nr_messages = 0
+    nr_bytes = 0
+    try:
+        # Telethon docs are misleading, `offset_date` is in fact a datetime.
+        with fs.open(messages_save_path, "ab") as f:
+            messages = client.iter_messages(
+                entity=channel,
+                offset_date=dt_from,
+                offset_id=offset_id,
+                reverse=True,
+            )
+            async for message in collegram.metrics.TimedPages(
+                messages, "telegram_request_seconds", request="GetHistoryRequest"
+            ):
+                # Take messages in until we've reached `dt_to` (works because
+                # `iter_messages` gets messages in reverse chronological order by
+                # default, and we reversed it)
+                if message.date <= dt_to:
+                    preprocessed_m = preprocess(
+                        message,
+                        forwards_set,
+                        anon_func,
+                        media_save_path,
+                        fs=fs,
+                    )
+                    encoded_m = collegram.json.encode_tl_object(preprocessed_m)
+                    f.write(encoded_m)
+                    f.write(b"\n")
+                    nr_messages += 1
+                    nr_bytes += len(encoded_m) + 1
+                    update_fwd_sources(fwd_sources, preprocessed_m)
+                else:
+                    break
+    finally:
+        collegram.metrics.REGISTRY.inc("messages_saved_total", nr_messages)
+        collegram.metrics.REGISTRY.inc("messages_bytes_written_total", nr_bytes)
+        # Also save what we got in case of interruption, since these messages will not
+        # be queried again.
+        # Written even without any forward, so that an existing index means the
+        # channel's messages are indexed.
+        if forwards_index_path is not None:
+            collegram.json.append_forwards_index(
+                fwd_sources, forwards_index_path, fs=fs
+            )
+
+
+def update_fwd_sources(
+    fwd_sources: dict[str, collegram.json.ForwardSource],
+    message: ExtendedMessage | MessageService,
+):
+    """
+    Record in `fwd_sources` the channel `message` was forwarded from, if any. Should be
+    called after anonymisation, so the keys are anonymised channel IDs.
+    """
+    fwd_from = getattr(message, "fwd_from", None)
+    from_chan_id = getattr(getattr(fwd_from, "from_id", None), "channel_id", None)
+    if from_chan_id is not None:
+        fwd_source = fwd_sources.get(from_chan_id)
+        if fwd_source is None:
+            reply_to = getattr(message.reply_to, "reply_to_msg_id", None)
+            fwd_sources[from_chan_id] = collegram.json.ForwardSource(
+                channel_id=from_chan_id, id=message.id, reply_to=reply_to
+            )
+        else:
+            fwd_source.nr_forwards += 1
 
 
+@collegram.metrics.timed("telegram_request_seconds", request="messages.SearchRequest")
 def query_channel_messages(
     client: TelegramClient,
     channel: TypeInputChannel | Channel,
@@ -309,6 +363,8 @@ MESSAGE_INIT_ARGS = inspect.getfullargspec(Message).args[1:]
 class ExtendedMessage(Message):
     # Created this class because m.reply_msg_id did not match the commented-on message's
     # id, so need to save the info somehow.
+    # Fields not in Telethon's `Message` which will be encoded by `collegram.json`:
+    extra_json_fields = ("text_urls", "text_mentions")
 
     @classmethod
     def from_message(
@@ -0,0 +1,329 @@
+from __future__ import annotations
+
+import bisect
+import contextlib
+import functools
+import inspect
+import json
+import logging
+import math
+import re
+import threading
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Iterator
+
+from telethon.errors import FloodWaitError
+
+from collegram.utils import LOCAL_FS
+
+if TYPE_CHECKING:
+    from fsspec import AbstractFileSystem
+
+logger = logging.getLogger(__name__)
+
+# In seconds, from fast API calls to full channel collections.
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 1800, math.inf)
+PROMETHEUS_PREFIX = "collegram_"
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def to_dict(self) -> dict:
+        cumulative_counts = []
+        total = 0
+        for c in self.bucket_counts:
+            total += c
+            cumulative_counts.append(total)
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": {str(b): c for b, c in zip(self.buckets, cumulative_counts)},
+        }
+
+
+def format_labels(labels: tuple[tuple[str, str], ...], **extra_labels) -> str:
+    labels = labels + tuple(extra_labels.items())
+    if len(labels) == 0:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class MetricsRegistry:
+    """
+    Thread-safe registry of counters and histograms, identified by a name and labels
+    passed as keyword arguments, like `registry.inc("requests_total", request="X")`.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters: dict[str, dict[tuple, float]] = {}
+        self.histograms: dict[str, dict[tuple, Histogram]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            series.setdefault(key, Histogram()).observe(value)
+
+    @contextlib.contextmanager
+    def timer(self, name: str, **labels) -> Iterator[None]:
+        """
+        Observe the duration of the block in histogram `name`, with an `outcome` label
+        telling whether it raised.
+        """
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            yield
+            outcome = "ok"
+        finally:
+            self.observe(name, time.perf_counter() - start, outcome=outcome, **labels)
+
+    def clear(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {
+                "counters": {
+                    name: [{"labels": dict(k), "value": v} for k, v in series.items()]
+                    for name, series in self.counters.items()
+                },
+                "histograms": {
+                    name: [
+                        {"labels": dict(k), **h.to_dict()} for k, h in series.items()
+                    ]
+                    for name, series in self.histograms.items()
+                },
+            }
+
+    def to_prometheus(self) -> str:
+        """
+        Export all metrics in the Prometheus text format.
+        """
+        lines = []
+        with self.lock:
+            for name, series in sorted(self.counters.items()):
+                name = PROMETHEUS_PREFIX + name
+                lines.append(f"# TYPE {name} counter")
+                for k, v in series.items():
+                    lines.append(f"{name}{format_labels(k)} {v}")
+            for name, series in sorted(self.histograms.items()):
+                name = PROMETHEUS_PREFIX + name
+                lines.append(f"# TYPE {name} histogram")
+                for k, h in series.items():
+                    for b, c in h.to_dict()["buckets"].items():
+                        le = "+Inf" if b == "inf" else b
+                        lines.append(f"{name}_bucket{format_labels(k, le=le)} {c}")
+                    lines.append(f"{name}_sum{format_labels(k)} {h.sum}")
+                    lines.append(f"{name}_count{format_labels(k)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: Path, fs: AbstractFileSystem = LOCAL_FS):
+        """
+        Write all metrics to `path`, as JSON if it has a ".json" suffix, in the
+        Prometheus text format otherwise. The file is replaced at once, so it can be
+        read at any time.
+        """
+        path = Path(path)
+        if path.suffix == ".json":
+            content = json.dumps({"time": time.time(), **self.to_dict()})
+        else:
+            content = self.to_prometheus()
+        fs.mkdirs(str(path.parent), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with fs.open(tmp_path, "w") as f:
+            f.write(content)
+        fs.mv(tmp_path, str(path))
+
+
+REGISTRY = MetricsRegistry()
+
+
+def timed(name: str, registry: MetricsRegistry | None = None, **labels):
+    """
+    Decorator observing the duration of every call of a function, or coroutine
+    function, in histogram `name` of `registry`, the global one by default.
+    """
+
+    def decorator(func: Callable) -> Callable:
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with (registry or REGISTRY).timer(name, **labels):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with (registry or REGISTRY).timer(name, **labels):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class TimedPages:
+    """
+    Wrap `iterator`, paging through the results of a Telegram request `page_size` at a
+    time like the ones returned by `TelegramClient.iter_messages`, to observe the time
+    waited for every page in histogram `name`, with an `outcome` label, and count the
+    flood waits too long to be slept through in "flood_wait_errors_total". Can be
+    iterated over synchronously or asynchronously, like the iterator it wraps.
+    """
+
+    def __init__(
+        self,
+        iterator,
+        name: str,
+        page_size: int = 100,
+        registry: MetricsRegistry | None = None,
+        **labels,
+    ):
+        self.iterator = iterator
+        self.name = name
+        self.page_size = page_size
+        self.registry = registry or REGISTRY
+        self.labels = labels
+        self.elapsed = 0.0
+        self.nr_waits = 0
+
+    def observe_page(self, outcome: str):
+        self.registry.observe(self.name, self.elapsed, outcome=outcome, **self.labels)
+        self.elapsed = 0.0
+        self.nr_waits = 0
+
+    def add_wait(self, start: float):
+        self.elapsed += time.perf_counter() - start
+        self.nr_waits += 1
+        if self.nr_waits == self.page_size:
+            self.observe_page("ok")
+
+    @contextlib.contextmanager
+    def timer(self) -> Iterator[None]:
+        outcome = "ok"
+        try:
+            yield
+        except Exception as e:
+            outcome = "error"
+            if isinstance(e, FloodWaitError):
+                self.registry.inc("flood_wait_errors_total", **self.labels)
+            raise
+        finally:
+            # Last page, or the one iteration was stopped in.
+            if self.nr_waits > 0:
+                self.observe_page(outcome)
+
+    async def __aiter__(self):
+        iterator = self.iterator.__aiter__()
+        with self.timer():
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = await iterator.__anext__()
+                except StopAsyncIteration:
+                    return
+                finally:
+                    self.add_wait(start)
+                yield item
+
+    def __iter__(self):
+        iterator = iter(self.iterator)
+        with self.timer():
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    self.add_wait(start)
+                yield item
+
+
+class PeriodicExporter:
+    """
+    Write the metrics of `registry` to `path` every `interval` seconds in a background
+    thread, and once more when stopped. Can be used as a context manager.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        interval: float = 60,
+        registry: MetricsRegistry | None = None,
+        fs: AbstractFileSystem = LOCAL_FS,
+    ):
+        self.path = path
+        self.interval = interval
+        self.registry = registry or REGISTRY
+        self.fs = fs
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.export()
+
+    def export(self):
+        try:
+            self.registry.write(self.path, fs=self.fs)
+        except Exception:
+            logger.exception(f"could not export metrics to {self.path}")
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.export()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class FloodWaitHandler(logging.Handler):
+    """
+    Logging handler counting the flood waits Telethon sleeps through, and the time
+    spent in them, from its log records. To add to the "telethon" logger.
+    """
+
+    pattern = re.compile(r"^Sleeping(?: early)? for (\d+)s \(.*\) on (\w+) flood wait")
+
+    def __init__(self, registry: MetricsRegistry | None = None):
+        super().__init__()
+        self.registry = registry or REGISTRY
+
+    def emit(self, record: logging.LogRecord):
+        match = self.pattern.match(record.getMessage())
+        if match is not None:
+            seconds, request = match.groups()
+            self.registry.inc("flood_waits_total", request=request)
+            self.registry.inc("flood_wait_seconds_total", int(seconds), request=request)
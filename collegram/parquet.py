@@ -0,0 +1,573 @@
+from __future__ import annotations
+
+import logging
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Iterable
+
+import polars as pl
+
+import collegram.channels
+import collegram.dataset
+import collegram.json
+import collegram.metrics
+import collegram.text
+import collegram.urls
+import collegram.users
+from collegram.paths import (
+    ChannelPaths,
+    ProjectPaths,
+    get_bin_partition,
+    get_prefix_partition,
+)
+from collegram.utils import LOCAL_FS
+
+if TYPE_CHECKING:
+    from fsspec import AbstractFileSystem
+    from lingua import LanguageDetector
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ParquetWriteProfile:
+    """
+    Settings with which tables are written to Parquet. Rows are sorted by the columns of
+    `sort_by` found in the table, so that the statistics of row groups are selective
+    on these columns, and scans filtering on them can skip most row groups.
+    """
+
+    compression: str = "zstd"
+    compression_level: int | None = 6
+    row_group_size: int | None = 2**16
+    statistics: bool | str = True
+    sort_by: tuple[str, ...] = ()
+
+    def write(self, df: pl.DataFrame, path: Path, fs: AbstractFileSystem = LOCAL_FS):
+        sort_by = [c for c in self.sort_by if c in df.columns]
+        if len(sort_by) > 0:
+            df = df.sort(sort_by, maintain_order=True)
+        fs.mkdirs(str(Path(path).parent), exist_ok=True)
+        with fs.open(str(path), "wb") as f:
+            df.write_parquet(
+                f,
+                compression=self.compression,
+                compression_level=self.compression_level,
+                statistics=self.statistics,
+                row_group_size=self.row_group_size,
+            )
+
+
+DEFAULT_WRITE_PROFILE = ParquetWriteProfile()
+MESSAGES_WRITE_PROFILE = ParquetWriteProfile(sort_by=("date", "id"))
+REACTIONS_WRITE_PROFILE = ParquetWriteProfile(sort_by=("message_id", "reaction"))
+IDS_WRITE_PROFILE = ParquetWriteProfile(sort_by=("id",))
+MEMBERSHIPS_WRITE_PROFILE = ParquetWriteProfile(sort_by=("channel_id", "user_id"))
+URLS_WRITE_PROFILE = ParquetWriteProfile(sort_by=("domain", "url", "id"))
+
+
+@dataclass
+class ConversionReport:
+    """
+    Outcome of the conversion of a channel, or of a batch of channels, `item`. `result`
+    holds anything the conversion returns, `error` the traceback if it failed, and
+    `duration` how long it took, in seconds.
+    """
+
+    item: Any
+    nr_files: int = 0
+    nr_rows: int = 0
+    nr_recovered: int = 0
+    nr_bad: int = 0
+    error: str | None = None
+    result: Any = None
+    duration: float = 0.0
+
+
+@dataclass
+class ConversionSummary:
+    nr_items: int = 0
+    nr_files: int = 0
+    nr_rows: int = 0
+    nr_recovered: int = 0
+    nr_bad: int = 0
+    failed_items: list = field(default_factory=list)
+
+    def add(self, report: ConversionReport):
+        self.nr_items += 1
+        self.nr_files += report.nr_files
+        self.nr_rows += report.nr_rows
+        self.nr_recovered += report.nr_recovered
+        self.nr_bad += report.nr_bad
+        if report.error is not None:
+            self.failed_items.append(report.item)
+
+
+def read_messages(
+    fpath: str | Path,
+    chan_paths: ChannelPaths,
+    fs: AbstractFileSystem = LOCAL_FS,
+    report: collegram.json.DecodeReport | None = None,
+) -> tuple[list[collegram.json.Message], list[collegram.json.MessageService]]:
+    """
+    Read the raw messages saved at `fpath`, returning separately the normal messages
+    and the service ones.
+    """
+    messages = []
+    service_messages = []
+    for batch in collegram.json.yield_message_batches_tolerant(
+        fpath,
+        fs=fs,
+        quarantine_path=chan_paths.messages_quarantine / Path(fpath).name,
+        report=report,
+    ):
+        for m in batch:
+            if isinstance(m, collegram.json.MessageService):
+                service_messages.append(m)
+            # For backwards compatibility, ignore comments, marked with non-null
+            # `comments_msg_id.` Could also go back to historical raw data to
+            # remove all of these messages.
+            elif m.comments_msg_id is None:
+                messages.append(m)
+    return messages, service_messages
+
+
+def convert_channel_messages(
+    anon_id: str,
+    project_paths: ProjectPaths,
+    fs: AbstractFileSystem = LOCAL_FS,
+    reactions_as_table: bool = False,
+) -> ConversionReport:
+    """
+    Convert the raw messages of a channel to its partitions of the messages, service
+    messages and URLs datasets. Every raw bin has its own partition, so only the
+    partitions of the bins modified since they were last converted are rebuilt, after
+    which the counts of the domains linked to by the channel are updated. If
+    `reactions_as_table`, reactions are saved in their own long-format dataset instead
+    of as a struct column.
+    """
+    chan_paths = ChannelPaths(anon_id, project_paths)
+    report = ConversionReport(anon_id)
+    for fpath in fs.glob(str(chan_paths.messages / "*.jsonl")):
+        bin_partition = get_bin_partition(fpath)
+        partition_path = chan_paths.messages_partitions / bin_partition
+        service_path = chan_paths.service_messages_partitions / bin_partition
+        reactions_path = chan_paths.reactions_partitions / bin_partition
+        urls_path = chan_paths.urls_partitions / bin_partition
+        raw_modified_at = fs.modified(fpath)
+        is_converted = all(
+            fs.exists(str(p)) and fs.modified(str(p)) > raw_modified_at
+            for p in [partition_path, service_path, urls_path]
+            + ([reactions_path] if reactions_as_table else [])
+        ) and (
+            # A partition written with the other `reactions_as_table` must be rebuilt.
+            has_column(partition_path, "reactions", fs=fs) != reactions_as_table
+        )
+        if is_converted:
+            continue
+
+        decode_report = collegram.json.DecodeReport()
+        messages, service_messages = read_messages(
+            fpath, chan_paths, fs=fs, report=decode_report
+        )
+        if decode_report.nr_recovered > 0 or decode_report.nr_bad > 0:
+            logger.warning(
+                f"{fpath}: recovered {decode_report.nr_recovered} messages from "
+                f"corrupted lines, quarantined {decode_report.nr_bad} bad records"
+            )
+        report.nr_recovered += decode_report.nr_recovered
+        report.nr_bad += decode_report.nr_bad
+
+        # Also save empty tables, to know this bin has been converted.
+        m_df = collegram.json.messages_to_df(
+            messages, with_reactions=not reactions_as_table
+        ).unique("id", keep="last", maintain_order=True)
+        write_parquet(m_df, partition_path, fs=fs, profile=MESSAGES_WRITE_PROFILE)
+
+        s_df = collegram.json.service_messages_to_df(service_messages).unique(
+            "id", keep="last", maintain_order=True
+        )
+        write_parquet(s_df, service_path, fs=fs, profile=MESSAGES_WRITE_PROFILE)
+
+        u_df = collegram.urls.messages_to_urls_df(m_df)
+        write_parquet(u_df, urls_path, fs=fs, profile=URLS_WRITE_PROFILE)
+
+        if reactions_as_table:
+            # The raw file was last written right after the reactions were queried.
+            r_df = collegram.json.messages_to_reactions_df(
+                messages, raw_modified_at
+            ).unique(["message_id", "reaction"], keep="last", maintain_order=True)
+            write_parquet(r_df, reactions_path, fs=fs, profile=REACTIONS_WRITE_PROFILE)
+        elif fs.exists(str(reactions_path)):
+            # Reactions are now in the messages table, so this would be stale.
+            fs.rm(str(reactions_path))
+
+        report.nr_files += 1
+        report.nr_rows += m_df.height + s_df.height
+
+    if report.nr_files > 0 or not fs.exists(str(chan_paths.channel_domains)):
+        urls_files = fs.glob(str(chan_paths.urls_partitions / "month=*" / "*.parquet"))
+        urls_lf = collegram.dataset.scan_files(
+            sorted(urls_files), collegram.urls.URLS_PL_SCHEMA, fs=fs
+        )
+        domains_df = collegram.urls.count_channel_domains(urls_lf).collect()
+        write_parquet(domains_df, chan_paths.channel_domains, fs=fs)
+    return report
+
+
+MESSAGE_LANGS_PL_SCHEMA = {"id": pl.Int64, "lang": pl.Utf8}
+
+
+def convert_channel_message_langs(
+    anon_id: str,
+    project_paths: ProjectPaths,
+    lang_detector: LanguageDetector,
+    min_nr_chars: int = 20,
+    fs: AbstractFileSystem = LOCAL_FS,
+) -> ConversionReport:
+    """
+    Detect the language of the messages of a channel, from its partitions of the
+    messages dataset to its partitions of the message languages dataset. Messages are
+    first cleaned of URLs, mentions and hashtags, and those left with fewer than
+    `min_nr_chars` characters get no language. Only the partitions of the bins
+    converted since their languages were last detected are rebuilt.
+    """
+    chan_paths = ChannelPaths(anon_id, project_paths)
+    report = ConversionReport(anon_id)
+    for fpath in fs.glob(str(chan_paths.messages_partitions / "month=*" / "*.parquet")):
+        langs_path = chan_paths.message_langs_partitions / get_bin_partition(fpath)
+        if fs.exists(str(langs_path)) and fs.modified(str(langs_path)) > fs.modified(
+            fpath
+        ):
+            continue
+
+        with fs.open(fpath, "rb") as f:
+            m_df = pl.read_parquet(f, columns=["id", "message"])
+        text_df = m_df.select(
+            "id", text=collegram.text.clean_text_expr(pl.col("message"))
+        ).filter(pl.col("text").str.len_chars() >= min_nr_chars)
+        langs = collegram.text.detect_texts_langs(
+            text_df["text"].to_list(), lang_detector
+        )
+        langs_df = m_df.select("id").join(
+            text_df.select("id", lang=pl.Series(langs, dtype=pl.Utf8)),
+            on="id",
+            how="left",
+        )
+        write_parquet(langs_df, langs_path, fs=fs, profile=IDS_WRITE_PROFILE)
+        report.nr_files += 1
+        report.nr_rows += langs_df.height
+    return report
+
+
+def flatten_channels(
+    anon_ids: Iterable[str],
+    project_paths: ProjectPaths,
+    fs: AbstractFileSystem = LOCAL_FS,
+) -> ConversionReport:
+    """
+    Flatten the raw data of channels `anon_ids` into a DataFrame following
+    `collegram.channels.get_pl_schema`, and their participants into a DataFrame following
+    `get_participants_pl_schema`, returned together as the report's `result`.
+    """
+    anon_ids = list(anon_ids)
+    report = ConversionReport(anon_ids[0] if len(anon_ids) == 1 else tuple(anon_ids))
+    flat_chans = []
+    flat_participants = []
+    for anon_id in anon_ids:
+        c = collegram.channels.load(anon_id, project_paths, fs=fs)
+        if "last_queried_at" not in c:
+            c["last_queried_at"] = collegram.channels.get_saved_at(
+                anon_id, project_paths, fs=fs
+            )
+        participants = c.pop("participants", None) or []
+        flat_c = collegram.channels.flatten_dict(c)
+        flat_chans.append(flat_c)
+        for p in participants:
+            flat_p = collegram.users.flatten_dict(p)
+            flat_p["channel_id"] = anon_id
+            flat_p["seen_at"] = flat_c["last_queried_at"]
+            flat_participants.append(flat_p)
+        report.nr_files += 1
+    chans_df = pl.DataFrame(flat_chans, schema=collegram.channels.get_pl_schema())
+    participants_df = pl.DataFrame(
+        flat_participants, schema=get_participants_pl_schema()
+    )
+    report.result = (chans_df, participants_df)
+    report.nr_rows = chans_df.height
+    return report
+
+
+def get_participants_pl_schema():
+    return {
+        **collegram.users.get_pl_schema(),
+        "channel_id": pl.Utf8,
+        "seen_at": pl.Datetime,
+    }
+
+
+MEMBERSHIPS_PL_SCHEMA = {
+    "user_id": pl.Utf8,
+    "channel_id": pl.Utf8,
+    "first_seen": pl.Datetime,
+    "last_seen": pl.Datetime,
+}
+
+
+def take_channels_journal(
+    project_paths: ProjectPaths, fs: AbstractFileSystem = LOCAL_FS
+) -> tuple[list[str], list[str]]:
+    """
+    Rotate the journal of changed channels, so that channels saved from now on are
+    recorded for the next conversion. Return the IDs of the changed channels, and the
+    paths of the rotated journals to remove once these are converted. Journals left by
+    previous runs that did not complete are also taken.
+    """
+    journal = project_paths.channels_journal
+    if fs.exists(str(journal)):
+        rotated = journal.with_name(f"{journal.stem}.{time.time_ns()}{journal.suffix}")
+        fs.mv(str(journal), str(rotated))
+    rotated_paths = sorted(
+        fs.glob(str(journal.with_name(f"{journal.stem}.*{journal.suffix}")))
+    )
+    anon_ids = set()
+    for p in rotated_paths:
+        anon_ids.update(fs.read_text(p).split())
+    return sorted(anon_ids), rotated_paths
+
+
+def group_by_partition(anon_ids: Iterable[str]) -> list[tuple[str, ...]]:
+    partitions = {}
+    for anon_id in anon_ids:
+        partitions.setdefault(get_prefix_partition(anon_id), []).append(anon_id)
+    return [tuple(ids) for ids in partitions.values()]
+
+
+def upsert_channels_partition(
+    anon_ids: tuple[str, ...],
+    project_paths: ProjectPaths,
+    fs: AbstractFileSystem = LOCAL_FS,
+) -> ConversionReport:
+    """
+    Replace the rows of channels `anon_ids`, which must all belong to the same partition
+    of the channels dataset, with their current data, and update their memberships.
+    Channels whose raw data was erased are removed from both. The latest attributes of
+    their participants, to pass to `upsert_users`, are returned as the report's
+    `result`.
+    """
+    chan_paths = ChannelPaths(anon_ids[0], project_paths)
+    saved_ids = [
+        i for i in anon_ids if collegram.channels.exists(i, project_paths, fs=fs)
+    ]
+    report = flatten_channels(saved_ids, project_paths, fs=fs)
+    report.item = anon_ids
+    new_chans_df, participants_df = report.result
+
+    chans_df = read_parquet_or_empty(
+        chan_paths.channels_partition, collegram.channels.get_pl_schema(), fs=fs
+    ).filter(~pl.col("id").is_in(anon_ids))
+    chans_df = pl.concat([chans_df, new_chans_df], how="diagonal_relaxed")
+    write_parquet(
+        chans_df, chan_paths.channels_partition, fs=fs, profile=IDS_WRITE_PROFILE
+    )
+
+    # Members who were not seen in the latest query keep their previous `last_seen`.
+    erased_ids = set(anon_ids).difference(saved_ids)
+    memberships_df = (
+        pl.concat(
+            [
+                read_parquet_or_empty(
+                    chan_paths.memberships_partition, MEMBERSHIPS_PL_SCHEMA, fs=fs
+                ).filter(~pl.col("channel_id").is_in(erased_ids)),
+                participants_df.select(
+                    user_id="id",
+                    channel_id="channel_id",
+                    first_seen="seen_at",
+                    last_seen="seen_at",
+                ),
+            ],
+            how="diagonal_relaxed",
+        )
+        .group_by("channel_id", "user_id")
+        .agg(pl.col("first_seen").min(), pl.col("last_seen").max())
+        .select(MEMBERSHIPS_PL_SCHEMA.keys())
+    )
+    write_parquet(
+        memberships_df,
+        chan_paths.memberships_partition,
+        fs=fs,
+        profile=MEMBERSHIPS_WRITE_PROFILE,
+    )
+
+    report.result = (
+        participants_df.drop("channel_id")
+        .rename({"seen_at": "last_seen"})
+        .sort("last_seen")
+        .unique("id", keep="last")
+    )
+    return report
+
+
+def upsert_users(
+    users_df: pl.DataFrame,
+    project_paths: ProjectPaths,
+    fs: AbstractFileSystem = LOCAL_FS,
+) -> int:
+    """
+    Update the users dataset, partitioned like the channels one by the first characters
+    of IDs, with `users_df`, so that it holds the latest attributes of every user as of
+    `last_seen`. Return the number of partitions updated.
+    """
+    users_df = users_df.sort("last_seen").unique("id", keep="last")
+    schema = {**collegram.users.get_pl_schema(), "last_seen": pl.Datetime}
+    partitions = users_df.with_columns(prefix=pl.col("id").str.slice(0, 2)).group_by(
+        "prefix"
+    )
+    nr_partitions = 0
+    for (prefix,), new_df in partitions:
+        partition_path = project_paths.users_dataset / get_prefix_partition(prefix)
+        df = (
+            pl.concat(
+                [
+                    read_parquet_or_empty(partition_path, schema, fs=fs),
+                    new_df.drop("prefix"),
+                ],
+                how="diagonal_relaxed",
+            )
+            .sort("last_seen")
+            .unique("id", keep="last")
+        )
+        write_parquet(df, partition_path, fs=fs, profile=IDS_WRITE_PROFILE)
+        nr_partitions += 1
+    return nr_partitions
+
+
+def read_parquet_or_empty(
+    path: Path, schema: dict, fs: AbstractFileSystem = LOCAL_FS
+) -> pl.DataFrame:
+    if not fs.exists(str(path)):
+        return pl.DataFrame(schema=schema)
+    with fs.open(str(path), "rb") as f:
+        return pl.read_parquet(f)
+
+
+def has_column(path: Path, column: str, fs: AbstractFileSystem = LOCAL_FS) -> bool:
+    with fs.open(str(path), "rb") as f:
+        return column in pl.read_parquet_schema(f)
+
+
+def write_parquet(
+    df: pl.DataFrame,
+    path: Path,
+    fs: AbstractFileSystem = LOCAL_FS,
+    profile: ParquetWriteProfile = DEFAULT_WRITE_PROFILE,
+):
+    profile.write(df, path, fs=fs)
+
+
+def init_worker(max_memory: int | None = None, nr_threads: int | None = None):
+    if nr_threads is not None:
+        # Polars' thread pool is only started on first use, so this is still effective.
+        os.environ["POLARS_MAX_THREADS"] = str(nr_threads)
+    if max_memory is not None:
+        import resource
+
+        resource.setrlimit(resource.RLIMIT_AS, (max_memory, max_memory))
+
+
+def run_safely(func: Callable[..., ConversionReport], item, **kwargs):
+    start = time.perf_counter()
+    try:
+        report = func(item, **kwargs)
+    except Exception:
+        # Includes MemoryError raised when hitting the worker's memory limit.
+        report = ConversionReport(item, error=traceback.format_exc())
+    report.duration = time.perf_counter() - start
+    return report
+
+
+def map_channels(
+    func: Callable[..., ConversionReport],
+    items: Iterable,
+    nr_workers: int | None = None,
+    max_memory_per_worker: int | None = None,
+    nr_threads_per_worker: int | None = 1,
+    progress: Callable[[ConversionReport], Any] | None = None,
+    **func_kwargs,
+) -> tuple[ConversionSummary, list[ConversionReport]]:
+    """
+    Run `func(item, **func_kwargs)` for every item, typically anonymised channel IDs,
+    in a pool of `nr_workers` processes (all CPUs by default, and no pool if 1).
+
+    Parameters
+    ----------
+    func : Callable[..., ConversionReport]
+        Conversion function, like `convert_channel_messages`. Must be importable, as it
+        is sent to the worker processes.
+    items : Iterable
+    nr_workers : int | None, optional
+    max_memory_per_worker : int | None, optional
+        Maximum size in bytes of the address space of every worker. When it is reached,
+        the conversion of the current item fails and is reported as such.
+    nr_threads_per_worker : int | None, optional
+        Number of threads Polars can use in every worker. 1 by default, as the
+        parallelism comes from the workers. If None, Polars' default is used.
+    progress : Callable[[ConversionReport], Any] | None, optional
+        Called with the report of every item once it is done, in completion order.
+
+    Returns
+    -------
+    tuple[ConversionSummary, list[ConversionReport]]
+        Summary of all conversions, and their individual reports in completion order.
+    """
+    summary = ConversionSummary()
+    reports = []
+
+    def add_report(report: ConversionReport):
+        summary.add(report)
+        reports.append(report)
+        # Workers have their own registry, so metrics are recorded here from reports.
+        outcome = "ok" if report.error is None else "error"
+        registry = collegram.metrics.REGISTRY
+        registry.observe(
+            "conversion_seconds",
+            report.duration,
+            function=func.__name__,
+            outcome=outcome,
+        )
+        registry.inc("conversion_files_total", report.nr_files, function=func.__name__)
+        registry.inc("conversion_rows_total", report.nr_rows, function=func.__name__)
+        if report.error is not None:
+            logger.error(f"conversion of {report.item} failed:\n{report.error}")
+        if progress is not None:
+            progress(report)
+
+    if nr_workers == 1:
+        for item in items:
+            add_report(run_safely(func, item, **func_kwargs))
+        return summary, reports
+
+    # Forking a process in which Polars' thread pool is running may deadlock, so spawn.
+    with ProcessPoolExecutor(
+        max_workers=nr_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker,
+        initargs=(max_memory_per_worker, nr_threads_per_worker),
+    ) as executor:
+        futures = {
+            executor.submit(run_safely, func, item, **func_kwargs): item
+            for item in items
+        }
+        for future in as_completed(futures):
+            try:
+                report = future.result()
+            except Exception:
+                # The worker itself died (killed by the OOM killer for instance).
+                report = ConversionReport(futures[future], error=traceback.format_exc())
+            add_report(report)
+    return summary, reports
@@ -1,10 +1,16 @@
+from __future__ import annotations
+
 import re
 from dataclasses import dataclass
 from pathlib import Path
 from string import Formatter
-from typing import Optional
+from typing import TYPE_CHECKING, Iterator, Optional
 
 import collegram
+from collegram.utils import LOCAL_FS
+
+if TYPE_CHECKING:
+    from fsspec import AbstractFileSystem
 
 
 def yield_kw_from_fmt_str(fmt_str):
@@ -52,6 +58,23 @@ def format_path(path_fmt, *args, **kwargs):
     return Path(str(path_fmt).format(*args, **kwargs))
 
 
+def get_bin_partition(raw_fpath: str | Path) -> Path:
+    """
+    Get the Hive partition of a raw data bin named like "2024-01-01_to_2024-02-01.jsonl",
+    relative to its channel's partition: one file per bin, under its month.
+    """
+    bin_name = Path(raw_fpath).name.split(".")[0]
+    return Path(f"month={bin_name[:7]}") / f"{bin_name}.parquet"
+
+
+def get_prefix_partition(anon_id: str) -> Path:
+    """
+    Get the Hive partition of the channel with ID `anon_id` in a dataset partitioned by
+    the first two characters of the IDs.
+    """
+    return Path(f"prefix={anon_id[:2]}") / "part.parquet"
+
+
 def get_params_fmt_str(*param_names):
     return "_".join("{0}={{{0}}}".format(p) for p in param_names)
 
@@ -69,6 +92,16 @@ class ProjectPaths:
 
     proj: Path = Path(collegram.__file__).parent.parent
     data: Optional[Path] = None
+    # Whether the full data of channels is packed in the shards of a
+    # `collegram.store.PackedStore` instead of saved in one file per channel. If None,
+    # this is the case if the marker file `packed_channels_marker` exists, which
+    # `scripts/pack_channels.py` creates.
+    packed_channels: Optional[bool] = None
+    # Whether the files and directories of channels are spread in two levels of
+    # subdirectories named after the first characters of their ID, like
+    # "ab/cd/abcd...", to keep directories small. If None, this is the case if the
+    # marker file `sharded_dirs_marker` exists, which `scripts/shard_dirs.py` creates.
+    sharded_dirs: Optional[bool] = None
 
     def __post_init__(self):
         if self.data is None:
@@ -76,12 +109,66 @@ class ProjectPaths:
         self.ext_data = self.data / "external"
         self.raw_data = self.data / "raw"
         self.interim_data = self.data / "interim"
+        self.sharded_dirs_marker = self.raw_data / ".sharded_dirs"
+        if self.sharded_dirs is None:
+            self.sharded_dirs = self.sharded_dirs_marker.exists()
+        self.packed_channels_marker = self.raw_data / ".packed_channels"
+        if self.packed_channels is None:
+            self.packed_channels = self.packed_channels_marker.exists()
+        self.anon_maps_dir = self.raw_data / "anon_maps"
+        self.channels_dir = self.raw_data / "channels"
+        self.messages_dir = self.raw_data / "messages"
+        self.forwards_dir = self.raw_data / "forwards"
+        self.messages_quarantine_dir = self.interim_data / "messages_quarantine"
         self.processed_data = self.data / "processed"
         self.channel_seed = self.ext_data / "channels.txt"
+        self.seed_search_cache = self.interim_data / "seed_search_cache.jsonl"
+        self.channels_first_seed = self.interim_data / "channels_first_seed.json"
         self.figs = self.proj / "reports" / "figures"
+        self.metrics = self.proj / "reports" / "metrics"
+        self.channels_lang_cache = self.interim_data / "channels_lang_cache.jsonl"
+        self.channels_journal = self.raw_data / "channels_journal.txt"
+        self.channels_store = self.raw_data / "channels_packed"
         self.channels_table = self.interim_data / "channels.parquet"
+        self.channels_dataset = self.interim_data / "channels_dataset"
         self.messages_tables = self.interim_data / "messages"
-        self.users_tables = self.interim_data / "users"
+        self.messages_dataset = self.interim_data / "messages_dataset"
+        self.reactions_dataset = self.interim_data / "reactions_dataset"
+        self.message_langs_dataset = self.interim_data / "message_langs_dataset"
+        self.fulltext_index = self.interim_data / "fulltext_index"
+        self.fulltext_terms = self.interim_data / "fulltext_terms.parquet"
+        self.urls_dataset = self.interim_data / "urls_dataset"
+        self.channel_domains_dataset = self.interim_data / "channel_domains_dataset"
+        self.domains_table = self.interim_data / "domains.parquet"
+        self.service_messages_dataset = self.interim_data / "service_messages_dataset"
+        self.users_dataset = self.interim_data / "users_dataset"
+        self.memberships_dataset = self.interim_data / "memberships_dataset"
+        self.graph = self.interim_data / "graph"
+
+    def get_shard_dir(self, root: Path, anon_id: str) -> Path:
+        """
+        Get the directory under `root` the file or directory of channel `anon_id` is in.
+        """
+        return root / anon_id[:2] / anon_id[2:4] if self.sharded_dirs else root
+
+    def yield_channel_ids(
+        self, root: Path, fs: AbstractFileSystem = LOCAL_FS
+    ) -> Iterator[str]:
+        """
+        Yield the IDs of the channels with a file or directory under `root`, like
+        `channels_dir` or `messages_dir`. With sharded directories, shards are listed
+        one at a time, so that the full listing is never held in memory.
+        """
+
+        def yield_entries(dir_path: str, depth: int) -> Iterator[str]:
+            for p in sorted(fs.ls(dir_path, detail=False)):
+                if depth == 0:
+                    yield Path(p).name.split(".")[0]
+                else:
+                    yield from yield_entries(p, depth - 1)
+
+        if fs.exists(str(root)):
+            yield from yield_entries(str(root), 2 if self.sharded_dirs else 0)
 
 
 @dataclass
@@ -91,18 +178,59 @@ class ChannelPaths:
 
     def __post_init__(self):
         self.anon_channel_id = str(self.anon_channel_id)
-        raw = self.project_paths.raw_data
-        self.anon_map = raw / "anon_maps" / f"{self.anon_channel_id}.json"
-        self.messages = raw / "messages" / self.anon_channel_id
-        self.channel = raw / "channels" / f"{self.anon_channel_id}.json"
+        anon_id = self.anon_channel_id
+        project_paths = self.project_paths
+        self.anon_map = (
+            project_paths.get_shard_dir(project_paths.anon_maps_dir, anon_id)
+            / f"{anon_id}.json"
+        )
+        self.messages = (
+            project_paths.get_shard_dir(project_paths.messages_dir, anon_id) / anon_id
+        )
+        self.channel = (
+            project_paths.get_shard_dir(project_paths.channels_dir, anon_id)
+            / f"{anon_id}.json"
+        )
+        self.forwards_index = (
+            project_paths.get_shard_dir(project_paths.forwards_dir, anon_id)
+            / f"{anon_id}.jsonl"
+        )
 
-        interim = self.project_paths.interim_data
         self.messages_table = (
             self.project_paths.messages_tables / f"{self.anon_channel_id}.parquet"
         )
-        self.messages_service_jsonl = (
-            interim / "messages_service" / f"{self.anon_channel_id}.jsonl"
+        self.channels_partition = self.project_paths.channels_dataset / (
+            get_prefix_partition(self.anon_channel_id)
+        )
+        self.messages_partitions = (
+            self.project_paths.messages_dataset / f"channel_id={self.anon_channel_id}"
+        )
+        self.reactions_partitions = (
+            self.project_paths.reactions_dataset / f"channel_id={self.anon_channel_id}"
+        )
+        self.message_langs_partitions = (
+            self.project_paths.message_langs_dataset
+            / f"channel_id={self.anon_channel_id}"
+        )
+        self.urls_partitions = (
+            self.project_paths.urls_dataset / f"channel_id={self.anon_channel_id}"
+        )
+        self.channel_domains = (
+            self.project_paths.channel_domains_dataset
+            / f"channel_id={self.anon_channel_id}"
+            / "part.parquet"
+        )
+        self.fulltext_partitions = (
+            self.project_paths.fulltext_index / f"channel_id={self.anon_channel_id}"
+        )
+        self.service_messages_partitions = (
+            self.project_paths.service_messages_dataset
+            / f"channel_id={self.anon_channel_id}"
+        )
+        self.messages_quarantine = (
+            project_paths.get_shard_dir(project_paths.messages_quarantine_dir, anon_id)
+            / anon_id
         )
-        self.users_table = (
-            self.project_paths.users_tables / f"{self.anon_channel_id}.parquet"
+        self.memberships_partition = self.project_paths.memberships_dataset / (
+            get_prefix_partition(self.anon_channel_id)
         )
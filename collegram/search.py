@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import re
+from typing import TYPE_CHECKING, Iterable
+
+from telethon.errors import ChannelPrivateError, UsernameInvalidError
+from telethon.tl.functions.contacts import SearchRequest
+
+import collegram.metrics
+from collegram.channels import query_bot
+from collegram.utils import LOCAL_FS
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+    from fsspec import AbstractFileSystem
+    from telethon import TelegramClient
+
+    from collegram.paths import ProjectPaths
+
+logger = logging.getLogger(__name__)
+
+USERNAME_PATTERN = re.compile(r"@([a-zA-Z0-9_]+)")
+
+
+class SearchCache:
+    """
+    Results of keyword searches of channels, per source and keyword, mapping channel
+    IDs to their access hash. Every new result is appended as a line to `save_path`,
+    which is read back on initialisation, so that an interrupted search is resumed
+    from the keywords left.
+    """
+
+    def __init__(self, save_path: Path, fs: AbstractFileSystem = LOCAL_FS):
+        self.save_path = save_path
+        self.fs = fs
+        self.results: dict[tuple[str, str], dict[int, int]] = {}
+        if fs.exists(str(save_path)):
+            with fs.open(str(save_path), "r") as f:
+                for line in f:
+                    d = json.loads(line)
+                    self.results[(d["source"], d["keyword"])] = {
+                        int(c_id): access_hash
+                        for c_id, access_hash in d["channels"].items()
+                    }
+
+    def __contains__(self, source_keyword: tuple[str, str]) -> bool:
+        return source_keyword in self.results
+
+    def add(self, source: str, keyword: str, channels: dict[int, int]):
+        self.results[(source, keyword)] = channels
+        self.fs.mkdirs(str(self.save_path.parent), exist_ok=True)
+        line = {"source": source, "keyword": keyword, "channels": channels}
+        with self.fs.open(str(self.save_path), "a") as f:
+            f.write(json.dumps(line) + "\n")
+
+    def get_channels(self, keywords: Iterable[str] | None = None) -> dict[int, int]:
+        """
+        Get all channels found for `keywords`, or any keyword if None.
+        """
+        keywords = None if keywords is None else set(keywords)
+        channels = {}
+        for (_, keyword), chans in self.results.items():
+            if keywords is None or keyword in keywords:
+                channels.update(chans)
+        return channels
+
+
+@collegram.metrics.timed("telegram_request_seconds", request="contacts.SearchRequest")
+async def search_from_api(client: TelegramClient, query: str, limit: int = 100):
+    res = await client(SearchRequest(q=query, limit=limit))
+    return {c.id: c.access_hash for c in res.chats}
+
+
+async def search_from_tgdb(
+    client: TelegramClient,
+    query: str,
+    daily_limit_wait: float = 24 * 3600,
+    retry_wait: float = 10,
+) -> dict[int, int]:
+    """
+    Search channels matching `query` with the TGDB bot. When the daily limit of free
+    searches is reached, waits `daily_limit_wait` seconds without blocking the event
+    loop, so that other searches carry on in the meantime.
+    """
+    while True:
+        search_res = await query_bot(client, "tgdb_bot", f"/search {query}")
+        if "result" in search_res.message:
+            usernames = USERNAME_PATTERN.findall(search_res.message)
+            break
+        elif "exhausted your daily free searches" in search_res.message:
+            logger.warning(f"TGDB daily limit reached, waiting {daily_limit_wait}s")
+            await asyncio.sleep(daily_limit_wait)
+        else:
+            await asyncio.sleep(retry_wait)
+
+    id_access_hash_map = {}
+    for username in usernames:
+        try:
+            entity = await client.get_input_entity(username)
+        except (ValueError, UsernameInvalidError, ChannelPrivateError):
+            continue
+        if hasattr(entity, "channel_id"):
+            id_access_hash_map[entity.channel_id] = entity.access_hash
+    return id_access_hash_map
+
+
+async def search_seeds(
+    client: TelegramClient,
+    keywords: Iterable[str],
+    cache: SearchCache,
+    api_limit: int = 100,
+    max_concurrent_api: int = 8,
+    with_tgdb: bool = True,
+    tgdb_min_interval: float = 5.0,
+    **tgdb_kwargs,
+) -> dict[int, int]:
+    """
+    Search channels matching every keyword of `keywords` not already in `cache`, and
+    return all channels found for them, with their access hash. API searches run
+    concurrently, at most `max_concurrent_api` at a time, while TGDB searches are
+    queued to run one at a time, as they are conversations with the same bot, at least
+    `tgdb_min_interval` seconds apart. Failed searches are logged and left out of
+    `cache`, so that they are retried on the next call.
+    """
+    keywords = list(dict.fromkeys(keywords))
+    api_semaphore = asyncio.Semaphore(max_concurrent_api)
+    failed = []
+
+    async def search_api(keyword: str):
+        try:
+            async with api_semaphore:
+                channels = await search_from_api(client, keyword, limit=api_limit)
+        except Exception:
+            logger.exception(f"API search of {keyword} failed")
+            failed.append(("api", keyword))
+            return
+        cache.add("api", keyword, channels)
+        logger.info(f"{keyword} yielded {len(channels)} from API")
+
+    async def search_tgdb(keywords: list[str]):
+        loop = asyncio.get_running_loop()
+        last_query_at = None
+        for keyword in keywords:
+            if last_query_at is not None:
+                await asyncio.sleep(last_query_at + tgdb_min_interval - loop.time())
+            last_query_at = loop.time()
+            try:
+                channels = await search_from_tgdb(client, keyword, **tgdb_kwargs)
+            except Exception:
+                logger.exception(f"TGDB search of {keyword} failed")
+                failed.append(("tgdb", keyword))
+                continue
+            cache.add("tgdb", keyword, channels)
+            logger.info(f"{keyword} yielded {len(channels)} from TGDB")
+
+    tasks = [search_api(kw) for kw in keywords if ("api", kw) not in cache]
+    if with_tgdb:
+        tasks.append(search_tgdb([kw for kw in keywords if ("tgdb", kw) not in cache]))
+    await asyncio.gather(*tasks)
+    if len(failed) > 0:
+        logger.error(f"{len(failed)} searches failed, to retry: {failed}")
+    return cache.get_channels(keywords)
+
+
+def load_seed_channels(
+    project_paths: ProjectPaths, fs: AbstractFileSystem = LOCAL_FS
+) -> dict[str, int]:
+    """
+    Get the seed channels, with their access hash: the ones found by keyword searches,
+    saved in `project_paths.seed_search_cache`, and the ones saved in
+    `project_paths.channels_first_seed` before searches were cached, if any.
+    """
+    channels = {}
+    if fs.exists(str(project_paths.channels_first_seed)):
+        with fs.open(str(project_paths.channels_first_seed), "r") as f:
+            channels.update(json.load(f))
+    cache = SearchCache(project_paths.seed_search_cache, fs=fs)
+    channels.update({str(c_id): h for c_id, h in cache.get_channels().items()})
+    return channels
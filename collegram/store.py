@@ -0,0 +1,265 @@
+from __future__ import annotations
+
+import contextlib
+import datetime
+import json
+import logging
+import time
+import uuid
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterator
+
+import msgspec
+
+from collegram.utils import LOCAL_FS
+
+if TYPE_CHECKING:
+    from fsspec import AbstractFileSystem
+
+logger = logging.getLogger(__name__)
+
+
+class IndexEntry(msgspec.Struct, array_like=True):
+    key: str
+    offset: int
+    # Negative for deleted documents.
+    length: int
+    saved_at: float
+
+
+class IndexHeader(msgspec.Struct):
+    # Changed by every compaction, and part of the name of the shard.
+    generation: str
+
+
+INDEX_DECODER = msgspec.json.Decoder(type=IndexEntry)
+INDEX_HEADER_DECODER = msgspec.json.Decoder(type=IndexHeader)
+# Generations are UUIDs in hex, so headers all have the same size.
+INDEX_HEADER_SIZE = len(msgspec.json.encode(IndexHeader(uuid.uuid4().hex))) + 1
+
+
+def encode_index_header(generation: str) -> bytes:
+    return msgspec.json.encode(IndexHeader(generation)) + b"\n"
+
+
+def read_index_header(f) -> tuple[str | None, int]:
+    """
+    Read the generation of the index opened as `f`, and the size of its header. Indices
+    written before generations were introduced have none.
+    """
+    f.seek(0)
+    line = f.read(INDEX_HEADER_SIZE)
+    if not line.startswith(b"{"):
+        return None, 0
+    return INDEX_HEADER_DECODER.decode(line).generation, INDEX_HEADER_SIZE
+
+
+class PackedStore:
+    """
+    Store of JSON documents keyed on anonymised IDs, packed in append-only shards to
+    avoid having one small file per document. Documents whose keys start with the same
+    `prefix_len` characters are appended to the same shard, and their position is
+    appended to the shard's index. Overwritten and deleted documents stay in shards
+    until `compact` is called, which writes a new generation of the shard.
+    """
+
+    def __init__(
+        self, root: Path, prefix_len: int = 2, fs: AbstractFileSystem = LOCAL_FS
+    ):
+        self.root = Path(root)
+        self.prefix_len = prefix_len
+        self.fs = fs
+        self.lock_path = self.root / ".lock"
+        # Per prefix, generation of the index, size of the index file read so far and
+        # the entries read from it.
+        self.indices: dict[str, tuple[str | None, int, dict[str, IndexEntry]]] = {}
+
+    def get_prefix(self, key: str) -> str:
+        return key[: self.prefix_len]
+
+    def shard_path(self, prefix: str, generation: str | None = None) -> Path:
+        if generation is None:
+            return self.root / f"{prefix}.jsonl"
+        return self.root / f"{prefix}.{generation}.jsonl"
+
+    def index_path(self, prefix: str) -> Path:
+        return self.root / f"{prefix}.idx"
+
+    def load_index(self, prefix: str) -> dict[str, IndexEntry]:
+        """
+        Get the latest entry of every key of shard `prefix`. Only the part of the index
+        appended since it was last loaded is read, unless the shard was compacted in the
+        meantime.
+        """
+        generation, read_size, entries = self.indices.get(prefix, (None, 0, {}))
+        index_path = str(self.index_path(prefix))
+        if not self.fs.exists(index_path):
+            generation, read_size, entries = None, 0, {}
+        else:
+            with self.fs.open(index_path, "rb") as f:
+                new_generation, header_size = read_index_header(f)
+                if new_generation != generation:
+                    # The shard was compacted in the meantime.
+                    read_size, entries = header_size, {}
+                    generation = new_generation
+                f.seek(max(read_size, header_size))
+                data = f.read()
+            # Only read complete entries, the last one may still be being appended.
+            data = data[: data.rfind(b"\n") + 1]
+            entries.update((e.key, e) for e in INDEX_DECODER.decode_lines(data))
+            read_size = max(read_size, header_size) + len(data)
+        self.indices[prefix] = (generation, read_size, entries)
+        return entries
+
+    def get_entry(self, key: str) -> IndexEntry | None:
+        entry = self.load_index(self.get_prefix(key)).get(key)
+        return entry if entry is not None and entry.length >= 0 else None
+
+    def __contains__(self, key: str) -> bool:
+        return self.get_entry(key) is not None
+
+    def get(self, key: str) -> dict | None:
+        prefix = self.get_prefix(key)
+        for _ in range(2):
+            entry = self.get_entry(key)
+            if entry is None:
+                return None
+            generation = self.indices[prefix][0]
+            try:
+                with self.fs.open(str(self.shard_path(prefix, generation)), "rb") as f:
+                    f.seek(entry.offset)
+                    return json.loads(f.read(entry.length))
+            except FileNotFoundError:
+                # The shard was compacted, and its previous generation removed, after
+                # its index was loaded, so load it again.
+                continue
+        raise RuntimeError(f"Shard {prefix} keeps being compacted while reading {key}")
+
+    def get_saved_at(self, key: str) -> datetime.datetime | None:
+        entry = self.get_entry(key)
+        if entry is None:
+            return None
+        return datetime.datetime.fromtimestamp(entry.saved_at, datetime.UTC)
+
+    @contextlib.contextmanager
+    def lock(self):
+        """
+        Lock the store, so that other writers wait for it to be released before saving
+        documents. Raise a `FileExistsError` if it is already locked.
+        """
+        self.fs.mkdirs(str(self.root), exist_ok=True)
+        with self.fs.open(str(self.lock_path), "xb") as f:
+            f.write(str(time.time()).encode())
+        try:
+            yield
+        finally:
+            self.fs.rm(str(self.lock_path))
+
+    def wait_unlocked(self, poll_interval: float = 1.0):
+        if self.fs.exists(str(self.lock_path)):
+            logger.warning(
+                f"Waiting for {self.lock_path} to be released, remove it if no "
+                "compaction is running."
+            )
+        while self.fs.exists(str(self.lock_path)):
+            time.sleep(poll_interval)
+
+    def get_generation(self, prefix: str) -> str | None:
+        """
+        Get the current generation of shard `prefix`, creating its index if needed.
+        """
+        index_path = str(self.index_path(prefix))
+        if not self.fs.exists(index_path):
+            try:
+                with self.fs.open(index_path, "xb") as f:
+                    f.write(encode_index_header(uuid.uuid4().hex))
+            except FileExistsError:
+                # Created by another writer in the meantime.
+                pass
+        with self.fs.open(index_path, "rb") as f:
+            return read_index_header(f)[0]
+
+    def append_entries(self, prefix: str, entries: list[IndexEntry]):
+        with self.fs.open(str(self.index_path(prefix)), "ab") as f:
+            for e in entries:
+                f.write(msgspec.json.encode(e) + b"\n")
+
+    def put(self, key: str, data: dict, saved_at: float | None = None):
+        self.wait_unlocked()
+        prefix = self.get_prefix(key)
+        self.fs.mkdirs(str(self.root), exist_ok=True)
+        shard_path = str(self.shard_path(prefix, self.get_generation(prefix)))
+        doc = json.dumps(data).encode() + b"\n"
+        offset = self.fs.size(shard_path) if self.fs.exists(shard_path) else 0
+        with self.fs.open(shard_path, "ab") as f:
+            f.write(doc)
+        saved_at = time.time() if saved_at is None else saved_at
+        # The index is only appended to once the document is fully written, so a
+        # document interrupted mid-write is never referenced.
+        self.append_entries(prefix, [IndexEntry(key, offset, len(doc) - 1, saved_at)])
+
+    def delete(self, key: str):
+        self.wait_unlocked()
+        if key in self:
+            entry = IndexEntry(key, -1, -1, time.time())
+            self.append_entries(self.get_prefix(key), [entry])
+
+    def prefixes(self) -> list[str]:
+        return sorted(Path(p).stem for p in self.fs.glob(str(self.root / "*.idx")))
+
+    def keys(self) -> Iterator[str]:
+        for prefix in self.prefixes():
+            for key, entry in self.load_index(prefix).items():
+                if entry.length >= 0:
+                    yield key
+
+    def compact(self, prefix: str | None = None) -> int:
+        """
+        Rewrite the shard `prefix`, or all of them, with only the latest version of
+        documents that were not deleted, while holding the store's lock. Return the
+        number of bytes reclaimed.
+        """
+        prefixes = self.prefixes() if prefix is None else [prefix]
+        with self.lock():
+            return sum(self.compact_shard(p) for p in prefixes)
+
+    def compact_shard(self, prefix: str) -> int:
+        """
+        Write a new generation of shard `prefix` and of its index, the latter replacing
+        the previous one at once, before removing the previous shard. Readers that
+        loaded the previous index can thus either still read the previous shard or
+        find it missing and reload the index.
+        """
+        live_entries = [e for e in self.load_index(prefix).values() if e.length >= 0]
+        generation, read_size, _ = self.indices[prefix]
+        shard_path = str(self.shard_path(prefix, generation))
+        if not self.fs.exists(shard_path):
+            return 0
+        index_path = str(self.index_path(prefix))
+        new_generation = uuid.uuid4().hex
+        new_shard_path = str(self.shard_path(prefix, new_generation))
+        new_entries = []
+        offset = 0
+        with self.fs.open(shard_path, "rb") as f_in:
+            with self.fs.open(new_shard_path, "wb") as f_out:
+                for e in sorted(live_entries, key=lambda e: e.offset):
+                    f_in.seek(e.offset)
+                    f_out.write(f_in.read(e.length + 1))
+                    new_entries.append(IndexEntry(e.key, offset, e.length, e.saved_at))
+                    offset += e.length + 1
+        with self.fs.open(f"{index_path}.tmp", "wb") as f:
+            f.write(encode_index_header(new_generation))
+            for e in new_entries:
+                f.write(msgspec.json.encode(e) + b"\n")
+
+        if self.fs.size(index_path) != read_size:
+            # A writer that started before the lock was taken saved documents since.
+            logger.warning(f"Shard {prefix} was written to while compacting, skipping")
+            self.fs.rm(new_shard_path)
+            self.fs.rm(f"{index_path}.tmp")
+            return 0
+        nr_reclaimed = self.fs.size(shard_path) - offset
+        self.fs.mv(f"{index_path}.tmp", index_path)
+        self.fs.rm(shard_path)
+        self.indices.pop(prefix, None)
+        return nr_reclaimed
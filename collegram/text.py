@@ -1,15 +1,32 @@
 from __future__ import annotations
 
+import hashlib
+import json
 import re
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Iterable
+
+import polars as pl
+
+from collegram.utils import LOCAL_FS
 
 if TYPE_CHECKING:
+    from pathlib import Path
+
     from bidict import bidict
+    from fsspec import AbstractFileSystem
     from lingua import LanguageDetector
 
 
+HASH_AT_PATTERN = r"(?:^|\B)((@|#)\w+)(?:$|\b)"
+URL_PATTERN = r"(https?://|www\.|t\.me/)\S+"
+# Also valid for Polars, which uses Rust's regex syntax.
+CLEAN_TEXT_PATTERN = "({})|({})".format(HASH_AT_PATTERN, URL_PATTERN)
+CLEAN_TEXT_REGEX = re.compile(CLEAN_TEXT_PATTERN)
+
+
 def get_chan_text(full_channel_d: dict, inverse_anon_map: bidict):
-    # TODO: maybe add a sample of messages?
+    # For a language detected from a sample of messages, see
+    # `collegram.dataset.get_channels_langs`.
     channel_d = [
         c
         for c in full_channel_d["chats"]
@@ -22,11 +39,86 @@ def get_chan_text(full_channel_d: dict, inverse_anon_map: bidict):
 
 
 def clean_text(s: str):
-    hash_at_pattern = r"(?:^|\B)((@|#)\w+)(?:$|\b)"
-    url_pattern = r"(https?://|www\.|t\.me/)\S+"
-    regex_filter = re.compile("({})|({})".format(hash_at_pattern, url_pattern))
-    clean_text = regex_filter.sub("", s)
-    return clean_text
+    return CLEAN_TEXT_REGEX.sub("", s)
+
+
+def clean_text_expr(expr: pl.Expr) -> pl.Expr:
+    """
+    Vectorised version of `clean_text`, also stripping the whitespace left at the ends.
+    """
+    return expr.str.replace_all(CLEAN_TEXT_PATTERN, "").str.strip_chars()
+
+
+def hash_text(text: str) -> str:
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+class LanguageCache:
+    """
+    Cache of the languages detected in channels' texts, keyed on the hash of their
+    title and description, so that a channel reached from many parents is only
+    detected once, and again only if its text changed. If `save_path` is given, new
+    results are appended to it, and read back on initialisation.
+    """
+
+    def __init__(
+        self, save_path: Path | None = None, fs: AbstractFileSystem = LOCAL_FS
+    ):
+        self.save_path = save_path
+        self.fs = fs
+        self.langs: dict[str, str | None] = {}
+        if save_path is not None and fs.exists(str(save_path)):
+            with fs.open(str(save_path), "r") as f:
+                for line in f:
+                    self.langs.update(json.loads(line))
+
+    def __contains__(self, text_hash: str) -> bool:
+        return text_hash in self.langs
+
+    def __getitem__(self, text_hash: str) -> str | None:
+        return self.langs[text_hash]
+
+    def update(self, new_langs: dict[str, str | None]):
+        self.langs.update(new_langs)
+        if self.save_path is not None and len(new_langs) > 0:
+            self.fs.mkdirs(str(self.save_path.parent), exist_ok=True)
+            with self.fs.open(str(self.save_path), "a") as f:
+                for text_hash, lang in new_langs.items():
+                    f.write(json.dumps({text_hash: lang}) + "\n")
+
+
+def detect_texts_langs(
+    texts: list[str],
+    lang_detector: LanguageDetector,
+    lang_cache: LanguageCache | None = None,
+) -> list[str | None]:
+    """
+    Detect the languages of `texts` at once, running the detector in parallel on the
+    texts not found in `lang_cache`.
+    """
+    text_hashes = [hash_text(t) for t in texts]
+    langs = {} if lang_cache is None else lang_cache.langs
+    to_detect = {h: t for h, t in zip(text_hashes, texts) if h not in langs}
+    detected = lang_detector.detect_languages_in_parallel_of(
+        [clean_text(t) for t in to_detect.values()]
+    )
+    new_langs = {
+        h: None if lang is None else lang.iso_code_639_1.name
+        for h, lang in zip(to_detect.keys(), detected)
+    }
+    if lang_cache is not None:
+        lang_cache.update(new_langs)
+    return [new_langs[h] if h in new_langs else langs[h] for h in text_hashes]
+
+
+def detect_chans_langs(
+    full_channel_ds: Iterable[dict],
+    inverse_anon_map: bidict,
+    lang_detector: LanguageDetector,
+    lang_cache: LanguageCache | None = None,
+) -> list[str | None]:
+    texts = [get_chan_text(d, inverse_anon_map) for d in full_channel_ds]
+    return detect_texts_langs(texts, lang_detector, lang_cache)
 
 
 def detect_chan_lang(
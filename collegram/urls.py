@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import logging
+
+import polars as pl
+
+logger = logging.getLogger(__name__)
+
+URL_SOURCES = pl.Enum(["text", "webpage"])
+URLS_PL_SCHEMA = {
+    "id": pl.Int64,
+    "date": pl.Datetime(time_zone="UTC"),
+    "source": URL_SOURCES,
+    "url": pl.Utf8,
+    "domain": pl.Utf8,
+}
+CHANNEL_DOMAINS_PL_SCHEMA = {
+    "domain": pl.Utf8,
+    "nr_urls": pl.UInt32,
+    "nr_messages": pl.UInt32,
+    "first_date": pl.Datetime(time_zone="UTC"),
+    "last_date": pl.Datetime(time_zone="UTC"),
+}
+URL_PATTERN = (
+    r"^(?:[a-zA-Z][a-zA-Z0-9+.-]*://)?(?:[^@/?#]*@)?(?P<host>[^/?#:]+)(?::\d+)?"
+    r"(?P<path>[^?#]*)(?:\?(?P<query>[^#]*))?"
+)
+# Query parameters only there to track where a link was shared.
+TRACKING_PARAM_PATTERN = r"^(utm_\w+|fbclid|gclid|yclid|igshid|mc_cid|mc_eid|ref_src)="
+# Labels found before a country code to form a public suffix, like "co" in "co.uk".
+# Without the full public suffix list, registered domains are taken as the last two
+# labels of the host, or the last three if they end with one of these suffixes.
+SECOND_LEVEL_LABELS = [
+    "ac",
+    "co",
+    "com",
+    "edu",
+    "gob",
+    "gov",
+    "govt",
+    "ltd",
+    "mil",
+    "net",
+    "nic",
+    "nom",
+    "or",
+    "org",
+    "plc",
+    "sch",
+]
+
+
+def normalize_url_expr(expr: pl.Expr) -> pl.Expr:
+    """
+    Normalise URLs: the scheme, credentials, port, fragment, tracking query parameters
+    and trailing slash are dropped, and the host is lowercased, without "www.".
+    """
+    parts = expr.str.strip_chars().str.extract_groups(URL_PATTERN)
+    host = (
+        parts.struct["host"]
+        .str.to_lowercase()
+        .str.strip_chars_end(".")
+        .str.strip_prefix("www.")
+    )
+    path = parts.struct["path"].str.strip_chars_end("/")
+    query = (
+        parts.struct["query"]
+        .str.split("&")
+        .list.eval(
+            pl.element().filter(~pl.element().str.contains(TRACKING_PARAM_PATTERN))
+        )
+        .list.join("&")
+    )
+    return pl.concat_str(
+        host,
+        path,
+        pl.when(query != "").then(pl.lit("?") + query).otherwise(pl.lit("")),
+    )
+
+
+def registered_domain_expr(url_expr: pl.Expr) -> pl.Expr:
+    """
+    Get the registered domain of normalised URLs, like "bbc.co.uk" for
+    "news.bbc.co.uk/article".
+    """
+    labels = url_expr.str.extract(r"^([^/?]+)").str.split(".")
+    has_second_level = (
+        (labels.list.len() > 2)
+        & labels.list.get(-2, null_on_oob=True).is_in(SECOND_LEVEL_LABELS)
+        & (labels.list.last().str.len_chars() == 2)
+    )
+    # IP addresses are kept whole.
+    is_ip = labels.list.last().str.contains(r"^\d+$")
+    return (
+        pl.when(is_ip)
+        .then(labels.list.join("."))
+        .when(has_second_level)
+        .then(labels.list.tail(3).list.join("."))
+        .otherwise(labels.list.tail(2).list.join("."))
+    )
+
+
+def messages_to_urls_df(messages_df: pl.DataFrame) -> pl.DataFrame:
+    """
+    Get the URLs of the messages of a table from `collegram.json.messages_to_df`, from
+    both their text and their web page preview, with one row per distinct normalised
+    URL of every message.
+    """
+    text_urls = (
+        messages_df.select("id", "date", "text_urls", source=pl.lit("text"))
+        .explode("text_urls")
+        .rename({"text_urls": "url"})
+    )
+    webpage_urls = messages_df.select(
+        "id", "date", url="webpage_preview_url", source=pl.lit("webpage")
+    )
+    return (
+        pl.concat([text_urls, webpage_urls], how="diagonal_relaxed")
+        .drop_nulls("url")
+        .with_columns(url=normalize_url_expr(pl.col("url")))
+        .filter(pl.col("url") != "")
+        .with_columns(
+            domain=registered_domain_expr(pl.col("url")),
+            source=pl.col("source").cast(URL_SOURCES),
+        )
+        .unique(["id", "url"], keep="first", maintain_order=True)
+        .select(list(URLS_PL_SCHEMA.keys()))
+        .cast(URLS_PL_SCHEMA)
+    )
+
+
+def count_channel_domains(urls: pl.LazyFrame) -> pl.LazyFrame:
+    """
+    Count the URLs and messages of a channel linking to every domain, from its URLs
+    table.
+    """
+    return (
+        urls.group_by("domain")
+        .agg(
+            nr_urls=pl.len(),
+            nr_messages=pl.col("id").n_unique(),
+            first_date=pl.col("date").min(),
+            last_date=pl.col("date").max(),
+        )
+        .cast(CHANNEL_DOMAINS_PL_SCHEMA)
+    )
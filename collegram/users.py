@@ -8,6 +8,7 @@ import polars as pl
 from telethon.errors import ChatAdminRequiredError
 from telethon.tl.types import Channel, TypeInputChannel, User
 
+import collegram.metrics
 import collegram.utils
 
 if typing.TYPE_CHECKING:
@@ -18,6 +19,7 @@ if typing.TYPE_CHECKING:
 logger = logging.getLogger(__name__)
 
 
+@collegram.metrics.timed("telegram_request_seconds", request="get_participants")
 def get_channel_participants(
     client: TelegramClient,
     channel: TypeInputChannel | Channel,
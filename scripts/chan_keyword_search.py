@@ -1,6 +1,6 @@
-import json
 import os
 
+import setup
 from dotenv import load_dotenv
 
 import collegram
@@ -9,6 +9,11 @@ if __name__ == "__main__":
     load_dotenv()
     key_name = "thomas"
     paths = collegram.paths.ProjectPaths()
+    logger = setup.init_logging(paths.proj / "scripts" / __file__)
+    # Maximum number of API searches running at the same time.
+    max_concurrent_api = 8
+    # Minimum number of seconds between two searches with the TGDB bot.
+    tgdb_min_interval = 5.0
     channels_dir = paths.raw_data / "channels"
     pre = f"{key_name.upper()}_"
     client = collegram.client.connect(
@@ -17,19 +22,23 @@ if __name__ == "__main__":
         os.environ[f"{pre}PHONE_NUMBER"],
         session=str(paths.proj / f"{key_name}.session"),
     )
-    output_file = paths.interim_data / "channels_first_seed.json"
-    channels = json.loads(output_file.read_text())
     keywords = set((paths.ext_data / "keywords.txt").read_text().strip().split("\n"))
+    # Keywords searched before results were cached, whose channels are in
+    # `paths.channels_first_seed`.
     searched_kw_path = paths.ext_data / "searched_keywords.txt"
-    searched_keywords = set(searched_kw_path.read_text().strip().split("\n"))
-    keywords_to_search = keywords.difference(searched_keywords)
-    for i, kw in enumerate(keywords_to_search):
-        tgdb_chans = collegram.channels.search_from_tgdb(client, kw)
-        api_chans = collegram.channels.search_from_api(client, kw)
-        channels = {**channels, **tgdb_chans, **api_chans}
-        output_file.write_text(json.dumps(channels))
-        searched_keywords.add(kw)
-        searched_kw_path.write_text("\n".join(searched_keywords))
-        print(
-            f"{i} / {len(keywords_to_search)}: {kw} yielded {len(tgdb_chans)} from TGDB, {len(api_chans)} from API"
+    if searched_kw_path.exists():
+        keywords.difference_update(searched_kw_path.read_text().strip().split("\n"))
+    # Results are appended to the cache as they come, and the seed is read from it by
+    # `collegram.search.load_seed_channels`, so an interrupted search resumes from the
+    # keywords left, and failed ones are retried on the next run.
+    cache = collegram.search.SearchCache(paths.seed_search_cache)
+    found_channels = client.loop.run_until_complete(
+        collegram.search.search_seeds(
+            client,
+            keywords,
+            cache,
+            max_concurrent_api=max_concurrent_api,
+            tgdb_min_interval=tgdb_min_interval,
         )
+    )
+    logger.info(f"{len(keywords)} keywords yielded {len(found_channels)} channels")
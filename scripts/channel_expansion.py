@@ -1,5 +1,6 @@
 import datetime
 import json
+import logging
 import os
 
 import polars as pl
@@ -19,7 +20,13 @@ if __name__ == "__main__":
     load_dotenv()
     key_name = "thomas"
 
+    # To measure the crawl offline, set to a `cg.fake.SyntheticSpec`: channels are then
+    # served from a synthetic network by a fake client, and saved in a separate data
+    # directory.
+    fake_spec = None
     paths = cg.paths.ProjectPaths()
+    if fake_spec is not None:
+        paths = cg.paths.ProjectPaths(data=paths.proj / "data_fake")
     logger = setup.init_logging(paths.proj / "scripts" / __file__)
     fpath_fwds_to_retrieve = paths.ext_data / "fpath_fwds_to_retrieve.jsonl"
 
@@ -30,28 +37,47 @@ if __name__ == "__main__":
     lang_priorities = {lc: 1 for lc in ["EN", "FR", "ES", "DE", "EL", "IT", "PL", "RO"]}
     lang_priorities["EN"] = 2
     lang_detector = LanguageDetectorBuilder.from_all_languages().build()
+    # Whether to also queue the channels of the channels dataset, ranked with the
+    # current scoring rules, for instance after changing them.
+    reseed_from_dataset = False
+    # Languages detected in channels are kept across runs, keyed on their text.
+    lang_cache = cg.text.LanguageCache(paths.channels_lang_cache)
+    # Request latencies, flood waits and messages saved, exported every minute.
+    logging.getLogger("telethon").addHandler(cg.metrics.FloodWaitHandler())
+    metrics_exporter = cg.metrics.PeriodicExporter(
+        paths.metrics / "channel_expansion.prom", interval=60
+    )
     # Go up to 30 days ago so that view counts, etc, have more or less reached their final value
     global_dt_to = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(
         days=30
     )
     # dt_from = dt_to - datetime.timedelta(days=31)
-    pre = f"{key_name.upper()}_"
-    client = cg.client.connect(
-        os.environ[f"{pre}API_ID"],
-        os.environ[f"{pre}API_HASH"],
-        os.environ[f"{pre}PHONE_NUMBER"],
-        session=str(paths.proj / f"{key_name}.session"),
-        flood_sleep_threshold=24 * 3600,
-        receive_updates=False,
-        entity_cache_limit=10000,
-        request_retries=1000,
-    )
+    if fake_spec is None:
+        pre = f"{key_name.upper()}_"
+        client = cg.client.connect(
+            os.environ[f"{pre}API_ID"],
+            os.environ[f"{pre}API_HASH"],
+            os.environ[f"{pre}PHONE_NUMBER"],
+            session=str(paths.proj / f"{key_name}.session"),
+            flood_sleep_threshold=24 * 3600,
+            receive_updates=False,
+            entity_cache_limit=10000,
+            request_retries=1000,
+        )
+        channels_first_seed = cg.search.load_seed_channels(paths)
+    else:
+        fake_channels = cg.fake.make_network(fake_spec)
+        client = cg.fake.FakeTelegramClient(fake_channels, latency=0.05, jitter=0.1)
+        channels_first_seed = {
+            str(c.id): c.access_hash for c in fake_channels[:10] if not c.private
+        }
     generic_anonymiser = cg.utils.HMAC_anonymiser()
 
-    channels_first_seed = json.loads(
-        (paths.interim_data / "channels_first_seed.json").read_text()
-    )
     channels_queue = cg.utils.UniquePriorityQueue()
+    seed_full_ds = {}
+    # Gathers the anonymisation maps of all seed channels to detect their languages at
+    # once.
+    seed_anonymiser = cg.utils.HMAC_anonymiser()
     for c_id, c_hash in channels_first_seed.items():
         anonymiser = cg.utils.HMAC_anonymiser()
         anon_id = anonymiser.anonymise(c_id)
@@ -73,270 +99,328 @@ if __name__ == "__main__":
             # Here `ChannelInvalidError` cannot happen because first seed consists of
             # broadcast channels only.
             continue
-        prio = cgc.get_explo_priority(
-            full_chat_d,
-            anonymiser,
-            0,
+        seed_anonymiser.anon_map.update(anonymiser.anon_map)
+        seed_full_ds[int(c_id)] = full_chat_d
+    seed_prios = cgc.get_explo_priorities(
+        seed_full_ds,
+        seed_anonymiser,
+        0,
+        lang_detector,
+        lang_priorities,
+        private_chans_priority,
+        lang_cache=lang_cache,
+    )
+    for c_id, prio in seed_prios.items():
+        channels_queue.put((prio, c_id))
+
+    if reseed_from_dataset:
+        # Requires the merged anonymisation map, see `scripts/merge_anon_maps.py`.
+        anon_map_df = pl.read_parquet(paths.interim_data / "anon_map.parquet")
+        chans_df = cgc.add_langs(
+            cg.dataset.scan_channels(paths).collect(),
             lang_detector,
-            lang_priorities,
-            private_chans_priority,
+            lang_cache=lang_cache,
+            anon_map_df=anon_map_df,
         )
-        channels_queue.put((prio, int(c_id)))
-
-    processed_channels = set()
-    nr_remaining_channels = channels_queue.qsize()
-    nr_processed_channels = 0
-    while not channels_queue.empty():
-        # First we get the encompassing full channel, to then read all of its chats.
-        prio, channel_id = channels_queue.get()
-        get_prio_kwargs = {
-            "parent_priority": prio,
-            "lang_detector": lang_detector,
-            "lang_priorities": lang_priorities,
-            "private_chans_priority": private_chans_priority,
-        }
-        anon_channel_id = anonymiser.anonymise(channel_id)
-        chan_paths = cg.paths.ChannelPaths(anon_channel_id, paths)
-        anonymiser = cg.utils.HMAC_anonymiser(save_path=chan_paths.anon_map)
-        try:
-            listed_channel_full, listed_channel_full_d = cgc.get_full(
-                client,
-                paths,
-                anonymiser,
-                key_name,
-                channel_id=channel_id,
-                force_query=True,
-            )
-        except (
-            ChannelInvalidError,
-            ChannelPrivateError,
-            UsernameInvalidError,
-            ValueError,
-        ):
-            # For all but ChannelPrivateError, can try with another key (TODO: add to
-            # list of new channels?).
-            logger.warning(f"could not get data for listed channel {channel_id}")
-            nr_remaining_channels -= 1
-            continue
+        # Prefer the language of a sample of messages, when they were processed by
+        # `scripts/message_langs_to_parquet.py`, to the one of the description.
+        msgs_langs = cg.dataset.get_channels_langs(paths).select(
+            id="channel_id", msgs_lang="lang"
+        )
+        chans_df = (
+            chans_df.lazy()
+            .join(msgs_langs, on="id", how="left")
+            .with_columns(lang=pl.coalesce("msgs_lang", "lang"))
+            .collect()
+        )
+        scoring = cgc.ExploScoring(
+            lang_priorities, private_chans_priority=private_chans_priority
+        )
+        reseed_df = (
+            cgc.score_channels(chans_df, scoring)
+            .filter(pl.col("priority") < private_chans_priority)
+            .join(anon_map_df.lazy(), left_on="id", right_on="hash")
+            .select("priority", pl.col("original").cast(pl.Int64))
+            .collect()
+        )
+        for prio, c_id in reseed_df.iter_rows():
+            channels_queue.put((prio, c_id))
+        logger.info(f"{reseed_df.height} channels queued from the channels dataset")
 
-        new_channels = {}
-        for chat in listed_channel_full.chats:
-            channel_id = chat.id
+    metrics_exporter.start()
+    try:
+        processed_channels = set()
+        nr_remaining_channels = channels_queue.qsize()
+        nr_processed_channels = 0
+        while not channels_queue.empty():
+            # First we get the encompassing full channel, to then read all of its chats.
+            prio, channel_id = channels_queue.get()
+            get_prio_kwargs = {
+                "parent_priority": prio,
+                "lang_detector": lang_detector,
+                "lang_priorities": lang_priorities,
+                "private_chans_priority": private_chans_priority,
+                "lang_cache": lang_cache,
+            }
             anon_channel_id = anonymiser.anonymise(channel_id)
             chan_paths = cg.paths.ChannelPaths(anon_channel_id, paths)
             anonymiser = cg.utils.HMAC_anonymiser(save_path=chan_paths.anon_map)
-
-            if channel_id == listed_channel_full.full_chat.id:
-                channel_full = listed_channel_full
-                channel_full_d = listed_channel_full_d
-            else:
-                try:
-                    channel_full, channel_full_d = cgc.get_full(
-                        client,
-                        paths,
-                        anonymiser,
-                        key_name,
-                        channel=chat,
-                        channel_id=channel_id,
-                        force_query=True,
-                    )
-                except (
-                    ChannelInvalidError,
-                    ChannelPrivateError,
-                    UsernameInvalidError,
-                    ValueError,
-                ):
-                    # Can be discussion group here, so include `ChannelInvalidError`.
-                    logger.warning(f"could not get data for channel {channel_id}")
-                    continue
-
-            # Ensure we're using a raw `chat`, and not one from `listed_channel_full`
-            # that may have been anonymised at some point.
-            if chat.username:
-                logger.info(f"**************** {chat.username} ****************")
-            logger.info(f"---------------- {channel_id} ----------------")
-            logger.info(
-                f"priority {prio}, {channel_full.full_chat.participants_count} participants, {channel_full.full_chat.about}"
-            )
-
-            recommended_chans = {}
-            for i in channel_full_d["recommended_channels"]:
-                rec_fc, rec_d = cgc.get_full(
+            try:
+                listed_channel_full, listed_channel_full_d = cgc.get_full(
                     client,
                     paths,
                     anonymiser,
                     key_name,
-                    channel_id=i,
-                )
-                rec_by = set(rec_d.get("recommended_by", []))
-                rec_by.add(anon_channel_id)
-                rec_d["recommended_by"] = list(rec_by)
-                recommended_chans[i] = cgc.get_explo_priority(
-                    rec_d, anonymiser, **get_prio_kwargs
+                    channel_id=channel_id,
+                    force_query=True,
                 )
+            except (
+                ChannelInvalidError,
+                ChannelPrivateError,
+                UsernameInvalidError,
+                ValueError,
+            ):
+                # For all but ChannelPrivateError, can try with another key (TODO: add to
+                # list of new channels?).
+                logger.warning(f"could not get data for listed channel {channel_id}")
+                nr_remaining_channels -= 1
+                continue
 
-            output_channel_full_d = json.loads(channel_full.to_json())
-            # yield here, or only do `get_extended_save_data`. to yield here, have to
-            # get rid of `chat` (premium querier should return fullchat JSON), load
-            # anonymiser, move get_anoned_full_dict out of get_extended_save_data and
-            # run it here below
-            output_channel_full_d = cgc.anon_full_dict(
-                output_channel_full_d,
-                anonymiser,
-            )
-            for key in ["recommended_channels", "forwards_from"]:
-                output_channel_full_d[key] = list(
-                    set(output_channel_full_d.get(key, [])).union(
-                        channel_full_d.get(key, [])
-                    )
-                )
-            cgc.save(output_channel_full_d, paths, key_name)
-            chat_d = cgc.get_matching_chat_from_full(output_channel_full_d)
-            anon_channel_id = chat_d["id"]
-            # try:
-            #     input_chat = cgc.get_input_chan(
-            #         client, channel_full_d, key_name, channel_id,
-            #     )
-            # except (ChannelInvalidError, ChannelPrivateError, UsernameInvalidError, ValueError):
-            #     # Can be discussion group here, so include `ChannelInvalidError`.
-            #     logger.warning(f"could not get data for channel {channel_id}")
-            #     continue
-            # TODO: if want different keys to handle same channels, uncomment above and remove below:
-            input_chat = chat
+            new_channels = {}
+            for chat in listed_channel_full.chats:
+                channel_id = chat.id
+                anon_channel_id = anonymiser.anonymise(channel_id)
+                chan_paths = cg.paths.ChannelPaths(anon_channel_id, paths)
+                anonymiser = cg.utils.HMAC_anonymiser(save_path=chan_paths.anon_map)
 
-            chan_paths.messages.mkdir(exist_ok=True, parents=True)
-            media_save_path = paths.raw_data / "media"
+                if channel_id == listed_channel_full.full_chat.id:
+                    channel_full = listed_channel_full
+                    channel_full_d = listed_channel_full_d
+                else:
+                    try:
+                        channel_full, channel_full_d = cgc.get_full(
+                            client,
+                            paths,
+                            anonymiser,
+                            key_name,
+                            channel=chat,
+                            channel_id=channel_id,
+                            force_query=True,
+                        )
+                    except (
+                        ChannelInvalidError,
+                        ChannelPrivateError,
+                        UsernameInvalidError,
+                        ValueError,
+                    ):
+                        # Can be discussion group here, so include `ChannelInvalidError`.
+                        logger.warning(f"could not get data for channel {channel_id}")
+                        continue
 
-            forwarded_chans = {}
-            for fwd_anon_id in set(output_channel_full_d["forwards_from"]):
-                fwd_id = anonymiser.inverse_anon_map.get(fwd_anon_id)
-                if fwd_id is None:
-                    logger.error(f"issue with anon map of {channel_id}")
-                    continue
+                # Ensure we're using a raw `chat`, and not one from `listed_channel_full`
+                # that may have been anonymised at some point.
+                if chat.username:
+                    logger.info(f"**************** {chat.username} ****************")
+                logger.info(f"---------------- {channel_id} ----------------")
+                logger.info(
+                    f"priority {prio}, {channel_full.full_chat.participants_count} participants, {channel_full.full_chat.about}"
+                )
 
-                try:
-                    _, full_chat_d = cgc.get_full(
+                recommended_full_ds = {}
+                for i in channel_full_d.get("recommended_channels", []):
+                    rec_fc, rec_d = cgc.get_full(
                         client,
                         paths,
                         anonymiser,
                         key_name,
-                        channel_id=fwd_id,
+                        channel_id=i,
                     )
-                except ChannelPrivateError:
-                    # These channels are valid and have been seen for sure,
-                    # might be private though.
-                    full_chat_d = {}
-                except (ChannelInvalidError, ValueError):
-                    # happens if chat's full was not saved to disk, and ID not present
-                    # in session file
-                    full_chat_d = {}
-                    logger.error(f"issue with saved forwards of {channel_id}")
-                    with open(fpath_fwds_to_retrieve, "a") as f:
-                        f.write(json.dumps({channel_id: fwd_id}))
-                        f.write("\n")
+                    rec_by = set(rec_d.get("recommended_by", []))
+                    rec_by.add(anon_channel_id)
+                    rec_d["recommended_by"] = list(rec_by)
+                    recommended_full_ds[i] = rec_d
+                recommended_chans = cgc.get_explo_priorities(
+                    recommended_full_ds, anonymiser, **get_prio_kwargs
+                )
 
-                forwarded_chans[int(fwd_id)] = cgc.get_explo_priority(
-                    full_chat_d,
+                output_channel_full_d = json.loads(channel_full.to_json())
+                # yield here, or only do `get_extended_save_data`. to yield here, have to
+                # get rid of `chat` (premium querier should return fullchat JSON), load
+                # anonymiser, move get_anoned_full_dict out of get_extended_save_data and
+                # run it here below
+                output_channel_full_d = cgc.anon_full_dict(
+                    output_channel_full_d,
                     anonymiser,
-                    **get_prio_kwargs,
                 )
+                for key in ["recommended_channels", "forwards_from"]:
+                    output_channel_full_d[key] = list(
+                        set(output_channel_full_d.get(key, [])).union(
+                            channel_full_d.get(key, [])
+                        )
+                    )
+                cgc.save(output_channel_full_d, paths, key_name)
+                chat_d = cgc.get_matching_chat_from_full(output_channel_full_d)
+                anon_channel_id = chat_d["id"]
+                # try:
+                #     input_chat = cgc.get_input_chan(
+                #         client, channel_full_d, key_name, channel_id,
+                #     )
+                # except (ChannelInvalidError, ChannelPrivateError, UsernameInvalidError, ValueError):
+                #     # Can be discussion group here, so include `ChannelInvalidError`.
+                #     logger.warning(f"could not get data for channel {channel_id}")
+                #     continue
+                # TODO: if want different keys to handle same channels, uncomment above and remove below:
+                input_chat = chat
 
-            logger.info(f"reading/saving messages from/to {chan_paths.messages}")
-            dt_from = chat.date
-            dt_from = dt_from.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-            dt_bin_edges = pl.datetime_range(
-                dt_from, global_dt_to, interval="1mo", eager=True, time_zone="UTC"
-            )
+                chan_paths.messages.mkdir(exist_ok=True, parents=True)
+                media_save_path = paths.raw_data / "media"
+
+                forwarded_full_ds = {}
+                for fwd_anon_id in set(output_channel_full_d["forwards_from"]):
+                    fwd_id = anonymiser.inverse_anon_map.get(fwd_anon_id)
+                    if fwd_id is None:
+                        logger.error(f"issue with anon map of {channel_id}")
+                        continue
+
+                    try:
+                        _, full_chat_d = cgc.get_full(
+                            client,
+                            paths,
+                            anonymiser,
+                            key_name,
+                            channel_id=fwd_id,
+                        )
+                    except ChannelPrivateError:
+                        # These channels are valid and have been seen for sure,
+                        # might be private though.
+                        full_chat_d = {}
+                    except (ChannelInvalidError, ValueError):
+                        # happens if chat's full was not saved to disk, and ID not present
+                        # in session file
+                        full_chat_d = {}
+                        logger.error(f"issue with saved forwards of {channel_id}")
+                        with open(fpath_fwds_to_retrieve, "a") as f:
+                            f.write(json.dumps({channel_id: fwd_id}))
+                            f.write("\n")
+
+                    forwarded_full_ds[int(fwd_id)] = full_chat_d
+                forwarded_chans = cgc.get_explo_priorities(
+                    forwarded_full_ds, anonymiser, **get_prio_kwargs
+                )
 
-            # Caution: the sorting only works because of file name format!
-            existing_files = sorted(list(chan_paths.messages.iterdir()))
-            for dt_from, dt_to in zip(dt_bin_edges[:-1], dt_bin_edges[1:]):
-                chunk_fwds = set()
-                messages_save_path = (
-                    chan_paths.messages / f"{dt_from.date()}_to_{dt_to.date()}.jsonl"
+                logger.info(f"reading/saving messages from/to {chan_paths.messages}")
+                dt_from = chat.date
+                dt_from = dt_from.replace(
+                    day=1, hour=0, minute=0, second=0, microsecond=0
                 )
-                is_last_saved_period = (
-                    len(existing_files) > 0 and messages_save_path == existing_files[-1]
+                dt_bin_edges = pl.datetime_range(
+                    dt_from, global_dt_to, interval="1mo", eager=True, time_zone="UTC"
                 )
-                if (
-                    not (
-                        messages_save_path.exists()
-                        or messages_save_path.with_suffix(".jsonl.gz").exists()
+
+                # Caution: the sorting only works because of file name format!
+                existing_files = sorted(list(chan_paths.messages.iterdir()))
+                if existing_files and not chan_paths.forwards_index.exists():
+                    # Build the forwards index of channels collected before it existed.
+                    cgc.recover_fwd_from_msgs(
+                        chan_paths.messages,
+                        forwards_index_path=chan_paths.forwards_index,
+                    )
+                for dt_from, dt_to in zip(dt_bin_edges[:-1], dt_bin_edges[1:]):
+                    chunk_fwds = set()
+                    messages_save_path = (
+                        chan_paths.messages
+                        / f"{dt_from.date()}_to_{dt_to.date()}.jsonl"
+                    )
+                    is_last_saved_period = (
+                        len(existing_files) > 0
+                        and messages_save_path == existing_files[-1]
                     )
-                    or is_last_saved_period
-                ):
-                    offset_id = 0
-                    if is_last_saved_period:
-                        # Get the offset in case collection was unexpectedly interrupted
-                        # while writing for this time range.
-                        last_message_saved = cg.utils.read_nth_to_last_line(
-                            messages_save_path
+                    if (
+                        not (
+                            messages_save_path.exists()
+                            or messages_save_path.with_suffix(".jsonl.gz").exists()
                         )
-                        # Check if not empty file before reading message
-                        if last_message_saved:
-                            offset_id = cg.json.read_message(last_message_saved).id
+                        or is_last_saved_period
+                    ):
+                        offset_id = 0
+                        if is_last_saved_period:
+                            # Get the offset in case collection was unexpectedly interrupted
+                            # while writing for this time range.
+                            last_message_saved = cg.utils.read_nth_to_last_line(
+                                messages_save_path
+                            )
+                            # Check if not empty file before reading message
+                            if last_message_saved:
+                                offset_id = cg.json.read_message(last_message_saved).id
 
-                    # Save messages, don't get to avoid overflowing memory.
-                    client.loop.run_until_complete(
-                        cg.messages.save_channel_messages(
-                            client,
-                            input_chat,
-                            dt_from,
-                            dt_to,
-                            chunk_fwds,
-                            anonymiser.anonymise,
-                            messages_save_path,
-                            media_save_path,
-                            offset_id=offset_id,
-                        )
-                    )
-                    anonymiser.save_map()
-                    new_fwds = chunk_fwds.difference(forwarded_chans.keys())
-                    for i in new_fwds:
-                        try:
-                            _, full_chat_d = cgc.get_full(
+                        # Save messages, don't get to avoid overflowing memory.
+                        client.loop.run_until_complete(
+                            cg.messages.save_channel_messages(
                                 client,
-                                paths,
-                                anonymiser,
-                                key_name,
-                                channel_id=i,
+                                input_chat,
+                                dt_from,
+                                dt_to,
+                                chunk_fwds,
+                                anonymiser.anonymise,
+                                messages_save_path,
+                                media_save_path,
+                                offset_id=offset_id,
+                                forwards_index_path=chan_paths.forwards_index,
                             )
-                        except ChannelPrivateError:
-                            # These channels are valid and have been seen for sure,
-                            # might be private though.
-                            full_chat_d = {}
-                        except (ChannelInvalidError, ValueError):
-                            # This should happen extremely rarely, still haven't figured
-                            # out conditions under which it does.
-                            full_chat_d = {}
-                            logger.error(f"new forward {i} of {channel_id} invalid?")
+                        )
+                        anonymiser.save_map()
+                        new_fwds = chunk_fwds.difference(forwarded_chans.keys())
+                        new_fwd_full_ds = {}
+                        for i in new_fwds:
+                            try:
+                                _, full_chat_d = cgc.get_full(
+                                    client,
+                                    paths,
+                                    anonymiser,
+                                    key_name,
+                                    channel_id=i,
+                                )
+                            except ChannelPrivateError:
+                                # These channels are valid and have been seen for sure,
+                                # might be private though.
+                                full_chat_d = {}
+                            except (ChannelInvalidError, ValueError):
+                                # This should happen extremely rarely, still haven't figured
+                                # out conditions under which it does.
+                                full_chat_d = {}
+                                logger.error(
+                                    f"new forward {i} of {channel_id} invalid?"
+                                )
 
-                        forwarded_chans[i] = cgc.get_explo_priority(
-                            full_chat_d,
-                            anonymiser,
-                            **get_prio_kwargs,
+                            new_fwd_full_ds[i] = full_chat_d
+                        forwarded_chans.update(
+                            cgc.get_explo_priorities(
+                                new_fwd_full_ds, anonymiser, **get_prio_kwargs
+                            )
                         )
 
-                    output_channel_full_d["forwards_from"] = list(
-                        {
-                            anonymiser.anonymise(c, safe=True)
-                            for c in set(forwarded_chans.keys())
-                        }.union(output_channel_full_d["forwards_from"])
-                    )
-                    anonymiser.save_map()
-                    cgc.save(output_channel_full_d, paths, key_name)
+                        output_channel_full_d["forwards_from"] = list(
+                            {
+                                anonymiser.anonymise(c, safe=True)
+                                for c in set(forwarded_chans.keys())
+                            }.union(output_channel_full_d["forwards_from"])
+                        )
+                        anonymiser.save_map()
+                        cgc.save(output_channel_full_d, paths, key_name)
 
-            # What new channels should we explore?
-            new_channels = {**new_channels, **forwarded_chans, **recommended_chans}
-            new_channels = {
-                k: p for k, p in new_channels.items() if p < private_chans_priority
-            }
-            processed_channels.add(channel_id)
-            nr_processed_channels += 1
+                # What new channels should we explore?
+                new_channels = {**new_channels, **forwarded_chans, **recommended_chans}
+                new_channels = {
+                    k: p for k, p in new_channels.items() if p < private_chans_priority
+                }
+                processed_channels.add(channel_id)
+                nr_processed_channels += 1
 
-        for c in set(new_channels.keys()).difference(processed_channels):
-            channels_queue.put((new_channels[c], c))
-        nr_remaining_channels = channels_queue.qsize()
-        logger.info(
-            f"{nr_processed_channels} channels already processed, {nr_remaining_channels} to go"
-        )
+            for c in set(new_channels.keys()).difference(processed_channels):
+                channels_queue.put((new_channels[c], c))
+            nr_remaining_channels = channels_queue.qsize()
+            logger.info(
+                f"{nr_processed_channels} channels already processed, {nr_remaining_channels} to go"
+            )
+    finally:
+        metrics_exporter.stop()
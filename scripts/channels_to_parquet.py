@@ -1,87 +1,61 @@
-import datetime
-import json
-import re
-from pathlib import Path
-from pprint import pprint
-
-import fsspec
 import polars as pl
 import setup
 from tqdm import tqdm
 
 import collegram
-from collegram.paths import ChannelPaths, ProjectPaths
-
-
-def yield_chan(
-    chan_ids: set[str],
-    user_schema: dict,
-    project_paths: ProjectPaths,
-    fs: fsspec.AbstractFileSystem,
-):
-    for i in chan_ids:
-        chan_paths = ChannelPaths(i, project_paths)
-        c = json.loads(fs.read_text(chan_paths.channel))
-        if "last_queried_at" not in c:
-            c["last_queried_at"] = fs.modified(chan_paths.channel)
-        participants = c.pop("participants", None)
-        if participants:
-            users_df = pl.DataFrame(
-                map(collegram.users.flatten_dict, participants), schema=user_schema
-            )
-            with fs.open(chan_paths.users_table, "wb") as f:
-                users_df.write_parquet(f)
-        yield c
-
-
-def has_been_modified_since(
-    anon_chan_id: str,
-    since: datetime.datetime,
-    project_paths: ProjectPaths,
-    fs: fsspec.AbstractFileSystem,
-):
-    chan_paths = ChannelPaths(anon_chan_id, project_paths)
-    return fs.modified(chan_paths.channel) > since
-
+from collegram.paths import ProjectPaths
 
 if __name__ == "__main__":
     fs = collegram.utils.LOCAL_FS
     paths = ProjectPaths()
     logger = setup.init_logging(paths.proj / "scripts" / __file__)
-    dummy_chan_paths = ChannelPaths("id", paths)
-    fs.mkdirs(dummy_chan_paths.users_table.parent, exist_ok=True)
-    fs.mkdirs(paths.channels_table.parent, exist_ok=True)
-
-    chans = list(fs.ls(dummy_chan_paths.channel.parent))
-
-    user_schema = collegram.users.get_pl_schema()
-    chan_schema = collegram.channels.get_pl_schema()
-    anon_chan_ids_to_add = set(
-        [p.stem for p in dummy_chan_paths.channel.parent.iterdir()]
+    # Number of worker processes, None to use all CPUs.
+    nr_workers = None
+
+    # Take the journal first, so that the channels saved while the dataset is built
+    # from scratch are also converted on the next run.
+    anon_ids, rotated_journals = collegram.parquet.take_channels_journal(paths, fs)
+    datasets = [paths.channels_dataset, paths.users_dataset, paths.memberships_dataset]
+    if not all(fs.exists(p) for p in datasets):
+        logger.info("Building channels and users datasets from all channels")
+        anon_ids = sorted(collegram.channels.yield_saved_ids(paths, fs=fs))
+
+    partitions = collegram.parquet.group_by_partition(anon_ids)
+    metrics_exporter = collegram.metrics.PeriodicExporter(
+        paths.metrics / "channels_to_parquet.prom", fs=fs
     )
-    if paths.channels_table.exists():
-        table_saved_at = fs.modified(paths.channels_table)
-        anon_chan_ids_to_add = set(
-            filter(
-                lambda i: has_been_modified_since(i, table_saved_at, paths, fs),
-                anon_chan_ids_to_add,
-            )
+    with tqdm(total=len(anon_ids)) as pbar, metrics_exporter:
+        summary, reports = collegram.parquet.map_channels(
+            collegram.parquet.upsert_channels_partition,
+            partitions,
+            nr_workers=nr_workers,
+            progress=lambda r: pbar.update(len(r.item)),
+            project_paths=paths,
+            fs=fs,
         )
-        chans_df = pl.read_parquet(fs.open(paths.channels_table, "rb").read()).filter(
-            ~pl.col("id").is_in(anon_chan_ids_to_add)
+    users_dfs = [r.result for r in reports if r.result is not None]
+    if len(users_dfs) > 0:
+        nr_partitions = collegram.parquet.upsert_users(
+            pl.concat(users_dfs, how="diagonal_relaxed"), paths, fs=fs
         )
-    else:
-        chans_df = pl.DataFrame(schema=chan_schema)
-
-    new_chans_df = pl.DataFrame(
-        map(
-            collegram.channels.flatten_dict,
-            tqdm(
-                yield_chan(anon_chan_ids_to_add, user_schema, paths, fs),
-                total=len(anon_chan_ids_to_add),
-            ),
-        ),
-        schema=chan_schema,
+        logger.info(f"Updated {nr_partitions} partitions of the users dataset")
+    failed_ids = [i for ids in summary.failed_items for i in ids]
+    logger.info(
+        f"Upserted {summary.nr_rows} channels in {summary.nr_items} partitions. "
+        f"{len(failed_ids)} channels failed: {failed_ids}"
     )
-    all_chans_df = pl.concat([chans_df, new_chans_df], how="diagonal").unique("id")
-    all_chans_df.write_parquet(fs.open(paths.channels_table, "wb"))
+
+    # The graph is built along the channels dataset, so that only the out-edges of
+    # updated channels are replaced.
+    if fs.exists(paths.graph) and fs.exists(paths.channels_dataset):
+        graph = collegram.graph.ChannelGraph.load(paths.graph, fs=fs)
+        graph.update_channels(anon_ids, paths, fs=fs)
+    else:
+        graph = collegram.graph.ChannelGraph.from_project(paths, fs=fs)
+    graph.save(paths.graph, fs=fs)
+    logger.info(f"Channel graph has {graph.nr_nodes} nodes and {graph.nr_edges} edges")
+
+    # Failed channels are put back in the journal to be retried on the next run.
+    collegram.channels.append_to_journal(failed_ids, paths.channels_journal, fs=fs)
+    for p in rotated_journals:
+        fs.rm(p)
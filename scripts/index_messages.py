@@ -0,0 +1,35 @@
+import setup
+from tqdm import tqdm
+
+import collegram
+
+if __name__ == "__main__":
+    fs = collegram.utils.LOCAL_FS
+    paths = collegram.paths.ProjectPaths()
+    logger = setup.init_logging(paths.proj / "scripts" / __file__)
+    # Number of worker processes, None to use all CPUs.
+    nr_workers = None
+
+    anon_ids = [
+        p.split("channel_id=")[-1]
+        for p in fs.glob(str(paths.messages_dataset / "channel_id=*"))
+    ]
+    with tqdm(total=len(anon_ids)) as pbar:
+        summary, _ = collegram.parquet.map_channels(
+            collegram.fulltext.index_channel,
+            anon_ids,
+            nr_workers=nr_workers,
+            progress=lambda _: pbar.update(),
+            project_paths=paths,
+            fs=fs,
+        )
+    logger.info(
+        f"Indexed {summary.nr_files} bins with {summary.nr_rows} terms from "
+        f"{summary.nr_items} channels. "
+        f"{len(summary.failed_items)} channels failed: {summary.failed_items}"
+    )
+
+    # Only rebuild the dictionary of all terms if the index changed.
+    if summary.nr_files > 0 or not fs.exists(str(paths.fulltext_terms)):
+        nr_rows = collegram.fulltext.build_term_dictionary(paths, fs=fs)
+        logger.info(f"Built the term dictionary with {nr_rows} terms of segments")
@@ -14,16 +14,13 @@ if __name__ == "__main__":
     script_path = paths.proj / "scripts" / __file__
     logger = setup.init_logging(script_path)
 
-    anon_maps_path = paths.raw_data / "anon_maps"
     base_anon = collegram.utils.HMAC_anonymiser()
+    it = (
+        collegram.paths.ChannelPaths(anon_id, paths).anon_map
+        for anon_id in paths.yield_channel_ids(paths.anon_maps_dir)
+    )
     if save_path.exists():
-        it = [
-            p
-            for p in anon_maps_path.iterdir()
-            if p.lstat().st_mtime > save_path.lstat().st_mtime
-        ]
-    else:
-        it = anon_maps_path.iterdir()
+        it = [p for p in it if p.lstat().st_mtime > save_path.lstat().st_mtime]
     out_d = {}
     for i, p in enumerate(it):
         logger.info(str(i))
@@ -49,4 +46,8 @@ if __name__ == "__main__":
         if r[0] is not None and base_anon.anonymise(r[0]) != r[1]:
             logger.error("values do not match anonymiser")
             breakpoint()
-    anon_map_df.write_parquet(save_path)
+    collegram.parquet.write_parquet(
+        anon_map_df,
+        save_path,
+        profile=collegram.parquet.ParquetWriteProfile(sort_by=("hash",)),
+    )
@@ -0,0 +1,35 @@
+import setup
+from lingua import LanguageDetectorBuilder
+from tqdm import tqdm
+
+import collegram
+
+if __name__ == "__main__":
+    fs = collegram.utils.LOCAL_FS
+    paths = collegram.paths.ProjectPaths()
+    logger = setup.init_logging(paths.proj / "scripts" / __file__)
+    # Messages with fewer characters once cleaned get no language.
+    min_nr_chars = 20
+    lang_detector = LanguageDetectorBuilder.from_all_languages().build()
+
+    anon_ids = [
+        p.split("channel_id=")[-1]
+        for p in fs.glob(str(paths.messages_dataset / "channel_id=*"))
+    ]
+    # The detector already runs on all CPUs, so channels are processed one at a time.
+    with tqdm(total=len(anon_ids)) as pbar:
+        summary, _ = collegram.parquet.map_channels(
+            collegram.parquet.convert_channel_message_langs,
+            anon_ids,
+            nr_workers=1,
+            progress=lambda _: pbar.update(),
+            project_paths=paths,
+            lang_detector=lang_detector,
+            min_nr_chars=min_nr_chars,
+            fs=fs,
+        )
+    logger.info(
+        f"Detected the languages of {summary.nr_rows} messages in {summary.nr_files} "
+        f"bins from {summary.nr_items} channels. "
+        f"{len(summary.failed_items)} channels failed: {summary.failed_items}"
+    )
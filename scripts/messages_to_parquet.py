@@ -1,144 +1,48 @@
-from pathlib import Path
-
-import msgspec
-import polars as pl
 import setup
 from tqdm import tqdm
 
 import collegram
 
-
-def read_messages(fpath, chan_paths):
-    messages = []
-    for m in collegram.json.yield_message(fpath):
-        # For backwards compatibility, ignore comments, marked with non-null
-        # `comments_msg_id.` Could also go back to historical raw data to
-        # remove all of these messages.
-        if isinstance(m, collegram.json.Message) and m.comments_msg_id is None:
-            messages.append(m)
-        else:
-            with open(chan_paths.messages_service_jsonl, "ab") as f:
-                f.write(msgspec.json.encode(m))
-                f.write(b"\n")
-    return messages
-
-
 if __name__ == "__main__":
     fs = collegram.utils.LOCAL_FS
     paths = collegram.paths.ProjectPaths()
     logger = setup.init_logging(paths.proj / "scripts" / __file__)
-    dummy_chan_paths = collegram.paths.ChannelPaths("id", paths)
-    fs.mkdirs(dummy_chan_paths.messages_table.parent, exist_ok=True)
-    fs.mkdirs(dummy_chan_paths.messages_service_jsonl.parent, exist_ok=True)
-
-    schema = collegram.json.get_pl_schema()
-    # Casting struct with fields to generic struct fails, so:
-    cast_schema = {k: v for k, v in schema.items() if v != pl.Struct}
-    chans = sorted(fs.ls(dummy_chan_paths.messages.parent))
-    for channel_dir in tqdm(chans):
-        channel_dir = Path(channel_dir)
-        anon_id = channel_dir.stem
-        chan_paths = collegram.paths.ChannelPaths(anon_id, paths)
-
-        saved = fs.exists(chan_paths.messages_table) and fs.exists(
-            chan_paths.messages_service_jsonl
+    # Whether to save reactions in their own long-format table, instead of as a struct
+    # column in the messages table.
+    reactions_as_table = False
+    # Number of worker processes, None to use all CPUs.
+    nr_workers = None
+    # Maximum memory, in bytes, each worker can use. None for no limit.
+    max_memory_per_worker = None
+
+    anon_ids = list(paths.yield_channel_ids(paths.messages_dir, fs=fs))
+    metrics_exporter = collegram.metrics.PeriodicExporter(
+        paths.metrics / "messages_to_parquet.prom", fs=fs
+    )
+    with tqdm(total=len(anon_ids)) as pbar, metrics_exporter:
+        summary, _ = collegram.parquet.map_channels(
+            collegram.parquet.convert_channel_messages,
+            anon_ids,
+            nr_workers=nr_workers,
+            max_memory_per_worker=max_memory_per_worker,
+            progress=lambda _: pbar.update(),
+            project_paths=paths,
+            fs=fs,
+            reactions_as_table=reactions_as_table,
         )
-        last_saved_at = None
-        if saved:
-            last_saved_at = max(
-                fs.modified(chan_paths.messages_table),
-                fs.modified(chan_paths.messages_service_jsonl),
-            )
-            try:
-                saved_df = pl.read_parquet(
-                    fs.open(chan_paths.messages_table, "rb").read()
-                ).cast(cast_schema)
-            except pl.ColumnNotFoundError:
-                print(f"missing column in df saved for {anon_id}, replacing")
-                saved = False
-
-        messages = []
-        for fpath in fs.glob(str(channel_dir / "*.jsonl")):
-            if not saved or fs.modified(fpath) > last_saved_at:
-                try:
-                    chunk_msgs = read_messages(fpath, chan_paths)
-                except msgspec.DecodeError:
-                    lines = []
-                    with fs.open(str(fpath), "r") as f:
-                        for li in f:
-                            li = li.strip("\n")
-                            if li:
-                                for p in li.split("}{"):
-                                    if not p.startswith("{"):
-                                        p = "{" + p
-                                    if not p.endswith("}"):
-                                        p = p + "}"
-                                    lines.append(p)
-
-                    with fs.open(str(fpath), "w") as f:
-                        f.write("\n".join(lines))
-                        f.write("\n")
-                    chunk_msgs = read_messages(fpath, chan_paths)
-                messages.extend(chunk_msgs)
-
-        # If nothing new to add, skip to next channel
-        if len(messages) == 0:
-            print(f"skipping {anon_id}")
-            continue
-
-        input_d = collegram.json.messages_to_dict(messages)
-        reactions = input_d.pop("reactions")
-        m_df = pl.DataFrame(input_d, schema=cast_schema).with_columns(
-            reactions=pl.Series(reactions)
-        )
-
-        if saved:
-            saved_has_reactions = saved_df.get_column("reactions").dtype == pl.Struct
-            m_has_reactions = m_df.get_column("reactions").dtype == pl.Struct
-            if m_has_reactions or saved_has_reactions:
-                # New reactions may have been added, or some removed, so get the union
-                # of set of reactions as struct keys, filling with nulls
-                reactions_schema = {
-                    **(
-                        saved_df.get_column("reactions").struct.schema
-                        if saved_has_reactions
-                        else {}
-                    ),
-                    **(
-                        m_df.get_column("reactions").struct.schema
-                        if m_has_reactions
-                        else {}
-                    ),
-                }
-                m_df = (
-                    pl.concat(
-                        [
-                            saved_df.unnest("reactions")
-                            if saved_has_reactions
-                            else saved_df.drop("reactions"),
-                            m_df.unnest("reactions")
-                            if m_has_reactions
-                            else m_df.drop("reactions"),
-                        ],
-                        how="diagonal",
-                    )
-                    .select(
-                        *set(saved_df.columns)
-                        .union(m_df.columns)
-                        .difference(["reactions"]),
-                        reactions=pl.struct(*reactions_schema.keys()),
-                    )
-                    .unique("id")
-                )
-            else:
-                m_df = pl.concat(
-                    [
-                        saved_df,
-                        m_df,
-                    ],
-                    how="diagonal",
-                ).unique("id")
-
-        print(f"saving {anon_id}")
-        with fs.open(chan_paths.messages_table, "wb") as f:
-            m_df.select(sorted(m_df.columns)).write_parquet(f)
+    logger.info(
+        f"Converted {summary.nr_files} bins with {summary.nr_rows} messages from "
+        f"{summary.nr_items} channels, recovered {summary.nr_recovered} messages and "
+        f"quarantined {summary.nr_bad} bad records. "
+        f"{len(summary.failed_items)} channels failed: {summary.failed_items}"
+    )
+
+    # Aggregated from the counts of every channel, updated during the conversion.
+    domains_df = collegram.dataset.get_domain_counts(paths, fs=fs).collect()
+    collegram.parquet.write_parquet(
+        domains_df,
+        paths.domains_table,
+        fs=fs,
+        profile=collegram.parquet.ParquetWriteProfile(sort_by=("domain",)),
+    )
+    logger.info(f"Counted links to {domains_df.height} domains")
@@ -0,0 +1,55 @@
+import argparse
+import json
+
+import setup
+from tqdm import tqdm
+
+import collegram
+from collegram.paths import ChannelPaths, ProjectPaths
+from collegram.store import PackedStore
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="Compact the store's shards once channels are packed.",
+    )
+    args = parser.parse_args()
+    fs = collegram.utils.LOCAL_FS
+    # Channels are read from their files even when this is run again after the store
+    # was marked as complete.
+    paths = ProjectPaths(packed_channels=False)
+    logger = setup.init_logging(paths.proj / "scripts" / __file__)
+    # Whether to remove the files of channels once they are packed. Leave to False
+    # while processes started before the store was marked as complete may still read
+    # or save these files.
+    remove_files = False
+    store = PackedStore(paths.channels_store, fs=fs)
+
+    # Migrate from one file per channel. Channels already in the store are skipped,
+    # so that this can be run again after an interruption.
+    anon_ids = list(collegram.channels.yield_saved_ids(paths, fs=fs))
+    nr_packed = 0
+    for anon_id in tqdm(anon_ids):
+        chan_path = ChannelPaths(anon_id, paths).channel
+        if anon_id not in store:
+            with fs.open(str(chan_path), "r") as f:
+                chan_data = json.load(f)
+            store.put(anon_id, chan_data, saved_at=fs.modified(chan_path).timestamp())
+            nr_packed += 1
+        if remove_files:
+            fs.rm(str(chan_path))
+    logger.info(f"Packed {nr_packed} channels out of {len(anon_ids)}")
+    # From now on, `ProjectPaths` defaults to reading and saving channels in the store.
+    fs.touch(str(paths.packed_channels_marker))
+
+    if args.compact:
+        # The store is locked while compacting, so writers in other processes wait for
+        # it to finish.
+        try:
+            nr_reclaimed = store.compact()
+        except FileExistsError:
+            logger.error(f"{store.lock_path} exists, another compaction is running")
+        else:
+            logger.info(f"Compaction reclaimed {nr_reclaimed / 2**20:.1f}MB")
@@ -0,0 +1,33 @@
+import setup
+from tqdm import tqdm
+
+import collegram
+from collegram.paths import ChannelPaths, ProjectPaths
+
+if __name__ == "__main__":
+    fs = collegram.utils.LOCAL_FS
+    flat_paths = ProjectPaths(sharded_dirs=False)
+    sharded_paths = ProjectPaths(sharded_dirs=True)
+    logger = setup.init_logging(flat_paths.proj / "scripts" / __file__)
+
+    # Move the files and directories of every channel from the flat layout to the
+    # sharded one. Shards are skipped when listing, so that this can be run again
+    # after an interruption.
+    attrs_by_root = {
+        flat_paths.anon_maps_dir: "anon_map",
+        flat_paths.channels_dir: "channel",
+        flat_paths.messages_dir: "messages",
+        flat_paths.forwards_dir: "forwards_index",
+        flat_paths.messages_quarantine_dir: "messages_quarantine",
+    }
+    for root, attr in attrs_by_root.items():
+        anon_ids = [i for i in flat_paths.yield_channel_ids(root, fs=fs) if len(i) > 2]
+        for anon_id in tqdm(anon_ids, desc=root.name):
+            src = getattr(ChannelPaths(anon_id, flat_paths), attr)
+            dest = getattr(ChannelPaths(anon_id, sharded_paths), attr)
+            fs.mkdirs(str(dest.parent), exist_ok=True)
+            fs.mv(str(src), str(dest), recursive=True)
+        logger.info(f"Moved {len(anon_ids)} entries of {root} to shards")
+
+    # From now on, `ProjectPaths` defaults to the sharded layout.
+    fs.touch(str(flat_paths.sharded_dirs_marker))
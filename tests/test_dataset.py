@@ -0,0 +1,22 @@
+import fsspec
+import polars as pl
+
+import collegram
+from collegram.dataset import CHANNEL_HIVE_SCHEMA, get_scan_sources, scan_files
+
+
+def test_get_scan_sources_remote():
+    fs = fsspec.filesystem("memory")
+    sources, storage_options = get_scan_sources(["/bucket/a.parquet"], fs=fs)
+    assert sources == ["memory:///bucket/a.parquet"]
+    assert storage_options == {}
+
+
+def test_scan_files_local(tmp_path):
+    fpath = tmp_path / "channel_id=ab" / "month=2024-01" / "a.parquet"
+    collegram.parquet.write_parquet(pl.DataFrame({"id": [1, 2]}), fpath)
+    df = scan_files([str(fpath)], {"id": pl.Int64}, CHANNEL_HIVE_SCHEMA).collect()
+    assert df.to_dicts() == [
+        {"id": 1, "channel_id": "ab", "month": "2024-01"},
+        {"id": 2, "channel_id": "ab", "month": "2024-01"},
+    ]
@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+from telethon.errors import FloodWaitError
+
+from collegram.metrics import MetricsRegistry, TimedPages
+
+
+def get_counts(registry, name="request_seconds"):
+    return {
+        dict(labels)["outcome"]: h.count
+        for labels, h in registry.histograms.get(name, {}).items()
+    }
+
+
+def test_timed_pages():
+    registry = MetricsRegistry()
+    pages = TimedPages(range(25), "request_seconds", page_size=10, registry=registry)
+    assert list(pages) == list(range(25))
+    assert get_counts(registry) == {"ok": 3}
+
+    # Iteration stopped in the middle of a page.
+    registry.clear()
+    for i in TimedPages(range(25), "request_seconds", page_size=10, registry=registry):
+        if i == 14:
+            break
+    assert get_counts(registry) == {"ok": 2}
+
+
+def test_timed_pages_async():
+    async def yield_items(n, exc=None):
+        for i in range(n):
+            yield i
+        if exc is not None:
+            raise exc
+
+    async def collect(pages):
+        return [i async for i in pages]
+
+    registry = MetricsRegistry()
+    pages = TimedPages(
+        yield_items(20), "request_seconds", page_size=10, registry=registry
+    )
+    assert asyncio.run(collect(pages)) == list(range(20))
+    # The last, empty page is observed too.
+    assert get_counts(registry) == {"ok": 3}
+
+    registry.clear()
+    exc = FloodWaitError(request=None, capture=100)
+    pages = TimedPages(
+        yield_items(15, exc),
+        "request_seconds",
+        page_size=10,
+        registry=registry,
+        request="GetHistoryRequest",
+    )
+    with pytest.raises(FloodWaitError):
+        asyncio.run(collect(pages))
+    assert get_counts(registry) == {"ok": 1, "error": 1}
+    assert registry.counters["flood_wait_errors_total"] == {
+        (("request", "GetHistoryRequest"),): 1
+    }
@@ -0,0 +1,50 @@
+import asyncio
+import json
+import time
+
+import collegram
+from collegram.paths import ProjectPaths
+from collegram.search import SearchCache, load_seed_channels, search_seeds
+
+
+def test_search_seeds_failures(tmp_path, monkeypatch):
+    tgdb_query_times = []
+
+    async def search_from_api(client, keyword, limit=100):
+        if keyword == "bad":
+            raise ConnectionError("network")
+        return {len(keyword): 1}
+
+    async def search_from_tgdb(client, keyword):
+        tgdb_query_times.append(time.monotonic())
+        if keyword == "worse":
+            raise ConnectionError("network")
+        return {100 + len(keyword): 2}
+
+    monkeypatch.setattr(collegram.search, "search_from_api", search_from_api)
+    monkeypatch.setattr(collegram.search, "search_from_tgdb", search_from_tgdb)
+    cache = SearchCache(tmp_path / "cache.jsonl")
+    keywords = ["a", "bad", "worse"]
+    channels = asyncio.run(search_seeds(None, keywords, cache, tgdb_min_interval=0.05))
+
+    assert channels == {1: 1, 5: 1, 101: 2, 103: 2}
+    assert ("api", "bad") not in cache
+    assert ("tgdb", "worse") not in cache
+    assert ("tgdb", "bad") in cache
+    assert all(
+        t2 - t1 >= 0.05 for t1, t2 in zip(tgdb_query_times, tgdb_query_times[1:])
+    )
+    # Results are read back, and only failed searches are run again.
+    cache = SearchCache(tmp_path / "cache.jsonl")
+    tgdb_query_times.clear()
+    asyncio.run(search_seeds(None, keywords, cache, tgdb_min_interval=0))
+    assert len(tgdb_query_times) == 1
+
+
+def test_load_seed_channels(tmp_path):
+    paths = ProjectPaths(data=tmp_path)
+    assert load_seed_channels(paths) == {}
+    paths.channels_first_seed.parent.mkdir(parents=True)
+    paths.channels_first_seed.write_text(json.dumps({"1": 10}))
+    SearchCache(paths.seed_search_cache).add("api", "kw", {2: 20})
+    assert load_seed_channels(paths) == {"1": 10, "2": 20}
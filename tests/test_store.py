@@ -0,0 +1,126 @@
+import json
+
+import msgspec
+import pytest
+
+import collegram
+from collegram.paths import ChannelPaths, ProjectPaths
+from collegram.store import IndexEntry, PackedStore
+
+
+def make_doc(key, i=0):
+    return {"id": key, "version": i, "text": "x" * (10 * i)}
+
+
+def test_put_get(tmp_path):
+    store = PackedStore(tmp_path)
+    store.put("aa1", make_doc("aa1"))
+    store.put("ab1", make_doc("ab1"))
+    assert store.get("aa1") == make_doc("aa1")
+    assert store.get("ab1") == make_doc("ab1")
+    assert store.get("aa2") is None
+    assert "aa1" in store
+    assert "aa2" not in store
+    assert sorted(store.keys()) == ["aa1", "ab1"]
+
+
+def test_overwrite(tmp_path):
+    store = PackedStore(tmp_path)
+    for i in range(3):
+        store.put("aa1", make_doc("aa1", i), saved_at=float(i))
+    assert store.get("aa1") == make_doc("aa1", 2)
+    assert store.get_saved_at("aa1").timestamp() == 2.0
+    assert list(store.keys()) == ["aa1"]
+
+
+def test_reopen(tmp_path):
+    store = PackedStore(tmp_path)
+    store.put("aa1", make_doc("aa1"))
+    store.put("aa2", make_doc("aa2"))
+    store.delete("aa2")
+
+    reopened = PackedStore(tmp_path)
+    assert reopened.get("aa1") == make_doc("aa1")
+    assert "aa2" not in reopened
+    # Appends from another instance are seen by an already loaded one.
+    reopened.put("aa3", make_doc("aa3"))
+    assert store.get("aa3") == make_doc("aa3")
+
+
+def test_compact(tmp_path):
+    store = PackedStore(tmp_path)
+    for i in range(3):
+        store.put("aa1", make_doc("aa1", i))
+    store.put("aa2", make_doc("aa2"))
+    store.delete("aa2")
+    assert store.compact() > 0
+    assert store.get("aa1") == make_doc("aa1", 2)
+    assert "aa2" not in store
+    assert len(list(tmp_path.glob("aa*.jsonl"))) == 1
+    assert not store.lock_path.exists()
+
+
+def test_compact_then_append_from_other_instance(tmp_path):
+    a = PackedStore(tmp_path)
+    b = PackedStore(tmp_path)
+    for i in range(5):
+        a.put(f"aa{i}", make_doc(f"aa{i}", i))
+        a.put(f"aa{i}", make_doc(f"aa{i}", i + 1))
+    assert a.get("aa0") == make_doc("aa0", 1)
+
+    b.compact()
+    # Enough appends for the index to get larger than what `a` had read.
+    for i in range(5, 15):
+        b.put(f"aa{i}", make_doc(f"aa{i}", i))
+    for i in range(5):
+        assert a.get(f"aa{i}") == make_doc(f"aa{i}", i + 1)
+    for i in range(5, 15):
+        assert a.get(f"aa{i}") == make_doc(f"aa{i}", i)
+
+
+def test_get_after_compaction_by_other_instance(tmp_path):
+    a = PackedStore(tmp_path)
+    b = PackedStore(tmp_path)
+    a.put("aa1", make_doc("aa1", 1))
+    a.put("aa1", make_doc("aa1", 2))
+    a.load_index("aa")
+    b.compact()
+    # The shard `a` loaded the index of was removed.
+    assert a.get("aa1") == make_doc("aa1", 2)
+
+
+def test_compact_locked(tmp_path):
+    store = PackedStore(tmp_path)
+    store.put("aa1", make_doc("aa1"))
+    with store.lock():
+        with pytest.raises(FileExistsError):
+            PackedStore(tmp_path).compact()
+    assert store.compact() == 0
+
+
+def test_index_without_header(tmp_path):
+    # Indices written before generations were introduced.
+    doc = json.dumps(make_doc("aa1")).encode()
+    (tmp_path / "aa.jsonl").write_bytes(doc + b"\n")
+    (tmp_path / "aa.idx").write_bytes(
+        msgspec.json.encode(IndexEntry("aa1", 0, len(doc), 0.0)) + b"\n"
+    )
+    store = PackedStore(tmp_path)
+    assert store.get("aa1") == make_doc("aa1")
+    store.put("aa2", make_doc("aa2"))
+    store.compact()
+    assert PackedStore(tmp_path).get("aa1") == make_doc("aa1")
+    assert store.get("aa2") == make_doc("aa2")
+
+
+def test_erase(tmp_path):
+    paths = ProjectPaths(data=tmp_path, packed_channels=True)
+    anon_id = "abcdef"
+    chan_data = {"full_chat": {"id": anon_id}, "chats": []}
+    collegram.channels.save(chan_data, paths, None)
+    assert collegram.channels.load(anon_id, paths) == chan_data
+
+    collegram.channels.erase(ChannelPaths(anon_id, paths))
+    assert not collegram.channels.exists(anon_id, paths)
+    assert anon_id not in PackedStore(paths.channels_store)
+    assert list(collegram.channels.yield_saved_ids(paths)) == []